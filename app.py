@@ -1,47 +1,252 @@
 import os
+from datetime import datetime
 
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+import click
+from flask import (Flask, Blueprint, render_template, request, flash,
+                   redirect, session, g, abort, jsonify, current_app)
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.engine import make_url
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import or_
+from werkzeug.local import LocalProxy
+
+from passwords import PasswordHasherBusy
 
 from forms import UserAddForm, LoginForm, MessageForm, EditProfileForm
-from models import db, connect_db, User, Message, Like
+from models import (db, connect_db, User, UserCard, Message, Like,
+                    TimelineEntry)
+from pagination import paginate_by_time
+from feeds import hydrate_messages
+from search import (search_users, create_search_indexes, search_messages,
+                    index_message, unindex_message, reindex_messages)
+from user_cache import UserCache
+from metrics import RequestMetrics
+from profiler import SamplingProfiler
+from fragment_cache import FragmentCache
+from caching import static_url, version_of, not_modified, add_cache_headers
+from migrations import migrate, pending
+from replicas import ReplicaRouter
+from compression import Compressor
+from config import CONFIGS
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
+# most messages one request to /messages/likes may like or unlike
+MAX_LIKE_BATCH = 100
 
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///waddle'))
+# the routes, hooks and commands below; create_app registers them
+views = Blueprint('waddle', __name__, cli_group=None)
+
+
+def current(name):
+    """The current app's extension `name`. Each app create_app builds has
+    its own, so apps with different settings can live side by side."""
+
+    return LocalProxy(lambda: current_app.extensions[name])
+
+
+replica_router = current('replica_router')
+profiler = current('sampling_profiler')
+request_metrics = current('request_metrics')
+user_cache = current('user_cache')
+fragment_cache = current('fragment_cache')
+compressor = current('compressor')
+
+
+def add_extension_metrics(metrics, fragments, router):
+    """Export the fragment cache's and replica router's stats."""
+
+    metrics.add_metric('waddle_fragment_cache_entries', 'gauge',
+                       "Rendered fragments held by this worker.",
+                       lambda: fragments.stats()['size'])
+    for stat in ['hits', 'misses', 'evictions', 'invalidations']:
+        metrics.add_metric(f'waddle_fragment_cache_{stat}_total', 'counter',
+                           f"Fragment cache {stat}.",
+                           lambda stat=stat: fragments.stats()[stat])
+    for outcome, help_text in [
+            ('replica', "GET requests that read from a replica."),
+            ('sticky', "GET requests kept on the primary after the user wrote."),
+            ('lagging', "GET requests kept on the primary as replicas lagged."),
+            ('writes', "Requests that wrote, making their user stick to the "
+                       "primary."),
+    ]:
+        metrics.add_metric(f'waddle_replica_{outcome}_total', 'counter',
+                           help_text,
+                           lambda outcome=outcome: router.stats()[outcome])
+
+
+def create_app(config_name=None):
+    """Build the app with the settings profile `config_name` from
+    config.py, or the one named by WADDLE_CONFIG.
+
+    Each app gets its own caches, router, profiler, metrics and password
+    hasher, which the module-level names such as `user_cache` stand for
+    while it's the current app.
+
+    Nothing here connects to the database: engines are created with empty
+    pools, and connect_db has each forked worker start its own.
+    """
+
+    app = Flask(__name__)
+    app.config.from_object(
+        CONFIGS[config_name or os.environ.get('WADDLE_CONFIG', 'development')])
+
+    if not app.config['SECRET_KEY']:
+        raise RuntimeError("SECRET_KEY must be set")
+
+    urls = [app.config['SQLALCHEMY_DATABASE_URI']] + [
+        bind['url'] for bind in app.config['SQLALCHEMY_BINDS'].values()]
+    if any(make_url(url).get_backend_name() != 'postgresql' for url in urls):
+        raise RuntimeError("Waddle needs Postgres: see config.py")
+
+    connect_db(app)
+
+    # the replica router goes first: the other hooks may query
+    router = ReplicaRouter()
+    router.init_app(app)
+    SamplingProfiler().init_app(app)
+    metrics = RequestMetrics()
+    metrics.init_app(app)
+    UserCache().init_app(app)
+    fragments = FragmentCache()
+    fragments.init_app(app)
+    add_extension_metrics(metrics, fragments, router)
+    # after_request hooks run last registered first, so this compresses
+    # pages once add_cache_headers has set their ETag
+    Compressor().init_app(app)
+
+    if app.config['DEBUG_TOOLBAR']:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    if app.config['JINJA_BYTECODE_CACHE']:
+        directory = (app.config['JINJA_BYTECODE_CACHE_DIR']
+                     or os.path.join(app.instance_path, 'jinja'))
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+    app.register_blueprint(views)
+
+    # Caching: Cache-Control per endpoint (see caching.CACHE_POLICIES), ETag
+    # and Last-Modified where the view computed them, and hashed static URLs
+    app.after_request(add_cache_headers)
+    app.add_template_global(static_url)
+
+    return app
+
+
+@views.cli.command('migrate')
+@click.option('--list', 'list_only', is_flag=True,
+              help="Only list the migrations not yet applied.")
+def run_migrations(list_only):
+    """Apply the schema migrations this database hasn't had yet."""
+
+    if list_only:
+        for migration in pending():
+            print(f"{migration.version:4} {migration.name}")
+        return
+
+    migrate(progress=lambda migration: print(
+        f"applied {migration.version:4} {migration.name}"))
+
+
+@views.cli.command('backfill-timelines')
+def backfill_timelines():
+    """Rebuild every home timeline from the follows and messages tables."""
+
+    TimelineEntry.backfill()
+    db.session.commit()
+
+
+@views.cli.command('repair-counters')
+def repair_counters():
+    """Recompute every user's message, follow and like counts."""
+
+    User.repair_counts()
+    db.session.commit()
+
+
+@views.cli.command('create-search-indexes')
+def add_search_indexes():
+    """Add the trigram indexes used by /users?q= to an existing database."""
+
+    create_search_indexes()
+    db.session.commit()
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = True
-# app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-app.config['PRESERVE_CONTEXT_ON_EXCEPTION'] = False
-# toolbar = DebugToolbarExtension(app)
-if __name__ == '__main__':
-   app.run(debug=True, port=int(os.environ.get("PORT", 5000)))
 
-connect_db(app)
+@views.cli.command('reindex-messages')
+def rebuild_message_index():
+    """Rebuild the message search index from the messages table."""
+
+    reindex_messages()
+    db.session.commit()
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@views.before_app_request
 def add_user_to_g():
-    """If logged in, add curr user to Flask global."""
+    """If logged in, add curr user to Flask global.
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+    Users come from the per-worker user cache, so most requests don't
+    query for them. Static files never need the user.
+    """
+
+    # g outlives the request when an app context was already pushed
+    # (as in the tests), so don't reuse another request's follow index
+    g.pop('following_ids', None)
+
+    if CURR_USER_KEY in session and request.endpoint != 'static':
+        g.user = user_cache.load(session[CURR_USER_KEY])
 
     else:
         g.user = None
 
 
+def get_following_ids():
+    """Ids the current user follows, loaded once per request."""
+
+    if 'following_ids' not in g:
+        g.following_ids = g.user.following_ids() if g.user else set()
+
+    return g.following_ids
+
+
+def load_follow_state(users):
+    """Check which of `users` the current user follows, in one query.
+
+    Pages that know every user they show call this so `viewer_follows`
+    reads only those follows, not all of the viewer's. The viewer has no
+    follow button on their own card, so isn't looked up.
+    """
+
+    among = {u.id for u in users} - {g.user.id if g.user else None}
+    g.following_ids = (g.user.following_ids(among=among)
+                       if g.user and among else set())
+
+
+@views.app_context_processor
+def add_follow_index():
+    """Let templates check follow state against the per-request index."""
+
+    def viewer_follows(user):
+        return user.id in get_following_ids()
+
+    return dict(viewer_follows=viewer_follows)
+
+
+def invalidate_users(*user_ids):
+    """Drop this worker's cached copies of users whose rows just changed.
+
+    Rendered fragments are left: those showing counters are keyed on
+    `updated_at`, so they miss anyway. Profile edits drop them as well.
+    """
+
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+
+
 def do_login(user):
     """Log in user."""
 
@@ -52,10 +257,11 @@ def do_logout(CURR_USER_KEY):
     """Logout user."""
 
     if CURR_USER_KEY in session:
+        user_cache.invalidate(session[CURR_USER_KEY])
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@views.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -91,7 +297,7 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@views.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
@@ -102,6 +308,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # saves the password hash if authenticate upgraded its cost
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -111,7 +319,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@views.route('/logout')
 def logout():
     """Handle logout of user."""
 
@@ -124,65 +332,115 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.route('/users')
+@views.route('/users')
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by username, location
+    and bio, and an 'after' param to get the next page of users.
     """
 
     search = request.args.get('q')
+    after = request.args.get('after')
 
     if not search:
-        users = User.query.all()
+        users, next_cursor = UserCard.directory(after=after)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        users, next_cursor = search_users(search, after=after)
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html',
+                           users=users,
+                           search=search,
+                           next_cursor=next_cursor)
 
 
-@app.route('/users/<int:user_id>')
+@views.route('/users/<int:user_id>')
 def users_show(user_id):
-    """Show user profile."""
+    """Show user profile.
 
-    user = User.query.get_or_404(user_id)
+    Takes a 'before' cursor in the querystring to show older messages.
+    Answers 304 if neither the user nor the viewer changed since the
+    client's copy; posting or deleting changes the user's counts, and
+    liking or following the viewer's.
+    """
+
+    viewer_id = g.user.id if g.user else None
+    row = (db.session
+           .query(User, version_of(viewer_id))
+           .filter(User.id == user_id)
+           .first())
+    if row is None:
+        abort(404)
+
+    user, viewer_updated_at = row
+    response = not_modified(
+        ('user', user.id, user.updated_at, viewer_id, viewer_updated_at),
+        max(user.updated_at, viewer_updated_at or user.updated_at))
+    if response:
+        return response
+
+    load_follow_state([user])
 
     # need to specify order bc
     # user.messages isn't in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    messages, next_cursor = paginate_by_time(
+        Message.query.filter(Message.user_id == user_id),
+        Message.timestamp,
+        Message.id,
+        before=request.args.get('before'))
+
+    liked_ids = hydrate_messages(messages, g.user)
 
+    return render_template('users/show.html',
+                           user=user,
+                           messages=messages,
+                           liked_ids=liked_ids,
+                           next_cursor=next_cursor)
 
-@app.route('/users/<int:user_id>/following')
+
+@views.route('/users/<int:user_id>/following')
 def show_following(user_id):
-    """Show list of people this user is following."""
+    """Show list of people this user is following.
+
+    Takes an 'after' param in the querystring to get the next page."""
 
     if CURR_USER_KEY not in session:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    users, next_cursor = UserCard.following(
+        user_id, after=request.args.get('after', type=int))
+    load_follow_state(users + [user])
 
+    return render_template('users/following.html',
+                           user=user,
+                           users=users,
+                           next_cursor=next_cursor)
 
-@app.route('/users/<int:user_id>/followers')
+
+@views.route('/users/<int:user_id>/followers')
 def users_followers(user_id):
-    """Show list of followers of this user."""
+    """Show list of followers of this user.
+
+    Takes an 'after' param in the querystring to get the next page."""
 
     if CURR_USER_KEY not in session:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    users, next_cursor = UserCard.followers(
+        user_id, after=request.args.get('after', type=int))
+    load_follow_state(users + [user])
 
+    return render_template('users/followers.html',
+                           user=user,
+                           users=users,
+                           next_cursor=next_cursor)
 
-@app.route('/users/follow/<int:follow_id>', methods=['POST'])
+
+@views.route('/users/follow/<int:follow_id>', methods=['POST'])
 def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
@@ -190,14 +448,22 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    if follow_id == g.user.id:
+        flash("You can't follow yourself.", "danger")
+        return redirect(f"/users/{g.user.id}")
+
     followed_user = User.query.get_or_404(follow_id)
     g.user.following.append(followed_user)
+    TimelineEntry.add_author(g.user.id, followed_user.id)
+    User.adjust_counts(g.user.id, following_count=1)
+    User.adjust_counts(followed_user.id, followers_count=1)
     db.session.commit()
+    invalidate_users(g.user.id, followed_user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+@views.route('/users/stop-following/<int:follow_id>', methods=['POST'])
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
@@ -207,12 +473,16 @@ def stop_following(follow_id):
 
     followed_user = User.query.get(follow_id)
     g.user.following.remove(followed_user)
+    TimelineEntry.remove_author(g.user.id, followed_user.id)
+    User.adjust_counts(g.user.id, following_count=-1)
+    User.adjust_counts(followed_user.id, followers_count=-1)
     db.session.commit()
+    invalidate_users(g.user.id, followed_user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@views.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
 
@@ -226,14 +496,17 @@ def profile():
 
         if User.authenticate(g.user.username, form.password.data):
 
-            g.user.username = form.username.data,
-            g.user.email = form.email.data,
-            g.user.image_url = form.image_url.data or User.image_url.default.arg,
-            g.user.header_image_url = form.header_image_url.data,
-            g.user.bio = form.bio.data,
+            g.user.username = form.username.data
+            g.user.email = form.email.data
+            g.user.image_url = form.image_url.data or User.image_url.default.arg
+            g.user.header_image_url = form.header_image_url.data
+            g.user.bio = form.bio.data
             g.user.location = form.location.data
+            g.user.profile_updated_at = datetime.utcnow()
 
             db.session.commit()
+            invalidate_users(g.user.id)
+            fragment_cache.invalidate('user', g.user.id)
             return redirect(f'/users/{g.user.id}')
         else:
             flash("Wrong Password!", "danger")
@@ -242,7 +515,7 @@ def profile():
         return render_template('/users/edit.html', form=form)
 
 
-@app.route('/users/delete', methods=["POST"])
+@views.route('/users/delete', methods=["POST"])
 def delete_user():
     """Delete user."""
 
@@ -254,27 +527,48 @@ def delete_user():
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    user_id = g.user.id
+    User.release_counts(user_id)
     db.session.delete(g.user)
     db.session.commit()
+    fragment_cache.invalidate('user', user_id)
 
-    do_logout()
+    do_logout(CURR_USER_KEY)
 
     return redirect("/signup")
 
 
-@app.route('/users/<int:user_id>/likes')
+@views.route('/users/<int:user_id>/likes')
 def show_likes(user_id):
-    """Shows list of liked messages by user"""
-
-    user_with_likes = User.query.get(user_id)
-
-    return render_template('/users/likes-list.html', user=user_with_likes)
+    """Shows list of liked messages by user, most recently liked first,
+    100 at a time before the 'before' cursor in the querystring."""
+
+    user_with_likes = User.query.get_or_404(user_id)
+
+    rows, next_cursor = paginate_by_time(
+        (db.session
+         .query(Message, Like.created_at)
+         .join(Like, Like.message_id == Message.id)
+         .filter(Like.user_id == user_id)),
+        Like.created_at,
+        Like.message_id,
+        before=request.args.get('before'),
+        key=lambda row: (row.created_at, row.Message.id))
+
+    messages = [row.Message for row in rows]
+    liked_ids = hydrate_messages(messages, g.user)
+
+    return render_template('/users/likes-list.html',
+                           user=user_with_likes,
+                           messages=messages,
+                           liked_ids=liked_ids,
+                           next_cursor=next_cursor)
 
 ##############################################################################
 # Messages routes:
 
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@views.route('/messages/new', methods=["GET", "POST"])
 def messages_add():
     """Add a message:
 
@@ -291,22 +585,74 @@ def messages_add():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
         db.session.add(g.user)
+        db.session.flush()
+        TimelineEntry.fan_out(msg)
+        index_message(msg)
+        User.adjust_counts(g.user.id, messages_count=1)
         db.session.commit()
+        invalidate_users(g.user.id)
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
 
-@app.route('/messages/<int:message_id>', methods=["GET"])
+@views.route('/messages/search')
+def messages_search():
+    """Search message text.
+
+    Takes a 'q' param: words must all appear, `word*` matches a prefix and
+    "quoted words" must appear together. Results are newest first and
+    take a 'before' cursor for older matches.
+    """
+
+    search = request.args.get('q', '')
+
+    messages, next_cursor = search_messages(search,
+                                            before=request.args.get('before'))
+    liked_ids = hydrate_messages(messages, g.user)
+
+    return render_template('messages/search.html',
+                           search=search,
+                           messages=messages,
+                           liked_ids=liked_ids,
+                           next_cursor=next_cursor)
+
+
+@views.route('/messages/<int:message_id>', methods=["GET"])
 def messages_show(message_id):
-    """Show a message."""
+    """Show a message.
 
-    msg = Message.query.get(message_id)
-    return render_template('messages/show.html', message=msg)
+    Messages don't change, so the page only changes with its author or
+    the viewer; answers 304 if neither did since the client's copy.
+    """
+
+    viewer_id = g.user.id if g.user else None
+    row = (db.session
+           .query(Message, User.updated_at, version_of(viewer_id))
+           .join(User, User.id == Message.user_id)
+           .filter(Message.id == message_id)
+           .first())
+    if row is None:
+        abort(404)
+
+    msg, author_updated_at, viewer_updated_at = row
+    response = not_modified(
+        ('message', msg.id, author_updated_at, viewer_id, viewer_updated_at),
+        max(msg.timestamp, author_updated_at,
+            viewer_updated_at or author_updated_at))
+    if response:
+        return response
 
+    liked_ids = hydrate_messages([msg], g.user)
+    load_follow_state([msg.user])
 
-@app.route('/messages/<int:message_id>/delete', methods=["POST"])
+    return render_template('messages/show.html',
+                           message=msg,
+                           liked_ids=liked_ids)
+
+
+@views.route('/messages/<int:message_id>/delete', methods=["POST"])
 def messages_destroy(message_id):
     """Delete a message."""
 
@@ -315,58 +661,104 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
+    TimelineEntry.remove_message(msg.id)
+    unindex_message(msg.id)
+    User.adjust_counts(msg.user_id, messages_count=-1)
+    User.adjust_counts(
+        db.select(Like.user_id).where(Like.message_id == msg.id),
+        likes_count=-1)
+    author_id = msg.user_id
     db.session.delete(msg)
     db.session.commit()
+    invalidate_users(g.user.id, author_id)
+    fragment_cache.invalidate('message', message_id)
 
     return redirect(f"/users/{g.user.id}")
 
 
-@app.route('/messages/<int:id>/like', methods=["POST"])
+@views.route('/messages/<int:id>/like', methods=["POST"])
 def like_message(id):
     """Likes a message, adds to db."""
 
-    message_info = Message.query.get_or_404(id)
+    Message.query.get_or_404(id)
 
     if CURR_USER_KEY not in session:
         flash("Must be logged in to 'like' something.", "danger")
         return redirect("/")
 
-    if message_info.user != g.user.username:
-        new_liked_message = Like(user_id=g.user.id, message_id=id)
-        db.session.add(new_liked_message)
-        db.session.commit()
+    Like.add(g.user.id, [id])
+    db.session.commit()
+    invalidate_users(g.user.id)
 
-        return redirect("/")
+    return redirect("/")
 
 
-@app.route('/messages/<int:message_id>/unlike', methods=["POST"])
+@views.route('/messages/<int:message_id>/unlike', methods=["POST"])
 def unlike_message(message_id):
     """Unikes a message and deletes like from db."""
 
-    message_info = Message.query.get_or_404(message_id)
+    Message.query.get_or_404(message_id)
 
     if CURR_USER_KEY not in session:
         flash("Must be logged in to 'like' something.", "danger")
         return redirect("/")
 
-    if message_info.user != g.user.username:
-        liked_message = Like.query.get_or_404((g.user.id, message_id))
-        db.session.delete(liked_message)
-        db.session.commit()
+    Like.remove(g.user.id, [message_id])
+    db.session.commit()
+    invalidate_users(g.user.id)
+
+    return redirect(request.referrer or "/")
+
+
+@views.route('/messages/likes', methods=["POST", "DELETE"])
+def update_likes():
+    """Like (POST) or unlike (DELETE) a batch of messages.
+
+    Takes a JSON body, {"message_ids": [1, 2, 3]}, and returns the
+    user's new like count, {"likes_count": 7}. Liking a message twice or
+    unliking one that isn't liked changes nothing, so clients can retry.
+
+    Only JSON bodies are accepted: a cross-site form can't send one, so
+    these need no CSRF token.
+    """
+
+    if not request.is_json:
+        return jsonify(error="Expected a JSON body."), 415
+
+    if not g.user:
+        return jsonify(error="Must be logged in to 'like' something."), 401
 
-        return redirect(request.referrer)
+    body = request.get_json(silent=True)
+    message_ids = body.get('message_ids') if isinstance(body, dict) else None
+
+    if (not isinstance(message_ids, list)
+            or not 0 < len(message_ids) <= MAX_LIKE_BATCH
+            or not all(type(message_id) is int for message_id in message_ids)):
+        return jsonify(error=f"message_ids must be a list of 1 to "
+                             f"{MAX_LIKE_BATCH} message ids."), 400
+
+    if request.method == 'POST':
+        likes_count = Like.add(g.user.id, message_ids)
+    else:
+        likes_count = Like.remove(g.user.id, message_ids)
+
+    db.session.commit()
+    invalidate_users(g.user.id)
+
+    return jsonify(likes_count=likes_count)
 
 
 ##############################################################################
 # Homepage and error pages
 
 
-@app.route('/', methods=["GET", "POST"])
+@views.route('/', methods=["GET", "POST"])
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users, or the 100
+      before the 'before' cursor in the querystring
     """
 
     # if CURR_USER_KEY not in session:
@@ -377,43 +769,55 @@ def homepage():
         if form.validate_on_submit():
             msg = Message(text=form.text.data)
             g.user.messages.append(msg)
+            db.session.flush()
+            TimelineEntry.fan_out(msg)
+            index_message(msg)
+            User.adjust_counts(g.user.id, messages_count=1)
             db.session.commit()
+            invalidate_users(g.user.id)
 
             return redirect("/")
 
-        following_ids = [f.id for f in g.user.following]
-
-        messages = (Message
-                    .query
-                    .filter(or_(Message.user_id.in_(following_ids), Message.user_id == g.user.id))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-
-        return render_template('home.html', messages=messages, form=form)
+        # timelines are materialized on write, so this is a single
+        # range read on (user_id, timestamp) rather than a scan of
+        # every followed user's messages
+        messages, next_cursor = paginate_by_time(
+            (Message
+             .query
+             .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+             .filter(TimelineEntry.user_id == g.user.id)),
+            TimelineEntry.timestamp,
+            TimelineEntry.message_id,
+            before=request.args.get('before'))
+
+        liked_ids = hydrate_messages(messages, g.user)
+
+        return render_template('home.html',
+                               messages=messages,
+                               liked_ids=liked_ids,
+                               next_cursor=next_cursor,
+                               form=form)
 
     else:
         return render_template('home-anon.html')
    
 
-@app.errorhandler(404)
+@views.app_errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    # too many logins/signups are already waiting on bcrypt
+    return "Too many sign-ins right now, please try again.", 503, {
+        'Retry-After': '1'}
+
+
+@views.app_errorhandler(404)
 def page_not_found(e):
     # note that we set the 404 status explicitly
     return render_template('404.html'), 404
 
-##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+
+
+# the app `flask run`, gunicorn (app:app) and the tests use
+app = create_app()
+
+if __name__ == '__main__':
+    app.run(debug=True, port=int(os.environ.get("PORT", 5000)))
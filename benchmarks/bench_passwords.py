@@ -0,0 +1,63 @@
+"""Benchmark password checks (logins) per second per core.
+
+Runs bcrypt checks through PasswordHasher at several cost factors, with
+`--workers` processes fed by as many request threads, and reports
+logins per second overall and per worker core.
+
+    python benchmarks/bench_passwords.py --workers 4 --rounds 10 11 12
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import PasswordHasher, hash_password  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="hashing processes (0 runs inline)")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12])
+    parser.add_argument("--logins", type=int, default=64,
+                        help="checks to run at each cost")
+    return parser.parse_args()
+
+
+def run(hasher, pw_hash, logins, threads):
+    # warm the pool so process start-up isn't timed
+    hasher.check(pw_hash, "password")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda _: hasher.check(pw_hash, "password"),
+                      range(logins)))
+    return logins / (time.perf_counter() - start)
+
+
+def main():
+    args = parse_args()
+    cores = max(args.workers, 1)
+
+    print(f"{'rounds':>6}{'workers':>9}{'logins/s':>11}{'per core':>10}")
+
+    for rounds in args.rounds:
+        pw_hash = hash_password("password", rounds)
+        hasher = PasswordHasher(rounds=rounds,
+                                workers=args.workers,
+                                max_pending=args.logins)
+        try:
+            per_second = run(hasher, pw_hash, args.logins, cores)
+        finally:
+            hasher.shutdown()
+
+        print(f"{rounds:>6}{args.workers:>9}{per_second:>11.1f}"
+              f"{per_second / cores:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
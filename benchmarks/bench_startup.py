@@ -0,0 +1,167 @@
+"""Measure cold start time and per-worker memory.
+
+Cold start is the time a fresh Python process takes to import the app and
+build it, as a gunicorn worker without --preload does, and the process's
+peak RSS once it has. Worker memory is read from a gunicorn this script
+starts with gunicorn.conf.py, after each worker has served some requests:
+RSS, PSS (RSS with pages shared between processes split among them) and
+USS (pages only that worker has), from /proc, so Linux only.
+
+    python benchmarks/bench_startup.py --workers 4
+    python benchmarks/bench_startup.py --workers 4 --no-preload
+"""
+
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from http.client import HTTPConnection
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# run in a fresh interpreter: import and build the app, print the seconds
+# that took and the peak RSS in KB
+COLD_START = """
+import resource, sys, time
+start = time.perf_counter()
+module_name, _, expression = sys.argv[1].partition(':')
+module = __import__(module_name)
+eval(expression, vars(module))
+print(time.perf_counter() - start,
+      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--app", default="app:app",
+                        help="what gunicorn runs (default %(default)s)")
+    parser.add_argument("--config", default="production",
+                        help="WADDLE_CONFIG to run with")
+    parser.add_argument("--database-url", default="postgresql:///waddle-bench")
+    parser.add_argument("--runs", type=int, default=10,
+                        help="cold starts to time")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="gunicorn workers (0 skips the memory check)")
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="build the app in each worker, not the master")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests to send before measuring memory")
+    parser.add_argument("--path", default="/users",
+                        help="page to request")
+    return parser.parse_args()
+
+
+def app_env(args):
+    return dict(os.environ, DATABASE_URL=args.database_url,
+                WADDLE_CONFIG=args.config,
+                SECRET_KEY=os.environ.get('SECRET_KEY', 'bench'),
+                WEB_CONCURRENCY=str(args.workers),
+                WEB_PRELOAD=str(int(args.preload)))
+
+
+def cold_starts(args):
+    """(seconds, peak RSS in MB) for each of --runs fresh processes."""
+
+    results = []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, "-c", COLD_START, args.app],
+                             cwd=ROOT, env=app_env(args), check=True,
+                             capture_output=True, text=True).stdout
+        seconds, max_rss = out.split()
+        results.append((float(seconds), int(max_rss) / 1024))
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(args):
+    port = free_port()
+    command = [sys.executable, "-m", "gunicorn",
+               "--config", "gunicorn.conf.py",
+               "--bind", f"127.0.0.1:{port}",
+               "--log-level", "warning",
+               args.app]
+
+    server = subprocess.Popen(command, cwd=ROOT,
+                              env=app_env(args), stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit("gunicorn exited during start-up")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server, port
+        except OSError:
+            time.sleep(0.05)
+
+    server.terminate()
+    raise SystemExit("gunicorn did not start listening")
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def memory(pid):
+    """RSS, PSS and USS of process `pid`, in MB."""
+
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        kb = {key: int(value) for key, value
+              in re.findall(r"^(\w+):\s+(\d+) kB", f.read(), re.M)}
+    return (kb['Rss'] / 1024, kb['Pss'] / 1024,
+            (kb['Private_Clean'] + kb['Private_Dirty']) / 1024)
+
+
+def worker_memory(args):
+    server, port = start_gunicorn(args)
+    try:
+        # every worker should have served something: requests are spread
+        # over them by the kernel, so send plenty
+        for _ in range(args.requests):
+            connection = HTTPConnection("127.0.0.1", port, timeout=30)
+            connection.request("GET", args.path)
+            connection.getresponse().read()
+            connection.close()
+
+        return [memory(pid) for pid in children(server.pid)]
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    args = parse_args()
+
+    starts = cold_starts(args)
+    print(f"cold start ({args.app}, {args.runs} runs): "
+          f"median {statistics.median(s for s, _ in starts) * 1000:.0f}ms, "
+          f"max RSS {statistics.median(rss for _, rss in starts):.1f}MB")
+
+    if not args.workers:
+        return
+
+    workers = worker_memory(args)
+    print(f"gunicorn, {args.workers} workers"
+          f"{'' if args.preload else ' --no-preload'}:")
+    print(f"{'worker':>6}{'RSS MB':>9}{'PSS MB':>9}{'USS MB':>9}")
+    for i, (rss, pss, uss) in enumerate(workers):
+        print(f"{i:>6}{rss:>9.1f}{pss:>9.1f}{uss:>9.1f}")
+    print(f"{'mean':>6}"
+          + "".join(f"{statistics.mean(column):>9.1f}"
+                    for column in zip(*workers)))
+
+
+if __name__ == "__main__":
+    main()
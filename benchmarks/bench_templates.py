@@ -0,0 +1,177 @@
+"""Benchmark template compilation and rendering.
+
+Times compiling every template from source and loading them from a
+Jinja bytecode cache instead, then renders each page template with
+synthetic users and messages, at each of --sizes items per page, and
+reports the median render time and the size of the HTML, as rendered and
+as sent gzipped or Brotli compressed.
+
+    python benchmarks/bench_templates.py --sizes 10 100 1000
+
+Nothing is read from the database. Cached fragments are off unless
+--fragment-cache is given, so every render does the full work; with it,
+the fragments are warmed first, as on a busy worker.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="messages or users per page")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="renders of each template at each size")
+    parser.add_argument("--fragment-cache", action="store_true",
+                        help="serve cached fragments, warmed before timing")
+    return parser.parse_args()
+
+
+def make_users(count, start=1):
+    from models import User
+
+    now = datetime(2024, 1, 1)
+    return [User(id=i, username=f"user{i}", email=f"user{i}@example.com",
+                 image_url="/static/images/default-pic.png",
+                 header_image_url="/static/images/warbler-hero.jpg",
+                 bio=f"Bio of user {i}, who likes to waddle.",
+                 location="Anywhere", updated_at=now,
+                 profile_updated_at=now,
+                 messages_count=i, following_count=i, followers_count=i,
+                 likes_count=i)
+            for i in range(start, start + count)]
+
+
+def make_messages(count, authors):
+    from models import Message
+
+    now = datetime(2024, 1, 1)
+    return [Message(id=i, text=f"Message {i}: " + "waddle " * 15,
+                    timestamp=now - timedelta(minutes=i),
+                    user_id=authors[i % len(authors)].id,
+                    user=authors[i % len(authors)])
+            for i in range(1, count + 1)]
+
+
+def make_cards(count):
+    from models import UserCard
+
+    return [UserCard(user.id, user.username, user.image_url,
+                     user.header_image_url, user.bio)
+            for user in make_users(count, start=1000)]
+
+
+def contexts(size):
+    """(template, context) for each page template, showing `size` items."""
+
+    from forms import MessageForm
+
+    viewer, author = make_users(2)
+    authors = make_users(max(size // 10, 1), start=100)
+    messages = make_messages(size, authors)
+    own_messages = make_messages(size, [author])
+    liked_ids = {message.id for message in messages[::2]}
+
+    return [
+        ('home.html', dict(messages=messages, liked_ids=liked_ids,
+                           next_cursor='cursor', form=MessageForm())),
+        ('users/show.html', dict(user=author, messages=own_messages,
+                                 liked_ids=liked_ids, next_cursor='cursor')),
+        ('users/likes-list.html', dict(user=author, messages=messages,
+                                       liked_ids=liked_ids,
+                                       next_cursor='cursor')),
+        ('messages/search.html', dict(search='waddle', messages=messages,
+                                      liked_ids=liked_ids,
+                                      next_cursor='cursor')),
+        ('users/index.html', dict(users=make_cards(size), search=None,
+                                  next_cursor='cursor')),
+        ('users/followers.html', dict(user=author, users=make_cards(size),
+                                      next_cursor=1)),
+    ], viewer
+
+
+def compile_ms(env, names, bytecode_cache):
+    """Milliseconds to get every template in `names`, none yet loaded."""
+
+    env.bytecode_cache = bytecode_cache
+    env.cache.clear()
+
+    start = time.perf_counter()
+    for name in names:
+        env.get_template(name)
+    return (time.perf_counter() - start) * 1000
+
+
+def render_ms(app, name, context, viewer, repeat):
+    """(median milliseconds, HTML) rendering `name`."""
+
+    from flask import g, render_template
+
+    samples = []
+    for _ in range(repeat):
+        with app.test_request_context('/'):
+            g.user = viewer
+            g.following_ids = set()
+
+            start = time.perf_counter()
+            html = render_template(name, **context)
+            samples.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(samples), html.encode()
+
+
+def main():
+    args = parse_args()
+
+    from app import app
+    from compression import compress
+
+    fragment_cache = app.extensions['fragment_cache']
+    compressor = app.extensions['compressor']
+
+    env = app.jinja_env
+    names = [name for name in env.list_templates()
+             if name.endswith('.html')]
+
+    with tempfile.TemporaryDirectory() as directory:
+        from jinja2 import FileSystemBytecodeCache
+
+        bytecode_cache = FileSystemBytecodeCache(directory)
+        from_source = compile_ms(env, names, None)
+        compile_ms(env, names, bytecode_cache)
+        from_cache = compile_ms(env, names, bytecode_cache)
+
+    print(f"{len(names)} templates: compiled in {from_source:.1f}ms, "
+          f"loaded from bytecode cache in {from_cache:.1f}ms")
+    print()
+
+    fragment_cache.max_size = 10 ** 6 if args.fragment_cache else 0
+    fragment_cache.clear()
+
+    print(f"{'template':<24}{'size':>6}{'ms':>10}{'ms/item':>10}"
+          f"{'KB':>10}{'gzip KB':>10}{'br KB':>10}")
+    for size in args.sizes:
+        # the message form needs a request
+        with app.test_request_context('/'):
+            pages, viewer = contexts(size)
+        for name, context in pages:
+            if args.fragment_cache:
+                render_ms(app, name, context, viewer, 1)
+            ms, html = render_ms(app, name, context, viewer, args.repeat)
+            sizes = [len(html)] + [
+                len(compress(html, encoding, compressor.levels[encoding]))
+                for encoding in ['gzip', 'br']]
+            print(f"{name:<24}{size:>6}{ms:>10.2f}{ms / size:>10.3f}"
+                  + "".join(f"{n / 1024:>10.1f}" for n in sizes))
+
+
+if __name__ == "__main__":
+    main()
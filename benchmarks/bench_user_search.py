@@ -0,0 +1,112 @@
+"""Benchmark /users?q= search with and without the trigram indexes.
+
+Fills a scratch Postgres database with synthetic users, then times
+search_users() for a set of search terms, first with the trigram indexes
+dropped (so every search scans users) and then with them built.
+
+    createdb waddle-bench
+    python benchmarks/bench_user_search.py --users 1000000
+
+This drops and recreates every table in the target database.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LOCATIONS = ["Oakland", "Berlin", "Lagos", "Osaka", "Lima",
+             "Reykjavik", "Hobart", "Ushuaia"]
+
+# a few selective and a few broad terms, plus one short enough that the
+# trigram index can't help
+TERMS = ["a1b2", "ffe0", "c9d", "user_00", "Ushuaia", "hobart", "bio 12ab", "zz"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--database-url",
+                        default=os.environ.get("DATABASE_URL",
+                                               "postgresql:///waddle-bench"))
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="times to run each search term")
+    return parser.parse_args()
+
+
+def load_users(db, count):
+    db.session.execute(db.text("""
+        INSERT INTO users (email, username, password, bio, location)
+        SELECT 'user' || i || '@example.com',
+               'user_' || md5(i::text),
+               'not-a-real-hash',
+               'bio ' || md5((i * 7)::text),
+               (:locations)[1 + i % :location_count]
+        FROM generate_series(1, :count) AS i
+    """), dict(locations=LOCATIONS,
+               location_count=len(LOCATIONS),
+               count=count))
+    db.session.commit()
+    db.session.execute(db.text("ANALYZE users"))
+    db.session.commit()
+
+
+def time_searches(search_users, repeat):
+    timings = {}
+
+    for term in TERMS:
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            search_users(term)
+            samples.append((time.perf_counter() - start) * 1000)
+        timings[term] = statistics.median(samples)
+
+    return timings
+
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+
+    from app import app
+    from models import db
+    from search import (create_search_indexes, drop_search_indexes,
+                        search_users)
+
+    app.app_context().push()
+    db.engine.echo = False
+
+    print(f"loading {args.users:,} users into {args.database_url}")
+    db.drop_all()
+    db.create_all()
+    drop_search_indexes()
+    db.session.commit()
+
+    start = time.perf_counter()
+    load_users(db, args.users)
+    print(f"loaded in {time.perf_counter() - start:.1f}s")
+
+    without_index = time_searches(search_users, args.repeat)
+
+    start = time.perf_counter()
+    create_search_indexes()
+    db.session.commit()
+    db.session.execute(db.text("ANALYZE users"))
+    db.session.commit()
+    print(f"built trigram indexes in {time.perf_counter() - start:.1f}s")
+
+    with_index = time_searches(search_users, args.repeat)
+
+    print()
+    print(f"{'term':<12}{'scan ms':>12}{'trigram ms':>12}{'speedup':>10}")
+    for term in TERMS:
+        before, after = without_index[term], with_index[term]
+        print(f"{term:<12}{before:>12.1f}{after:>12.1f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
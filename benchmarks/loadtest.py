@@ -0,0 +1,556 @@
+"""Drive a realistic traffic mix at Waddle and report latency per route.
+
+Logged-in virtual users load their home feed, view profiles, search
+/users?q=, follow and unfollow, like and unlike, and post. For each route
+the run reports p50/p95/p99 latency, throughput and SQL queries per
+request.
+
+Requests go through app.test_client() in this process, or over HTTP to a
+running server (--url) or to a gunicorn this script starts (--gunicorn).
+SQL counts come from the Server-Timing header the app sends.
+
+    createdb waddle-bench
+    python benchmarks/loadtest.py --seed-users 10000 --seed-messages 100000 \\
+        --seed-follows 500000 --requests 5000 --save-baseline baseline.json
+    python benchmarks/loadtest.py --requests 5000 --baseline baseline.json
+
+The workload can be written out with --record and played back with
+--replay; the first --warmup requests of a log are sent but not measured.
+Follows and likes in a log only make sense against the data they were
+recorded on, so replay against a freshly seeded database.
+
+With --baseline the run exits non-zero if any route got slower than the
+tolerance allows, made more queries or failed more often.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.parse import urlencode, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# relative frequency of each operation in generated traffic
+MIX = {
+    "home": 35,
+    "profile": 20,
+    "search": 10,
+    "follow": 8,
+    "unfollow": 6,
+    "like": 10,
+    "unlike": 6,
+    "post": 5,
+}
+
+# the app reports its SQL as Server-Timing: db;dur=1.2;desc="5 queries"
+QUERIES_RE = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+# p95 may grow this much before it counts as a regression, and by at least
+# MIN_SLOWDOWN_MS, so sub-millisecond noise doesn't fail a run
+TOLERANCE = 0.25
+MIN_SLOWDOWN_MS = 2.0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--database-url",
+                        default=os.environ.get("DATABASE_URL",
+                                               "postgresql:///waddle-bench"))
+    parser.add_argument("--seed-users", type=int,
+                        help="generate and load a dataset this size first "
+                             "(drops every table)")
+    parser.add_argument("--seed-messages", type=int, default=None)
+    parser.add_argument("--seed-follows", type=int, default=None)
+    parser.add_argument("--seed", default="waddle",
+                        help="seed for the dataset and the traffic")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100,
+                        help="requests sent first and left out of results")
+    parser.add_argument("--virtual-users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--url", help="send requests to this server")
+    parser.add_argument("--gunicorn", type=int, metavar="WORKERS",
+                        help="start gunicorn with this many workers and "
+                             "send requests to it")
+    parser.add_argument("--record", help="write the requests to this JSONL file")
+    parser.add_argument("--replay", help="send the requests in this JSONL file")
+    parser.add_argument("--save-baseline", help="write results to this file")
+    parser.add_argument("--baseline", help="compare results with this file")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    return parser.parse_args(argv)
+
+
+##############################################################################
+# Dataset
+
+
+def seed_dataset(args):
+    """Generate CSVs for the requested scale and load them."""
+
+    from loader import load
+
+    users = args.seed_users
+    messages = args.seed_messages if args.seed_messages is not None else users * 10
+    follows = args.seed_follows if args.seed_follows is not None else users * 20
+
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run([sys.executable,
+                        os.path.join(ROOT, "generator", "create_csvs.py"),
+                        "--users", str(users),
+                        "--messages", str(messages),
+                        "--follows", str(min(follows, users * (users - 1))),
+                        "--seed", args.seed,
+                        "--out", directory],
+                       check=True)
+        load(directory)
+
+
+class VirtualUser:
+    """A logged-in user and what it follows and likes, kept current as the
+    generated traffic changes them so every request is valid."""
+
+    def __init__(self, user_id, following, liked):
+        self.id = user_id
+        self.following = following
+        self.liked = liked
+
+
+def load_state(virtual_users, rng):
+    """Pick virtual users and read what the workload needs to know."""
+
+    from models import db, User, Message, Like, Follows
+
+    max_user_id = db.session.query(db.func.max(User.id)).scalar()
+    max_message_id = db.session.query(db.func.max(Message.id)).scalar() or 0
+    if not max_user_id or max_user_id < 2:
+        raise SystemExit("the database needs at least two users; "
+                         "seed it with --seed-users")
+
+    ids = sorted(rng.sample(range(1, max_user_id + 1),
+                            min(virtual_users, max_user_id)))
+    following = defaultdict(set)
+    for followed_id, follower_id in (db.session
+                                     .query(Follows.user_being_followed_id,
+                                            Follows.user_following_id)
+                                     .filter(Follows.user_following_id.in_(ids))):
+        following[follower_id].add(followed_id)
+
+    liked = defaultdict(set)
+    for user_id, message_id in (db.session
+                                .query(Like.user_id, Like.message_id)
+                                .filter(Like.user_id.in_(ids))):
+        liked[user_id].add(message_id)
+
+    usernames = [username for username, in (db.session
+                                             .query(User.username)
+                                             .order_by(User.id)
+                                             .limit(500))]
+
+    return dict(
+        users=[VirtualUser(user_id, following[user_id], liked[user_id])
+               for user_id in ids],
+        max_user_id=max_user_id,
+        max_message_id=max_message_id,
+        terms=sorted({name[:4] for name in usernames if len(name) >= 4}),
+    )
+
+
+##############################################################################
+# Workload
+
+
+def next_request(rng, state):
+    """One request from the traffic mix, as a plain dict for the log."""
+
+    user = rng.choice(state["users"])
+    operation = rng.choices(list(MIX), weights=list(MIX.values()))[0]
+
+    # fall back to the opposite operation when there's nothing to undo
+    if operation == "unfollow" and not user.following:
+        operation = "follow"
+    if operation == "unlike" and not user.liked:
+        operation = "like"
+    if operation == "follow" and len(user.following) >= state["max_user_id"] - 1:
+        operation = "unfollow"
+    if operation == "like" and len(user.liked) >= state["max_message_id"]:
+        operation = "unlike" if user.liked else "post"
+
+    request = dict(route=operation, user_id=user.id, method="POST")
+
+    if operation == "home":
+        request.update(method="GET", path="/")
+
+    elif operation == "profile":
+        profile_id = rng.randint(1, state["max_user_id"])
+        request.update(method="GET", path=f"/users/{profile_id}")
+
+    elif operation == "search":
+        query = urlencode(dict(q=rng.choice(state["terms"])))
+        request.update(method="GET", path=f"/users?{query}")
+
+    elif operation == "follow":
+        while True:
+            followed_id = rng.randint(1, state["max_user_id"])
+            if followed_id != user.id and followed_id not in user.following:
+                break
+        user.following.add(followed_id)
+        request.update(path=f"/users/follow/{followed_id}")
+
+    elif operation == "unfollow":
+        followed_id = rng.choice(sorted(user.following))
+        user.following.discard(followed_id)
+        request.update(path=f"/users/stop-following/{followed_id}")
+
+    elif operation == "like":
+        while True:
+            message_id = rng.randint(1, state["max_message_id"])
+            if message_id not in user.liked:
+                break
+        user.liked.add(message_id)
+        request.update(path=f"/messages/{message_id}/like")
+
+    elif operation == "unlike":
+        message_id = rng.choice(sorted(user.liked))
+        user.liked.discard(message_id)
+        request.update(path=f"/messages/{message_id}/unlike")
+
+    elif operation == "post":
+        request.update(path="/messages/new",
+                       form=dict(text=f"load test post {rng.getrandbits(32):x}"))
+
+    return request
+
+
+def generate_workload(count, rng, state):
+    return [next_request(rng, state) for _ in range(count)]
+
+
+def write_log(path, requests):
+    with open(path, "w") as log:
+        for request in requests:
+            log.write(json.dumps(request) + "\n")
+
+
+def read_log(path):
+    with open(path) as log:
+        return [json.loads(line) for line in log if line.strip()]
+
+
+##############################################################################
+# Clients
+
+
+def sign_in(app, user_ids):
+    """A session cookie and CSRF token for each user, made the way the app
+    would so no bcrypt login is needed."""
+
+    from flask import session
+    from flask_wtf.csrf import generate_csrf
+    from app import CURR_USER_KEY
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    credentials = {}
+
+    for user_id in user_ids:
+        # a fresh app context each time, as generate_csrf caches on g
+        with app.app_context(), app.test_request_context():
+            session[CURR_USER_KEY] = user_id
+            csrf_token = generate_csrf()
+            credentials[user_id] = (serializer.dumps(dict(session)), csrf_token)
+
+    return credentials
+
+
+def request_body(request, credentials):
+    headers = {"Referer": "/"}
+    body = None
+
+    if request.get("user_id") is not None:
+        cookie, csrf_token = credentials[request["user_id"]]
+        headers["Cookie"] = f"session={cookie}"
+        if request["method"] == "POST":
+            body = urlencode(dict(request.get("form", {}), csrf_token=csrf_token))
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+    return headers, body
+
+
+def query_count(server_timing):
+    """The SQL count from the app's Server-Timing header, if it sent one."""
+
+    match = QUERIES_RE.search(server_timing or "")
+    return int(match.group(1)) if match else None
+
+
+class InProcessClient:
+    """Send requests through the Flask test client."""
+
+    def __init__(self, app, credentials):
+        self.app = app
+        self.credentials = credentials
+        self.local = threading.local()
+
+    def send(self, request):
+        if not hasattr(self.local, "client"):
+            self.local.client = self.app.test_client(use_cookies=False)
+
+        headers, body = request_body(request, self.credentials)
+
+        start = time.perf_counter()
+        response = self.local.client.open(request["path"],
+                                          method=request["method"],
+                                          headers=headers,
+                                          data=body)
+        response.get_data()
+        elapsed = time.perf_counter() - start
+        response.close()
+
+        return (response.status_code, elapsed,
+                query_count(response.headers.get("Server-Timing")))
+
+
+class HTTPClient:
+    """Send requests to a running server, one connection per thread."""
+
+    def __init__(self, url, credentials):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.credentials = credentials
+        self.local = threading.local()
+
+    def send(self, request):
+        if not hasattr(self.local, "connection"):
+            self.local.connection = HTTPConnection(self.host, self.port,
+                                                   timeout=60)
+
+        headers, body = request_body(request, self.credentials)
+
+        start = time.perf_counter()
+        try:
+            self.local.connection.request(request["method"], request["path"],
+                                          body=body, headers=headers)
+            response = self.local.connection.getresponse()
+            response.read()
+        except (ConnectionError, OSError):
+            self.local.connection.close()
+            raise
+        elapsed = time.perf_counter() - start
+
+        if response.getheader("Connection", "").lower() == "close":
+            self.local.connection.close()
+
+        return (response.status, elapsed,
+                query_count(response.getheader("Server-Timing")))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(workers, database_url):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn",
+         "--workers", str(workers),
+         "--bind", f"127.0.0.1:{port}",
+         "--log-level", "warning",
+         "app:app"],
+        cwd=ROOT,
+        env=dict(os.environ, DATABASE_URL=database_url),
+        stdout=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit("gunicorn exited during start-up")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.2)
+
+    server.terminate()
+    raise SystemExit("gunicorn did not start listening")
+
+
+##############################################################################
+# Running and reporting
+
+
+def run(client, requests, concurrency=1):
+    """Send `requests`; return (route, status, seconds, queries) per request
+    and the wall-clock time taken."""
+
+    def send(request):
+        status, elapsed, queries = client.send(request)
+        return request["route"], status, elapsed, queries
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        samples = [send(request) for request in requests]
+    else:
+        # requests of one virtual user must keep their order (a follow
+        # before its unfollow), so each user's requests go to one thread
+        lanes = defaultdict(list)
+        for request in requests:
+            lanes[request.get("user_id", 0) % concurrency].append(request)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = [sample
+                       for lane in pool.map(lambda lane: [send(request)
+                                                          for request in lane],
+                                            lanes.values())
+                       for sample in lane]
+
+    return samples, time.perf_counter() - start
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def summarize(samples, wall_seconds):
+    """Per-route latency percentiles (ms), throughput, errors and SQL."""
+
+    by_route = defaultdict(list)
+    for sample in samples:
+        by_route[sample[0]].append(sample)
+
+    results = {}
+    for route, route_samples in sorted(by_route.items()):
+        latencies = sorted(elapsed * 1000 for _, _, elapsed, _ in route_samples)
+        queries = [count for *_, count in route_samples if count is not None]
+        results[route] = dict(
+            count=len(route_samples),
+            errors=sum(1 for _, status, _, _ in route_samples if status >= 500),
+            rps=len(route_samples) / wall_seconds,
+            p50=percentile(latencies, 50),
+            p95=percentile(latencies, 95),
+            p99=percentile(latencies, 99),
+            sql=sum(queries) / len(queries) if queries else None,
+        )
+
+    return results
+
+
+def print_report(results, wall_seconds, total):
+    print(f"{total:,} requests in {wall_seconds:.1f}s "
+          f"({total / wall_seconds:,.1f} req/s)")
+    print(f"{'route':<10}{'count':>7}{'errors':>8}{'req/s':>9}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'sql/req':>9}")
+
+    for route, result in results.items():
+        sql = "-" if result["sql"] is None else f"{result['sql']:.1f}"
+        print(f"{route:<10}{result['count']:>7}{result['errors']:>8}"
+              f"{result['rps']:>9.1f}{result['p50']:>9.1f}"
+              f"{result['p95']:>9.1f}{result['p99']:>9.1f}{sql:>9}")
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Regressions of `results` against `baseline`, as messages."""
+
+    regressions = []
+
+    for route, before in baseline.items():
+        after = results.get(route)
+        if after is None:
+            continue
+
+        limit = max(before["p95"] * (1 + tolerance),
+                    before["p95"] + MIN_SLOWDOWN_MS)
+        if after["p95"] > limit:
+            regressions.append(f"{route}: p95 {after['p95']:.1f}ms, "
+                               f"baseline {before['p95']:.1f}ms")
+
+        if (after["sql"] is not None and before["sql"] is not None
+                and after["sql"] > before["sql"] + 0.5):
+            regressions.append(f"{route}: {after['sql']:.1f} queries per "
+                               f"request, baseline {before['sql']:.1f}")
+
+        if after["errors"] / after["count"] > before["errors"] / before["count"]:
+            regressions.append(f"{route}: {after['errors']} errors, "
+                               f"baseline {before['errors']}")
+
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ["DATABASE_URL"] = args.database_url
+
+    from app import app
+    app.config["WTF_CSRF_TIME_LIMIT"] = None
+
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        if args.seed_users:
+            seed_dataset(args)
+
+        if args.replay:
+            requests = read_log(args.replay)
+        else:
+            state = load_state(args.virtual_users, rng)
+            requests = generate_workload(args.warmup + args.requests, rng, state)
+
+    if args.record:
+        write_log(args.record, requests)
+
+    credentials = sign_in(app, {request["user_id"] for request in requests
+                                if request.get("user_id") is not None})
+
+    server = None
+    if args.gunicorn:
+        server, args.url = start_gunicorn(args.gunicorn, args.database_url)
+
+    try:
+        client = (HTTPClient(args.url, credentials) if args.url
+                  else InProcessClient(app, credentials))
+        run(client, requests[:args.warmup], args.concurrency)
+        samples, wall_seconds = run(client, requests[args.warmup:],
+                                    args.concurrency)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    results = summarize(samples, wall_seconds)
+    print_report(results, wall_seconds, len(samples))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file),
+                                  args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS against", args.baseline, file=sys.stderr)
+            for regression in regressions:
+                print("  " + regression, file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
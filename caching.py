@@ -0,0 +1,116 @@
+"""HTTP caching: conditional GETs for pages and hashed static URLs."""
+
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app, g, request, session, url_for
+
+from models import db, User
+
+# Cache-Control by endpoint. Pages depend on who is logged in, so only the
+# browser may keep them, and must check back before reusing them.
+DEFAULT_CACHE_POLICY = 'private, no-cache'
+CACHE_POLICIES = {
+    'metrics': 'no-store',
+    'waddle.login': 'no-store',
+    'waddle.signup': 'no-store',
+    'waddle.profile': 'no-store',
+    'waddle.update_likes': 'no-store',
+}
+
+# static files requested through static_url carry a content hash, so they
+# can be kept forever; a new version gets a new URL
+STATIC_VERSIONED_POLICY = 'public, max-age=31536000, immutable'
+STATIC_POLICY = 'public, max-age=3600'
+
+static_hashes = {}
+
+
+def static_url(filename):
+    """URL for a static file with a hash of its contents in the query
+    string, e.g. /static/stylesheets/style.css?v=0123456789ab."""
+
+    path = os.path.join(current_app.static_folder, filename)
+    mtime = os.path.getmtime(path)
+
+    cached = static_hashes.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as static_file:
+            digest = hashlib.sha1(static_file.read()).hexdigest()[:12]
+        cached = static_hashes[path] = (mtime, digest)
+
+    return url_for('static', filename=filename, v=cached[1])
+
+
+def version_of(user_id):
+    """A user's updated_at as a scalar subquery, so a page's query can
+    fetch the viewer's version in the same round trip. NULL for None."""
+
+    return (db.select(User.updated_at)
+            .where(User.id == user_id)
+            .scalar_subquery())
+
+
+def not_modified(versions, last_modified):
+    """Check the request's validators against a page's.
+
+    `versions` is everything the rendered page depends on: ids and
+    updated_at stamps. Returns a 304 response when the client's copy is
+    current; otherwise returns None, and the ETag and Last-Modified are
+    added to the page by `add_cache_headers`.
+
+    The ETag is checked first, and If-Modified-Since only without one.
+    Last-Modified is in whole seconds, so a page changed again within the
+    second it was sent would still match its date: a page changed in the
+    last second gets no Last-Modified, and doesn't honour one.
+
+    A page showing flashed messages is never cached, since the flashes
+    aren't part of its versions.
+    """
+
+    if '_flashes' in session:
+        return None
+
+    etag = hashlib.sha1(repr(versions).encode()).hexdigest()
+    last_modified = last_modified.replace(tzinfo=timezone.utc, microsecond=0)
+    if last_modified + timedelta(seconds=1) > datetime.now(timezone.utc):
+        last_modified = None
+    g.validators = (etag, last_modified)
+
+    if request.if_none_match:
+        current = request.if_none_match.contains_weak(etag)
+    else:
+        since = request.if_modified_since
+        current = bool(last_modified and since and last_modified <= since)
+
+    if current:
+        return current_app.response_class(status=304)
+
+    return None
+
+
+def add_cache_headers(response):
+    """Set Cache-Control for the endpoint, and validators if the view
+    computed them."""
+
+    if request.endpoint == 'static':
+        response.headers['Cache-Control'] = (STATIC_VERSIONED_POLICY
+                                             if 'v' in request.args
+                                             else STATIC_POLICY)
+        return response
+
+    response.headers['Cache-Control'] = CACHE_POLICIES.get(
+        request.endpoint, DEFAULT_CACHE_POLICY)
+
+    validators = g.pop('validators', None)
+    if validators and response.status_code in (200, 304):
+        etag, last_modified = validators
+        # weak: the tag is of the versions shown, not the bytes sent, which
+        # differ by compression; a 304 must carry the same tag as the 200
+        response.set_etag(etag, weak=True)
+        if last_modified:
+            response.last_modified = last_modified
+        response.vary.add('Cookie')
+
+    return response
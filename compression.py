@@ -0,0 +1,185 @@
+"""Compress responses with gzip or Brotli, per the client's Accept-Encoding.
+
+Pages and JSON are compressed as they are sent, when they are at least
+COMPRESS_MIN_SIZE bytes (default 500) and of one of COMPRESS_MIMETYPES;
+below that the headers cost more than compression saves.
+
+Static files aren't compressed per request. `flask compress-static` writes
+a .br and a .gz next to each static file that shrinks enough, and requests
+for the file are answered with one of those when the client accepts it.
+Files that are already compressed (PNG, JPEG) are left as they are.
+"""
+
+import gzip
+import mimetypes
+import os
+
+import brotli
+from flask import current_app, request, send_from_directory
+from werkzeug.security import safe_join
+
+COMPRESS_MIMETYPES = [
+    'text/html', 'text/css', 'text/plain', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+]
+
+# most preferred first: Brotli is smaller, gzip is understood everywhere
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# a compressed copy of a static file is only kept if it is at most this
+# share of the original's size
+STATIC_MAX_RATIO = 0.9
+
+
+def compress(data, encoding, level=None):
+    """`data` compressed with 'br' or 'gzip', at `level` or the default."""
+
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if level is None else level)
+
+    return gzip.compress(data, compresslevel=9 if level is None else level,
+                         mtime=0)
+
+
+def accepted_encoding(encodings):
+    """The first of `encodings` the request accepts, or None."""
+
+    for encoding in encodings:
+        if request.accept_encodings[encoding]:
+            return encoding
+
+    return None
+
+
+def compress_static(folder, progress=None):
+    """Write a .br and a .gz of each compressible file under `folder`.
+
+    A copy is only kept if it saves enough; any old copy is removed
+    otherwise. Copies carry their original's modification time, so one
+    left from an older version of the file is never served.
+    `progress` is called with each file's path and the copies written.
+    """
+
+    for directory, _, filenames in os.walk(folder):
+        for filename in filenames:
+            if filename.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+                continue
+
+            mimetype = mimetypes.guess_type(filename)[0]
+            if mimetype not in COMPRESS_MIMETYPES:
+                continue
+
+            path = os.path.join(directory, filename)
+            with open(path, 'rb') as source:
+                data = source.read()
+            mtime = os.stat(path).st_mtime_ns
+
+            written = []
+            for encoding, suffix in ENCODINGS:
+                compressed = compress(data, encoding)
+                if len(compressed) > len(data) * STATIC_MAX_RATIO:
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+                    continue
+
+                with open(path + suffix, 'wb') as copy:
+                    copy.write(compressed)
+                os.utime(path + suffix, ns=(mtime, mtime))
+                written.append(suffix)
+
+            if progress:
+                progress(path, written)
+
+
+class Compressor:
+    """Compress responses and serve precompressed static files.
+
+    Configured from COMPRESS_MIN_SIZE, COMPRESS_MIMETYPES,
+    COMPRESS_GZIP_LEVEL (default 6) and COMPRESS_BR_LEVEL (default 4) by
+    `init_app`. The levels are lower than for static files, which are
+    compressed once, as pages are compressed on every request.
+    """
+
+    def init_app(self, app):
+        app.extensions['compressor'] = self
+        self.min_size = app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        self.mimetypes = set(app.config.setdefault('COMPRESS_MIMETYPES',
+                                                   COMPRESS_MIMETYPES))
+        self.levels = dict(
+            br=app.config.setdefault('COMPRESS_BR_LEVEL', 4),
+            gzip=app.config.setdefault('COMPRESS_GZIP_LEVEL', 6))
+
+        app.after_request(self.compress_response)
+        app.view_functions['static'] = self.send_static
+
+        @app.cli.command('compress-static')
+        def compress_static_files():
+            """Write .br and .gz copies of the static files to serve."""
+
+            compress_static(app.static_folder, progress=lambda path, written:
+                            print(f"{path}: {', '.join(written) or 'skipped'}"))
+
+    def compress_response(self, response):
+        if (response.mimetype not in self.mimetypes
+                or response.direct_passthrough
+                or response.is_streamed):
+            return response
+
+        # a cache between us and the client must keep one copy per encoding
+        response.vary.add('Accept-Encoding')
+
+        if (response.status_code != 200
+                or 'Content-Encoding' in response.headers
+                or len(response.get_data()) < self.min_size):
+            return response
+
+        encoding = accepted_encoding(self.levels)
+        if encoding is None:
+            return response
+
+        response.set_data(compress(response.get_data(), encoding,
+                                   self.levels[encoding]))
+        response.headers['Content-Encoding'] = encoding
+
+        # the compressed body isn't byte for byte the one a strong ETag was
+        # made for, but it still is the same page; pages' own ETags are
+        # weak already (see caching.add_cache_headers)
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+        return response
+
+    def send_static(self, filename):
+        """Flask's static view, answering with a compressed copy of the
+        file when the client accepts one that's up to date."""
+
+        folder = current_app.static_folder
+        max_age = current_app.get_send_file_max_age(filename)
+        mimetype = mimetypes.guess_type(filename)[0]
+
+        path = safe_join(folder, filename)
+        if path and mimetype in self.mimetypes:
+            available = {}
+            for encoding, suffix in ENCODINGS:
+                try:
+                    fresh = (os.stat(path + suffix).st_mtime_ns
+                             == os.stat(path).st_mtime_ns)
+                except (OSError, ValueError):
+                    fresh = False
+                if fresh:
+                    available[encoding] = suffix
+
+            encoding = accepted_encoding(available)
+            if encoding:
+                response = send_from_directory(
+                    folder, filename + available[encoding],
+                    mimetype=mimetype, max_age=max_age)
+                response.headers['Content-Encoding'] = encoding
+                response.vary.add('Accept-Encoding')
+                return response
+
+        response = send_from_directory(folder, filename, max_age=max_age)
+        if mimetype in self.mimetypes:
+            response.vary.add('Accept-Encoding')
+        return response
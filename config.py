@@ -0,0 +1,113 @@
+"""Settings profiles for `create_app`.
+
+WADDLE_CONFIG picks one: development (the default), testing or production.
+Each reads its settings from the environment, with defaults that suit it.
+
+Waddle runs on Postgres only: likes, the loader, migrations and search all
+use its SQL, so DATABASE_URL and the replica URLs must be postgresql:// ones.
+"""
+
+import os
+
+from replicas import replica_binds
+
+
+def engine_options(pre_ping=False):
+    """Connection pool settings, used for the primary and, through
+    `replica_binds`, each replica.
+
+    Every worker process has its own pools, so DB_POOL_SIZE is per worker
+    and should cover its threads: it defaults to WEB_THREADS (see
+    gunicorn.conf.py) when that is set.
+    """
+
+    return dict(
+        pool_size=int(os.environ.get('DB_POOL_SIZE',
+                                     os.environ.get('WEB_THREADS', 5))),
+        max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        pool_pre_ping=bool(int(os.environ.get('DB_POOL_PRE_PING', pre_ping))),
+        pool_recycle=int(os.environ.get('DB_POOL_RECYCLE', -1)),
+    )
+
+
+class Config:
+    """Settings every profile starts from."""
+
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL',
+                                             'postgresql:///waddle')
+
+    # GET requests read from these, comma separated; see replicas.py
+    SQLALCHEMY_BINDS = replica_binds(
+        os.environ.get('REPLICA_DATABASE_URLS', ''), engine_options())
+    REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+    REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG',
+                                           REPLICA_STICKY_SECONDS))
+
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options()
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # statements are counted and timed per request by RequestMetrics; echo
+    # them all only when asked to, as it floods stdout under load
+    SQLALCHEMY_ECHO = bool(int(os.environ.get('SQLALCHEMY_ECHO', 0)))
+    SQL_REPEAT_THRESHOLD = int(os.environ.get('SQL_REPEAT_THRESHOLD', 5))
+
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 10000))
+    # compiled templates are kept here, by default in the instance folder,
+    # so restarted or new workers load them instead of compiling again
+    JINJA_BYTECODE_CACHE = bool(int(os.environ.get('JINJA_BYTECODE_CACHE', 1)))
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR')
+    # smaller pages and JSON go out uncompressed; see compression.py
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))
+
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+    PRESERVE_CONTEXT_ON_EXCEPTION = False
+
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0))
+    PASSWORD_HASH_MAX_PENDING = int(
+        os.environ.get('PASSWORD_HASH_MAX_PENDING', 32))
+
+    # the toolbar is only imported when it's turned on
+    DEBUG_TOOLBAR = False
+
+
+class DevelopmentConfig(Config):
+    DEBUG_TOOLBAR = bool(int(os.environ.get('DEBUG_TOOLBAR', 0)))
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+
+class TestingConfig(Config):
+    """The test databases, never DATABASE_URL, so the tests can't clear
+    a real one. Replica reads are off except in test_replicas."""
+
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL',
+                                             'postgresql:///waddle-test')
+    SQLALCHEMY_BINDS = replica_binds(
+        os.environ.get('TEST_REPLICA_DATABASE_URLS',
+                       'postgresql:///waddle-test-replica'), engine_options())
+    REPLICA_READS = False
+    WTF_CSRF_ENABLED = False
+    JINJA_BYTECODE_CACHE = False
+
+
+class ProductionConfig(Config):
+    """SECRET_KEY must be set. Pooled connections are checked before use,
+    so a database restart or failover costs no failed requests."""
+
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(pre_ping=True)
+    # bcrypt runs beside each worker's threads (see gunicorn.conf.py)
+    # instead of holding the one that took the login
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    SQLALCHEMY_BINDS = replica_binds(
+        os.environ.get('REPLICA_DATABASE_URLS', ''), SQLALCHEMY_ENGINE_OPTIONS)
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
@@ -0,0 +1,37 @@
+"""Helpers for rendering lists of messages."""
+
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import db, User, Like
+
+
+def hydrate_messages(messages, viewer=None):
+    """Batch-load what the message templates need for `messages`.
+
+    Loads every author on the page in one query and attaches it as
+    `msg.user`, so the templates don't lazy-load a user per message.
+
+    Returns the set of ids, out of `messages`, that `viewer` has liked
+    (empty for anonymous viewers). Only the likes for this page are
+    read, not the viewer's whole like history.
+    """
+
+    if not messages:
+        return set()
+
+    author_ids = {msg.user_id for msg in messages}
+    authors = {user.id: user for user in
+               User.query.filter(User.id.in_(author_ids))}
+
+    for msg in messages:
+        set_committed_value(msg, 'user', authors[msg.user_id])
+
+    if viewer is None:
+        return set()
+
+    liked = (db.session
+             .query(Like.message_id)
+             .filter(Like.user_id == viewer.id,
+                     Like.message_id.in_([msg.id for msg in messages])))
+
+    return {message_id for (message_id,) in liked}
@@ -0,0 +1,141 @@
+"""Cache rendered template fragments, keyed on the versions of what they show.
+
+In a template,
+
+    {% cache 'feed-message', msg %} ...markup using msg... {% endcache %}
+
+renders the body once per version of `msg`: its id and its author's id
+and `profile_updated_at`, which only a profile edit changes, so likes,
+follows and new messages don't throw away every fragment of the author's
+messages. A user's fragments show their counters too, and are keyed on
+the user's id and `updated_at`, which any change to the row sets. So a
+changed entity is never served from an old entry. Profile edits and
+deletes also `invalidate` what they change, so dead entries don't take
+up room until the LRU gets to them.
+
+Only viewer-independent markup belongs in a fragment: like and follow
+buttons stay outside.
+"""
+
+from collections import OrderedDict, defaultdict
+from threading import Lock
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from models import User, Message
+
+
+def versions(entity):
+    """(key parts, invalidation tags) for one argument of a cache tag."""
+
+    if isinstance(entity, User):
+        return ('user', entity.id, entity.updated_at), [('user', entity.id)]
+
+    if isinstance(entity, Message):
+        author = entity.user
+        return (('message', entity.id, author.id, author.profile_updated_at),
+                [('message', entity.id), ('user', author.id)])
+
+    return (entity,), []
+
+
+class FragmentCache:
+    """A bounded LRU of rendered fragments, one per worker.
+
+    Holds up to FRAGMENT_CACHE_SIZE fragments (default 10000; 0 turns
+    caching off) and counts hits, misses, evictions and invalidations.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.tagged = defaultdict(set)
+        self.lock = Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def init_app(self, app):
+        app.extensions['fragment_cache'] = self
+        self.max_size = app.config.setdefault('FRAGMENT_CACHE_SIZE', 10000)
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.fragment_cache = self
+
+    def render(self, parts, render_body):
+        """The cached fragment for `parts`, rendering it on a miss."""
+
+        key = ()
+        tags = []
+        for part in parts:
+            part_key, part_tags = versions(part)
+            key += part_key
+            tags += part_tags
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+
+        fragment = render_body()
+
+        if self.max_size:
+            with self.lock:
+                self.entries[key] = (fragment, tags)
+                for tag in tags:
+                    self.tagged[tag].add(key)
+                while len(self.entries) > self.max_size:
+                    self.drop(next(iter(self.entries)))
+                    self.evictions += 1
+
+        return fragment
+
+    def drop(self, key):
+        _, tags = self.entries.pop(key)
+        for tag in tags:
+            self.tagged[tag].discard(key)
+            if not self.tagged[tag]:
+                del self.tagged[tag]
+
+    def invalidate(self, kind, entity_id):
+        """Drop every fragment showing the 'user' or 'message' `entity_id`."""
+
+        with self.lock:
+            for key in list(self.tagged.get((kind, entity_id), ())):
+                self.drop(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tagged.clear()
+
+    def stats(self):
+        with self.lock:
+            return dict(size=len(self.entries),
+                        hits=self.hits,
+                        misses=self.misses,
+                        evictions=self.evictions,
+                        invalidations=self.invalidations)
+
+
+class FragmentCacheExtension(Extension):
+    """The `{% cache part, ... %}...{% endcache %}` tag."""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+
+        return nodes.CallBlock(
+            self.call_method('render_fragment', [nodes.List(parts)]),
+            [], [], body).set_lineno(lineno)
+
+    def render_fragment(self, parts, caller):
+        return self.environment.fragment_cache.render(parts, caller)
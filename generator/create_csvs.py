@@ -1,72 +1,201 @@
-"""Generate CSVs of random data for Waddle."""
+"""Generate CSVs of random data for Waddle.
 
+Output is streamed, so memory stays flat however many rows are asked for,
+and the same --seed always gives the same files (for a given Faker
+version). Image URLs come from the lists in images/, so no network is
+needed.
+
+    python generator/create_csvs.py --users 1000000 --messages 10000000 \\
+        --follows 100000000 --out /tmp/waddle-1m
+"""
+
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import sys
+import time
+from datetime import datetime
+from random import Random
+
 from faker import Faker
-from helpers import get_random_datetime
+
+from helpers import PowerLawSampler, get_random_datetime, load_urls
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
-
-fake = Faker()
-
-# Generate random profile image URLs to use for users
-
-image_urls = [
-    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
-    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
-    for i in range(count)
-]
-
-# Generate random header image URLs to use for users
-
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
-
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+NUM_FOLLOWS = 5000
+
+# "password", hashed once; bcrypt per row would dominate the run
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+# Faker is slow per call, so names, bios, places and message text are
+# drawn from pools made once up front
+POOL_SIZE = 5000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=NUM_USERS)
+    parser.add_argument("--messages", type=int, default=NUM_MESSAGES)
+    parser.add_argument("--follows", type=int, default=NUM_FOLLOWS)
+    parser.add_argument("--seed", default="waddle",
+                        help="same seed, same output")
+    parser.add_argument("--end", type=datetime.fromisoformat,
+                        default=datetime(2024, 1, 1),
+                        help="messages are dated before this (YYYY-MM-DD)")
+    parser.add_argument("--days", type=int, default=730,
+                        help="how many days of messages to generate")
+    parser.add_argument("--exponent", type=float, default=1.0,
+                        help="power-law exponent for follower counts")
+    parser.add_argument("--out", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="directory to write the CSVs to")
+    args = parser.parse_args()
+
+    if args.users < 2 and args.follows:
+        parser.error("follows need at least two users")
+    if args.follows > args.users * (args.users - 1):
+        parser.error("more follows than distinct pairs of users")
+
+    return args
+
+
+def seeded_faker(seed):
+    fake = Faker()
+    fake.seed_instance(seed)
+    return fake
+
+
+def write_csv(path, headers, rows):
+    """Stream `rows` to `path`, reporting progress on stderr."""
+
+    started = time.monotonic()
+    count = 0
+
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(headers)
+        for count, row in enumerate(rows, 1):
+            writer.writerow(row)
+
+    elapsed = time.monotonic() - started
+    print(f"{path}: {count:,} rows in {elapsed:.1f}s", file=sys.stderr)
+
+
+def generate_users(num_users, fake, rng):
+    image_urls = load_urls('profile_images.txt')
+    header_image_urls = load_urls('header_images.txt')
+    names = [fake.user_name() for _ in range(POOL_SIZE)]
+    domains = [fake.free_email_domain() for _ in range(POOL_SIZE)]
+    bios = [fake.sentence() for _ in range(POOL_SIZE)]
+    locations = [fake.city() for _ in range(POOL_SIZE)]
+
+    for i in range(1, num_users + 1):
+        # the row number keeps usernames and emails unique at any scale
+        username = f"{rng.choice(names)}{i}"
+        # ids are written out, as messages and follows refer to them
+        yield [
+            i,
+            f"{username}@{rng.choice(domains)}",
+            username,
+            rng.choice(image_urls),
+            PASSWORD_HASH,
+            rng.choice(bios),
+            rng.choice(header_image_urls),
+            rng.choice(locations),
+        ]
+
+
+def generate_messages(num_messages, num_users, fake, rng, end, days):
+    sentences = [fake.sentence() for _ in range(POOL_SIZE)]
+    # a few users write most of the messages
+    author = PowerLawSampler(num_users, rng)
+
+    for _ in range(num_messages):
+        text = " ".join(rng.choice(sentences) for _ in range(rng.randint(1, 3)))
+        timestamp = get_random_datetime(rng, end, days)
+        yield [
+            text[:MAX_WARBLER_LENGTH],
+            timestamp.strftime('%Y-%m-%d %H:%M:%S.%f'),
+            author(),
+        ]
+
+
+def generate_follows(num_follows, num_users, rng, exponent):
+    """Yield distinct (followed, follower) pairs.
+
+    Who gets followed is drawn from a power law, so follower counts have a
+    long tail. How many users each user follows is exponentially
+    distributed around the mean needed to reach `num_follows`, and never
+    so few that the users left couldn't make up the rest.
+    """
+
+    followed = PowerLawSampler(num_users, rng, exponent)
+    remaining = num_follows
+
+    for follower in range(1, num_users + 1):
+        if not remaining:
+            return
+
+        users_left = num_users - follower + 1
+        if users_left == 1:
+            wanted = remaining
+        else:
+            wanted = round(rng.expovariate(1) * remaining / users_left)
+        # each user can follow at most everyone else, so a shortfall here
+        # must fit in what the users after this one can still follow
+        wanted = max(wanted, remaining - (users_left - 1) * (num_users - 1))
+        wanted = min(wanted, num_users - 1, remaining)
+
+        chosen = set()
+        # the head of the distribution is quickly exhausted for users who
+        # follow a lot; top up uniformly rather than draw forever
+        for _ in range(4 * wanted):
+            if len(chosen) == wanted:
+                break
+            chosen.add(followed())
+            chosen.discard(follower)
+
+        while len(chosen) < wanted:
+            chosen.add(rng.randint(1, num_users))
+            chosen.discard(follower)
+
+        for user_id in sorted(chosen):
+            yield [user_id, follower]
+
+        remaining -= wanted
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.out, exist_ok=True)
+
+    # separate generators per file, so changing one count leaves the
+    # other files as they were
+    write_csv(os.path.join(args.out, 'users.csv'),
+              USERS_CSV_HEADERS,
+              generate_users(args.users,
+                             seeded_faker(f"{args.seed}-users"),
+                             Random(f"{args.seed}-users")))
+
+    write_csv(os.path.join(args.out, 'messages.csv'),
+              MESSAGES_CSV_HEADERS,
+              generate_messages(args.messages, args.users,
+                                seeded_faker(f"{args.seed}-messages"),
+                                Random(f"{args.seed}-messages"),
+                                args.end, args.days))
+
+    write_csv(os.path.join(args.out, 'follows.csv'),
+              FOLLOWS_CSV_HEADERS,
+              generate_follows(args.follows, args.users,
+                               Random(f"{args.seed}-follows"),
+                               args.exponent))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,65 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+import math
+import os
+from bisect import bisect
+from datetime import timedelta
+from itertools import accumulate
 
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images')
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+# relative posting activity for each hour of the day: quiet overnight,
+# a lunchtime bump and an evening peak
+HOURLY_ACTIVITY = [
+    3, 2, 1, 1, 1, 2, 4, 7, 9, 9, 9, 10,
+    11, 10, 9, 9, 10, 11, 13, 15, 16, 15, 11, 6,
+]
+HOURLY_CUM_WEIGHTS = list(accumulate(HOURLY_ACTIVITY))
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
 
-    return datetime.fromtimestamp(random_timestamp)
+def load_urls(file_name):
+    """Read the bundled list of image URLs in images/`file_name`."""
+
+    with open(os.path.join(IMAGES_DIR, file_name)) as urls:
+        return [line.strip() for line in urls if line.strip()]
+
+
+class PowerLawSampler:
+    """Pick user ids 1..n so that popularity follows a power law.
+
+    The user at popularity rank r is picked with weight r ** -exponent.
+    Ranks are shuffled onto ids, so popular users are spread over the
+    id range rather than being the oldest accounts.
+    """
+
+    def __init__(self, n, rng, exponent=1.0):
+        self.rng = rng
+        self.ids = list(range(1, n + 1))
+        rng.shuffle(self.ids)
+        self.cum_weights = list(accumulate(
+            (rank ** -exponent for rank in range(1, n + 1))))
+        self.total = self.cum_weights[-1]
+
+    def __call__(self):
+        rank = bisect(self.cum_weights, self.rng.random() * self.total)
+        return self.ids[min(rank, len(self.ids) - 1)]
+
+
+def get_random_datetime(rng, end, days=730, growth=2.0):
+    """Get a random datetime in the `days` before `end`.
+
+    Activity grows exponentially over the window (`growth` is the log of
+    how many times busier the last day is than the first) and follows
+    HOURLY_ACTIVITY through the day.
+    """
+
+    # inverse CDF of a density proportional to e ** (growth * t), t in [0, 1)
+    t = math.log1p(rng.random() * math.expm1(growth)) / growth
+    day = min(int(t * days), days - 1)
+    hour = bisect(HOURLY_CUM_WEIGHTS, rng.random() * HOURLY_CUM_WEIGHTS[-1])
+
+    start_of_day = end.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    return start_of_day - timedelta(days=days - day) + timedelta(
+        hours=hour,
+        seconds=rng.random() * 3600)
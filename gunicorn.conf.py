@@ -0,0 +1,25 @@
+"""gunicorn settings: gunicorn -c gunicorn.conf.py app:app
+
+The app is built once in the master (WEB_PRELOAD=0 builds it in each
+worker instead) and forked into WEB_CONCURRENCY workers of WEB_THREADS
+threads each. Workers start with empty connection pools (see
+models.connect_db), sized for their threads (see config.engine_options).
+"""
+
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2 * (os.cpu_count() or 1) + 1))
+# threads let a worker serve other requests while one waits on the
+# database or on a password hash (see passwords.py)
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+preload_app = bool(int(os.environ.get('WEB_PRELOAD', 1)))
+
+
+def when_ready(server):
+    # Everything loaded so far lives as long as the workers do. Freezing it
+    # keeps the collector from touching it in the workers, where writing
+    # its bookkeeping would copy each page they share with the master.
+    gc.freeze()
@@ -0,0 +1,191 @@
+"""Stream the generator CSVs into the database in resumable chunks.
+
+Each chunk goes in with `COPY ... FROM STDIN` and is committed together
+with a checkpoint of how many rows of its file are loaded, so a load
+that dies part way can be resumed without duplicating rows.
+
+Secondary indexes are dropped for the load and built once at the end,
+which is far cheaper than updating them row by row.
+"""
+
+import csv
+import io
+import os
+import sys
+import time
+
+from migrations import stamp
+from models import db, User, TimelineEntry
+from search import create_search_indexes, drop_search_indexes, reindex_messages
+
+CHUNK_ROWS = 50_000
+
+# in dependency order: follows and messages point at users
+SEED_FILES = [
+    ('users', 'users.csv'),
+    ('messages', 'messages.csv'),
+    ('follows', 'follows.csv'),
+]
+
+checkpoints = db.Table(
+    'load_checkpoints',
+    db.Column('path', db.Text, primary_key=True),
+    db.Column('rows_loaded', db.BigInteger, nullable=False),
+)
+
+
+def report(path, rows, started):
+    """Default progress callback: print rows loaded and the rate."""
+
+    elapsed = time.monotonic() - started
+    rate = rows / elapsed if elapsed else 0
+    print(f"{path}: {rows:,} rows ({rate:,.0f} rows/s)", file=sys.stderr)
+
+
+def rows_loaded(path):
+    """How many rows of `path` earlier runs committed."""
+
+    loaded = (db.session
+              .query(checkpoints.c.rows_loaded)
+              .filter(checkpoints.c.path == path)
+              .scalar())
+
+    return loaded or 0
+
+
+def save_checkpoint(path, rows):
+    updated = db.session.execute(
+        checkpoints.update()
+        .where(checkpoints.c.path == path)
+        .values(rows_loaded=rows))
+
+    if not updated.rowcount:
+        db.session.execute(checkpoints.insert().values(path=path,
+                                                       rows_loaded=rows))
+
+
+def read_chunks(reader, chunk_rows):
+    chunk = []
+    for row in reader:
+        chunk.append(row)
+        if len(chunk) == chunk_rows:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def copy_chunk(table, columns, chunk):
+    """Send one chunk to Postgres with COPY FROM STDIN."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(chunk)
+    buffer.seek(0)
+
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer)
+
+
+def load_file(table, path, chunk_rows=CHUNK_ROWS, progress=report):
+    """Load one CSV into `table`, resuming after any committed chunks."""
+
+    done = rows_loaded(path)
+    started = time.monotonic()
+
+    with open(path, newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        # looking the header up in the table rejects unknown columns
+        columns = [table.c[name].name for name in next(reader)]
+
+        for _ in range(done):
+            next(reader)
+
+        for chunk in read_chunks(reader, chunk_rows):
+            copy_chunk(table, columns, chunk)
+            done += len(chunk)
+            save_checkpoint(path, done)
+            db.session.commit()
+            progress(path, done, started)
+
+
+def reset_sequences():
+    """Move each table's id sequence past the largest id loaded.
+
+    Ids come from the CSVs, so a failed chunk can be loaded again with the
+    same ids, but the sequences don't see them.
+    """
+
+    for table_name, _ in SEED_FILES:
+        table = db.metadata.tables[table_name]
+        if 'id' in table.c:
+            db.session.execute(db.text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"coalesce(max(id), 0) + 1, false) FROM {table.name}"))
+
+    db.session.commit()
+
+
+def drop_indexes():
+    """Drop every secondary index; primary keys and UNIQUEs stay."""
+
+    connection = db.session.connection()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(connection, checkfirst=True)
+
+    drop_search_indexes()
+    db.session.commit()
+
+
+def create_indexes():
+    """Build the indexes `drop_indexes` removed."""
+
+    connection = db.session.connection()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+    create_search_indexes()
+    db.session.commit()
+
+
+def load(directory='generator', resume=False, chunk_rows=CHUNK_ROWS,
+         derived=True, progress=report):
+    """Load users, messages and follows from the CSVs in `directory`.
+
+    Unless `resume` is set, every table is dropped and recreated first.
+    With `derived`, timelines, counters and the message search index are
+    rebuilt from the loaded rows at the end.
+    """
+
+    if not resume:
+        db.drop_all()
+        db.create_all()
+        stamp()
+
+    checkpoints.create(db.engine, checkfirst=True)
+    drop_indexes()
+
+    for table_name, file_name in SEED_FILES:
+        load_file(db.metadata.tables[table_name],
+                  os.path.join(directory, file_name),
+                  chunk_rows=chunk_rows,
+                  progress=progress)
+
+    reset_sequences()
+
+    # derived tables are filled before the indexes are built, so their
+    # indexes are also built once instead of row by row
+    if derived:
+        TimelineEntry.backfill()
+        User.repair_counts()
+        reindex_messages()
+        db.session.commit()
+
+    create_indexes()
+
+    db.session.execute(checkpoints.delete())
+    db.session.commit()
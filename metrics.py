@@ -0,0 +1,230 @@
+"""Per-request SQL and latency metrics.
+
+SQLAlchemy cursor events count and time every statement run while a
+request is being handled. Each response gets a Server-Timing header with
+the totals, statements repeated within one request are logged as likely
+N+1 queries, and the running totals per endpoint are served in Prometheus
+text format at /metrics.
+"""
+
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from threading import Lock
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+
+from models import db
+
+# request duration histogram buckets, in seconds
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+
+
+class QueryStats:
+    """The statements one request has run so far."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    def repeated(self, threshold):
+        """Statements run at least `threshold` times, with their counts.
+
+        Statements are compared with their bound parameters left out, so
+        the same query for a different id counts as a repeat.
+        """
+
+        return {statement: count
+                for statement, count in self.statements.items()
+                if count >= threshold}
+
+
+class EndpointTotals:
+    def __init__(self):
+        self.requests = Counter()
+        self.buckets = [0] * len(BUCKETS)
+        self.seconds = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.repeated = 0
+
+
+class RequestMetrics:
+    """Count and time SQL per request and export the totals.
+
+    `init_app` hooks into the app's engine and request cycle and adds the
+    /metrics endpoint. Totals are per worker process; with several
+    gunicorn workers each scrape sees one of them.
+
+    A statement run SQL_REPEAT_THRESHOLD (default 5) or more times in one
+    request is logged as a warning and counted as repeated.
+    """
+
+    def __init__(self):
+        self.totals = defaultdict(EndpointTotals)
+        self.lock = Lock()
+        self.repeat_threshold = 5
+        self.extra = []
+
+    def add_metric(self, name, kind, help_text, read):
+        """Also export `read()` as `name`, a Prometheus 'counter' or
+        'gauge', e.g. another component's stats."""
+
+        self.extra.append((name, kind, help_text, read))
+
+    def init_app(self, app):
+        app.extensions['request_metrics'] = self
+        self.repeat_threshold = app.config.setdefault('SQL_REPEAT_THRESHOLD', 5)
+        self.logger = app.logger
+
+        # the primary and any read replicas
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute',
+                             self.before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute',
+                             self.after_cursor_execute)
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.export)
+
+    def before_cursor_execute(self, conn, cursor, statement, *args):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, *args):
+        seconds = time.perf_counter() - conn.info['query_started'].pop()
+
+        if has_app_context() and 'query_stats' in g:
+            g.query_stats.record(statement, seconds)
+
+    def start_request(self):
+        g.query_stats = QueryStats()
+
+    def finish_request(self, response):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return response
+
+        seconds = time.perf_counter() - stats.started
+        endpoint = request.endpoint or 'unknown'
+        repeated = stats.repeated(self.repeat_threshold)
+
+        for statement, count in repeated.items():
+            self.logger.warning("%s ran the same statement %d times "
+                                "(possible N+1): %s",
+                                endpoint, count, statement)
+
+        with self.lock:
+            totals = self.totals[endpoint]
+            totals.requests[(request.method, response.status_code)] += 1
+            totals.seconds += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    totals.buckets[i] += 1
+            totals.queries += stats.count
+            totals.query_seconds += stats.seconds
+            totals.repeated += len(repeated)
+
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries", '
+            f'total;dur={seconds * 1000:.1f}')
+
+        return response
+
+    def export(self):
+        """Render the totals in Prometheus text format."""
+
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self.lock:
+            totals = sorted(self.totals.items())
+
+            family('waddle_requests_total', 'counter',
+                   "Requests handled, by endpoint, method and status.")
+            for endpoint, endpoint_totals in totals:
+                for (method, status), count in sorted(endpoint_totals.requests.items()):
+                    lines.append(f'waddle_requests_total{{endpoint="{endpoint}",'
+                                 f'method="{method}",status="{status}"}} {count}')
+
+            family('waddle_request_duration_seconds', 'histogram',
+                   "Time spent handling requests, by endpoint.")
+            for endpoint, endpoint_totals in totals:
+                count = sum(endpoint_totals.requests.values())
+                for bound, bucket in zip(BUCKETS, endpoint_totals.buckets):
+                    lines.append(f'waddle_request_duration_seconds_bucket'
+                                 f'{{endpoint="{endpoint}",le="{bound}"}} {bucket}')
+                lines.append(f'waddle_request_duration_seconds_bucket'
+                             f'{{endpoint="{endpoint}",le="+Inf"}} {count}')
+                lines.append(f'waddle_request_duration_seconds_sum'
+                             f'{{endpoint="{endpoint}"}} {endpoint_totals.seconds:.6f}')
+                lines.append(f'waddle_request_duration_seconds_count'
+                             f'{{endpoint="{endpoint}"}} {count}')
+
+            for name, attribute, help_text in [
+                ('waddle_sql_queries_total', 'queries',
+                 "SQL statements run, by endpoint."),
+                ('waddle_sql_duration_seconds_total', 'query_seconds',
+                 "Time spent running SQL, by endpoint."),
+                ('waddle_sql_repeated_statements_total', 'repeated',
+                 "Statements repeated enough in one request to suggest N+1."),
+            ]:
+                family(name, 'counter', help_text)
+                for endpoint, endpoint_totals in totals:
+                    value = getattr(endpoint_totals, attribute)
+                    if isinstance(value, float):
+                        value = f"{value:.6f}"
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {value}')
+
+        for name, kind, help_text, read in self.extra:
+            family(name, kind, help_text)
+            lines.append(f"{name} {read()}")
+
+        return ("\n".join(lines) + "\n", 200,
+                {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    def reset(self):
+        """Forget the totals gathered so far."""
+
+        with self.lock:
+            self.totals.clear()
+
+
+@contextmanager
+def record_queries():
+    """Collect the SQL statements run inside the block.
+
+    Meant for tests, which can check a view's query budget with
+
+        with record_queries() as statements:
+            client.get("/")
+        self.assertLessEqual(len(statements), 4)
+    """
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute',
+                         before_cursor_execute)
@@ -0,0 +1,255 @@
+"""Versioned schema migrations.
+
+`db.create_all()` only creates tables that are missing, so a database made
+before a column or index was added to models.py never gets it. Every
+schema change is therefore also a numbered migration here, and
+`flask migrate` applies the ones a database hasn't had yet, recording each
+in `schema_migrations`. A database made from scratch with `create_all` is
+already current and can be `stamp`ed instead.
+
+Migrations can run against a database that already has their change:
+columns are added with IF NOT EXISTS and indexes are only created when
+missing.
+
+Indexes on tables that already hold data are built with CREATE INDEX
+CONCURRENTLY, which doesn't block writes while it runs. Such
+a build can't run inside a transaction, so migrations marked `concurrent`
+get an autocommit connection; the others run in one transaction, together
+with recording their version.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from models import db, User, TimelineEntry, MessageTerm
+from search import TRIGRAM_COLUMNS, reindex_messages
+
+Migration = namedtuple('Migration', ['version', 'name', 'apply', 'concurrent'])
+
+MIGRATIONS = []
+
+schema_migrations = db.Table(
+    'schema_migrations',
+    db.Column('version', db.Integer, primary_key=True),
+    db.Column('name', db.Text, nullable=False),
+    db.Column('applied_at', db.DateTime, nullable=False,
+              default=datetime.utcnow),
+)
+
+
+def migration(version, concurrent=False):
+    """Register the decorated function as migration `version`.
+
+    The function is called with the connection to run its statements on.
+    """
+
+    def register(apply):
+        MIGRATIONS.append(Migration(version, apply.__name__, apply, concurrent))
+        MIGRATIONS.sort()
+        return apply
+
+    return register
+
+
+def has_column(connection, table, column):
+    return column in {col['name'] for col
+                      in db.inspect(connection).get_columns(table)}
+
+
+def add_column(connection, table, definition):
+    connection.execute(db.text(
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {definition}"))
+
+
+def create_index(connection, name, definition):
+    """CREATE INDEX CONCURRENTLY `name` ON `definition`.
+
+    A concurrent build that fails part way leaves an invalid index behind,
+    which IF NOT EXISTS would then keep; one of those is dropped first.
+    """
+
+    invalid = connection.execute(db.text(
+        "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = indexrelid "
+        "WHERE relname = :name AND NOT indisvalid"), dict(name=name)).first()
+    if invalid:
+        connection.execute(db.text(f"DROP INDEX CONCURRENTLY {name}"))
+
+    connection.execute(db.text(
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"))
+
+
+##############################################################################
+# Migrations, oldest first. Never edit one that has shipped; add another.
+#
+# Data is filled in with the same functions as the flask rebuild commands,
+# so a migration using one comes after those adding the columns it writes.
+
+
+@migration(1)
+def create_timelines_and_message_terms(connection):
+    """Home timelines and the message search index, built from the
+    messages and follows already there."""
+
+    inspector = db.inspect(connection)
+    missing = [table for table in [TimelineEntry.__table__,
+                                   MessageTerm.__table__]
+               if not inspector.has_table(table.name)]
+
+    db.metadata.create_all(connection, tables=missing)
+
+    if TimelineEntry.__table__ in missing:
+        TimelineEntry.backfill()
+    if MessageTerm.__table__ in missing:
+        reindex_messages()
+
+
+@migration(2)
+def add_users_updated_at(connection):
+    add_column(connection, 'users',
+               "updated_at timestamp NOT NULL "
+               "DEFAULT (now() at time zone 'utc')")
+
+
+@migration(3)
+def add_user_counters(connection):
+    """Denormalized message/follow/like counts on users, filled in from
+    the source tables."""
+
+    missing = not has_column(connection, 'users', 'messages_count')
+
+    for counter in ['messages_count', 'followers_count',
+                    'following_count', 'likes_count']:
+        add_column(connection, 'users',
+                   f"{counter} integer NOT NULL DEFAULT 0")
+
+    if missing:
+        User.repair_counts()
+
+
+@migration(4)
+def add_likes_created_at(connection):
+    """When each like was made. Likes from before this migration get the
+    time it ran."""
+
+    add_column(connection, 'likes',
+               "created_at timestamp NOT NULL "
+               "DEFAULT (now() at time zone 'utc')")
+
+
+@migration(5, concurrent=True)
+def add_user_search_indexes(connection):
+    """Trigram indexes for /users?q=."""
+
+    connection.execute(db.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    for column in TRIGRAM_COLUMNS:
+        create_index(connection, f"ix_users_{column}_trgm",
+                     f"users USING gin ({column} gin_trgm_ops)")
+
+
+@migration(6, concurrent=True)
+def add_likes_page_index(connection):
+    create_index(connection, "ix_likes_user_created",
+                 "likes (user_id, created_at DESC, message_id DESC)")
+
+
+@migration(7, concurrent=True)
+def add_hot_query_indexes(connection):
+    """A user's messages newest first (profiles), who a user follows
+    (following pages, fan-out), and a message's likes (message deletes
+    and their cascades)."""
+
+    create_index(connection, "ix_messages_user_timestamp",
+                 "messages (user_id, timestamp DESC, id DESC)")
+    create_index(connection, "ix_follows_following",
+                 "follows (user_following_id, user_being_followed_id)")
+    create_index(connection, "ix_likes_message", "likes (message_id)")
+
+
+@migration(8)
+def add_users_profile_updated_at(connection):
+    add_column(connection, 'users',
+               "profile_updated_at timestamp NOT NULL "
+               "DEFAULT (now() at time zone 'utc')")
+
+
+@migration(9)
+def add_message_terms_timestamp(connection):
+    """Each search term's message timestamp, copied from messages."""
+
+    add_column(connection, 'message_terms', "timestamp timestamp")
+    connection.execute(db.text(
+        "UPDATE message_terms SET timestamp = messages.timestamp "
+        "FROM messages "
+        "WHERE messages.id = message_terms.message_id "
+        "AND message_terms.timestamp IS NULL"))
+    connection.execute(db.text(
+        "ALTER TABLE message_terms ALTER COLUMN timestamp SET NOT NULL"))
+
+
+@migration(10, concurrent=True)
+def add_message_terms_timestamp_index(connection):
+    """Search results newest first, a page at a time."""
+
+    create_index(connection, "ix_message_terms_term_timestamp",
+                 "message_terms (term, timestamp DESC, message_id DESC)")
+
+
+##############################################################################
+# Running migrations
+
+
+def applied_versions():
+    """Versions already applied to the database."""
+
+    with db.engine.begin() as connection:
+        schema_migrations.create(connection, checkfirst=True)
+        return {version for (version,) in
+                connection.execute(db.select(schema_migrations.c.version))}
+
+
+def pending():
+    """Migrations not yet applied, oldest first."""
+
+    applied = applied_versions()
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def record(connection, migration):
+    connection.execute(schema_migrations.insert().values(
+        version=migration.version, name=migration.name))
+
+
+def migrate(progress=None):
+    """Apply every pending migration, in order.
+
+    `progress` is called with each migration after it's applied.
+    """
+
+    # a concurrent index build waits for every open transaction to end,
+    # which would include the session's own
+    db.session.commit()
+
+    for migration in pending():
+        if migration.concurrent:
+            with db.engine.connect().execution_options(
+                    isolation_level='AUTOCOMMIT') as connection:
+                migration.apply(connection)
+                record(connection, migration)
+        else:
+            connection = db.session.connection()
+            migration.apply(connection)
+            record(connection, migration)
+            db.session.commit()
+
+        if progress:
+            progress(migration)
+
+
+def stamp():
+    """Record every migration as applied, for a database just made by
+    `create_all`, which already has everything they add."""
+
+    for migration in pending():
+        record(db.session.connection(), migration)
+
+    db.session.commit()
@@ -1,12 +1,19 @@
 """SQLAlchemy models for Waddle."""
 
+import os
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import insert
+from werkzeug.local import LocalProxy
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from passwords import PasswordHasher
+from replicas import RoutingSession
+
+# each app has its own, made by connect_db
+hasher = LocalProxy(lambda: current_app.extensions['password_hasher'])
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class Follows(db.Model):
@@ -26,6 +33,13 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key leads with the followed user; this finds who a user
+    # follows (following pages, timeline fan-out)
+    __table_args__ = (
+        db.Index('ix_follows_following',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -70,6 +84,57 @@ class User(db.Model):
         nullable=False,
     )
 
+    # denormalized counts shown on profiles; kept in step by the write
+    # paths in app.py and rebuilt by `flask repair-counters`
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # version stamp for HTTP validators and cache keys: any UPDATE of the
+    # row, ORM or bulk (the counters), sets it
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        server_default=db.text("(now() at time zone 'utc')"),
+    )
+
+    # set only when the user edits their profile, so it versions what
+    # their messages show of them (see fragment_cache.py); counter
+    # updates leave it alone
+    profile_updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.text("(now() at time zone 'utc')"),
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -96,16 +161,108 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [
-            user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.query.get((self.id, other_user.id)) is not None
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [
-            user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.query.get((other_user.id, self.id)) is not None
+
+    def following_ids(self, among=None):
+        """Set of ids of the users this user follows, in one query.
+
+        Use this rather than `is_following` when checking many users,
+        e.g. every card on a page. Pass `among`, the ids on the page, to
+        read only those follows rather than all of them.
+        """
+
+        followed = (db.session
+                    .query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == self.id))
+
+        if among is not None:
+            followed = followed.filter(
+                Follows.user_being_followed_id.in_(among))
+
+        return {user_id for (user_id,) in followed}
+
+    @classmethod
+    def adjust_counts(cls, user_ids, **deltas):
+        """Add `deltas` to the counter columns of the given users.
+
+        `user_ids` is an id, a list of ids or a subquery of ids. The update
+        is done in SQL (`count = count + delta`) so concurrent writers
+        don't lose each other's changes.
+        """
+
+        if isinstance(user_ids, int):
+            user_ids = [user_ids]
+
+        (cls.query
+         .filter(cls.id.in_(user_ids))
+         .update({getattr(cls, name): getattr(cls, name) + delta
+                  for name, delta in deltas.items()},
+                 synchronize_session=False))
+
+    @classmethod
+    def release_counts(cls, user_id):
+        """Take a user about to be deleted out of everyone else's counts.
+
+        The database cascades delete their follows, messages and likes,
+        so the matching counters on other users are decremented here.
+        """
+
+        cls.adjust_counts(
+            db.select(Follows.user_being_followed_id)
+            .where(Follows.user_following_id == user_id),
+            followers_count=-1)
+
+        cls.adjust_counts(
+            db.select(Follows.user_following_id)
+            .where(Follows.user_being_followed_id == user_id),
+            following_count=-1)
+
+        likes_lost = (db.select(db.func.count())
+                      .select_from(Like)
+                      .join(Message, Message.id == Like.message_id)
+                      .where(Message.user_id == user_id,
+                             Like.user_id == cls.id)
+                      .scalar_subquery())
+
+        (cls.query
+         .filter(cls.id != user_id, likes_lost > 0)
+         .update({cls.likes_count: cls.likes_count - likes_lost},
+                 synchronize_session=False))
+
+    @classmethod
+    def repair_counts(cls):
+        """Recompute every user's counters from the source tables.
+
+        Each counter is one GROUP BY over its table joined back to users
+        (UPDATE ... FROM), so the cost is a scan per table rather than a
+        subquery per user.
+        """
+
+        counters = [
+            (cls.messages_count, Message.user_id),
+            (cls.followers_count, Follows.user_being_followed_id),
+            (cls.following_count, Follows.user_following_id),
+            (cls.likes_count, Like.user_id),
+        ]
+
+        cls.query.update({counter: 0 for counter, _ in counters},
+                         synchronize_session=False)
+
+        for counter, user_id in counters:
+            totals = (db.select(user_id.label('user_id'),
+                                db.func.count().label('total'))
+                      .group_by(user_id)
+                      .subquery())
+
+            db.session.execute(
+                db.update(cls.__table__)
+                .where(cls.__table__.c.id == totals.c.user_id)
+                .values({counter.key: totals.c.total}))
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -114,7 +271,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -135,13 +292,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the hash was made with an old cost factor it is replaced with
+        one at the current cost; the caller's commit saves it.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -151,15 +313,105 @@ class User(db.Model):
         if new_pwd_init != new_pwd_confirm:
             return False
         else:
-            auth_user = User.authenticate(cls, username, curr_pwd)
-            if auth_user is True:
-                hashed_pwd = bcrypt.generate_password_hash(new_pwd_init).decode('UTF-8')
+            auth_user = cls.authenticate(username, curr_pwd)
+            if auth_user:
+                hashed_pwd = hasher.hash(new_pwd_init)
                 auth_user.password = hashed_pwd
                 db.session.commit()
             else:
                 return False
 
 
+class UserCard:
+    """The columns of a user shown on a user card, without the ORM.
+
+    Lists of users (the directory, search results) load these instead of
+    full `User` rows, so they never read password hashes or emails and
+    don't add every user to the session's identity map.
+    """
+
+    __slots__ = ('id', 'username', 'image_url', 'header_image_url', 'bio')
+
+    def __init__(self, id, username, image_url, header_image_url, bio):
+        self.id = id
+        self.username = username
+        self.image_url = image_url
+        self.header_image_url = header_image_url
+        self.bio = bio
+
+    def __repr__(self):
+        return f"<UserCard #{self.id}: {self.username}>"
+
+    @classmethod
+    def columns(cls):
+        """The User columns to select, in constructor order."""
+
+        return [getattr(User, name) for name in cls.__slots__]
+
+    @classmethod
+    def directory(cls, after=None, per_page=30):
+        """One page of user cards in username order.
+
+        `after` is the last username on the previous page. Returns
+        (cards, next_cursor); next_cursor is None on the last page.
+        """
+
+        query = db.session.query(*cls.columns())
+
+        if after:
+            query = query.filter(User.username > after)
+
+        rows = query.order_by(User.username).limit(per_page + 1).all()
+        cards = [cls(*row) for row in rows[:per_page]]
+
+        if len(rows) > per_page:
+            return cards, cards[-1].username
+
+        return cards, None
+
+    @classmethod
+    def followers(cls, user_id, after=None, per_page=30):
+        """One page of cards for the users following `user_id`.
+
+        Pages are in follower id order and `after` is the last id on the
+        previous page, so each page is a range read on the follows
+        primary key. Returns (cards, next_cursor) like `directory`.
+        """
+
+        return cls._follows_page(Follows.user_being_followed_id,
+                                 Follows.user_following_id,
+                                 user_id, after, per_page)
+
+    @classmethod
+    def following(cls, user_id, after=None, per_page=30):
+        """One page of cards for the users `user_id` follows, in id order.
+
+        Works like `followers`.
+        """
+
+        return cls._follows_page(Follows.user_following_id,
+                                 Follows.user_being_followed_id,
+                                 user_id, after, per_page)
+
+    @classmethod
+    def _follows_page(cls, user_col, other_col, user_id, after, per_page):
+        query = (db.session
+                 .query(*cls.columns())
+                 .join(Follows, other_col == User.id)
+                 .filter(user_col == user_id))
+
+        if after is not None:
+            query = query.filter(other_col > after)
+
+        rows = query.order_by(other_col).limit(per_page + 1).all()
+        cards = [cls(*row) for row in rows[:per_page]]
+
+        if len(rows) > per_page:
+            return cards, cards[-1].id
+
+        return cards, None
+
+
 class Message(db.Model):
     """An individual message."""
 
@@ -178,7 +430,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -189,6 +441,12 @@ class Message(db.Model):
 
     user = db.relationship('User')
 
+    # a user's messages newest first, as profiles page through them
+    __table_args__ = (
+        db.Index('ix_messages_user_timestamp',
+                 'user_id', timestamp.desc(), id.desc()),
+    )
+
 
 class Like(db.Model):
     """Shows which users liked which messages."""
@@ -207,7 +465,248 @@ class Like(db.Model):
         primary_key=True
     )
 
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.text("(now() at time zone 'utc')"),
+    )
+
+    # a user's likes page is a range read on the first, most recent
+    # first; the second finds a message's likes
+    __table_args__ = (
+        db.Index('ix_likes_user_created',
+                 'user_id', created_at.desc(), message_id.desc()),
+        db.Index('ix_likes_message', 'message_id'),
+    )
+
+    @classmethod
+    def add(cls, user_id, message_ids):
+        """Have `user_id` like `message_ids`; returns their new likes_count.
+
+        Messages already liked, or that don't exist, are skipped, so a
+        repeated request is harmless. The insert and the counter update
+        are one statement: INSERT ... ON CONFLICT DO NOTHING RETURNING in
+        a CTE, with the UPDATE counting the rows it returned.
+        """
+
+        added = (insert(cls)
+                 .from_select(['user_id', 'message_id'],
+                              db.select(db.literal(user_id), Message.id)
+                              .where(Message.id.in_(message_ids)))
+                 .on_conflict_do_nothing()
+                 .returning(cls.message_id)
+                 .cte('added'))
+
+        return cls._count_changes(user_id, added, 1)
+
+    @classmethod
+    def remove(cls, user_id, message_ids):
+        """Have `user_id` unlike `message_ids`; returns their new likes_count.
+
+        Messages not liked are skipped. Like `add`, this is one statement.
+        """
+
+        removed = (db.delete(cls)
+                   .where(cls.user_id == user_id,
+                          cls.message_id.in_(message_ids))
+                   .returning(cls.message_id)
+                   .cte('removed'))
+
+        return cls._count_changes(user_id, removed, -1)
+
+    @classmethod
+    def _count_changes(cls, user_id, changed, sign):
+        users = User.__table__
+        changes = db.select(db.func.count()).select_from(changed)
+
+        return db.session.execute(
+            db.update(users)
+            .add_cte(changed)
+            .where(users.c.id == user_id)
+            .values(likes_count=(users.c.likes_count
+                                 + sign * changes.scalar_subquery()))
+            .returning(users.c.likes_count)
+        ).scalar()
+
+
+class MessageTerm(db.Model):
+    """One word of a message, at its position in the text.
+
+    This is the inverted index behind message search: looking up a word
+    (or a word prefix, as a range) in the primary key finds the messages
+    that contain it, and positions let phrases be matched. Each row has
+    its message's timestamp, so a page of a word's messages, newest
+    first, is a range read however many messages have the word.
+    """
+
+    __tablename__ = 'message_terms'
+
+    term = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    position = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_message_terms_message', 'message_id'),
+        db.Index('ix_message_terms_term_timestamp',
+                 'term', timestamp.desc(), message_id.desc()),
+    )
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into one user's home timeline.
+
+    Rows are written when a message is posted (fan-out on write), so
+    building a home feed is a single range read on
+    (user_id, timestamp, message_id) instead of an IN over everyone the
+    user follows.
+    """
+
+    __tablename__ = 'timelines'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timelines_user_timestamp',
+                 'user_id', timestamp.desc(), message_id.desc()),
+        db.Index('ix_timelines_user_author', 'user_id', 'author_id'),
+    )
+
+    @classmethod
+    def fan_out(cls, message):
+        """Add `message` to its author's timeline and their followers'.
+
+        The message must already be flushed so it has an id and timestamp.
+        """
+
+        followers = (db.session
+                     .query(Follows.user_following_id)
+                     .filter(Follows.user_being_followed_id == message.user_id,
+                             Follows.user_following_id != message.user_id))
+        recipient_ids = [message.user_id] + [row[0] for row in followers]
+
+        db.session.execute(
+            cls.__table__.insert(),
+            [dict(user_id=recipient_id,
+                  message_id=message.id,
+                  author_id=message.user_id,
+                  timestamp=message.timestamp)
+             for recipient_id in recipient_ids])
+
+    @classmethod
+    def add_author(cls, user_id, author_id):
+        """Copy every message by `author_id` into `user_id`'s timeline."""
+
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                ['user_id', 'message_id', 'author_id', 'timestamp'],
+                db.select(db.literal(user_id),
+                          Message.id,
+                          Message.user_id,
+                          Message.timestamp)
+                .where(Message.user_id == author_id)
+                .where(~db.exists().where(db.and_(
+                    cls.user_id == user_id,
+                    cls.message_id == Message.id)))))
+
+    @classmethod
+    def remove_author(cls, user_id, author_id):
+        """Drop every message by `author_id` from `user_id`'s timeline.
+
+        A user's own messages stay, even if they once followed themselves.
+        """
+
+        if user_id == author_id:
+            return
+
+        (cls.query
+         .filter(cls.user_id == user_id, cls.author_id == author_id)
+         .delete(synchronize_session=False))
+
+    @classmethod
+    def remove_message(cls, message_id):
+        """Drop a message from every timeline it was fanned out to."""
+
+        (cls.query
+         .filter(cls.message_id == message_id)
+         .delete(synchronize_session=False))
+
+    @classmethod
+    def backfill(cls):
+        """Rebuild every timeline from the follows and messages tables."""
+
+        cls.query.delete(synchronize_session=False)
+
+        own = db.select(Message.user_id.label('user_id'),
+                        Message.id,
+                        Message.user_id.label('author_id'),
+                        Message.timestamp)
+        followed = (db.select(Follows.user_following_id.label('user_id'),
+                              Message.id,
+                              Message.user_id.label('author_id'),
+                              Message.timestamp)
+                    .join(Message,
+                          Message.user_id == Follows.user_being_followed_id))
+
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                ['user_id', 'message_id', 'author_id', 'timestamp'],
+                db.union(own, followed)))
+
 
 def connect_db(app):
     db.app = app
     db.init_app(app)
+    PasswordHasher().init_app(app)
+
+    # A process forked after this (a gunicorn worker under --preload)
+    # inherits the engines, and any pooled connections would then be
+    # shared with the parent over the same sockets. The child starts with
+    # empty pools instead, leaving the parent's connections to it.
+    with app.app_context():
+        engines = list(db.engines.values())
+
+    def dispose_engines():
+        for engine in engines:
+            engine.dispose(close=False)
+
+    os.register_at_fork(after_in_child=dispose_engines)
@@ -0,0 +1,66 @@
+"""Keyset (cursor) pagination for Waddle."""
+
+from collections import namedtuple
+from datetime import datetime
+
+from flask import abort
+
+from models import db
+
+PAGE_SIZE = 100
+
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def encode_cursor(timestamp, row_id):
+    """Turn the (timestamp, id) of the last row on a page into a cursor."""
+
+    return f"{timestamp.strftime(CURSOR_TIME_FORMAT)}-{row_id}"
+
+
+def decode_cursor(cursor):
+    """Turn a cursor back into (timestamp, id).
+
+    Raises ValueError if the cursor is malformed.
+    """
+
+    timestamp, _, row_id = cursor.partition('-')
+    return datetime.strptime(timestamp, CURSOR_TIME_FORMAT), int(row_id)
+
+
+def paginate_by_time(query, timestamp_col, id_col, before=None,
+                     per_page=PAGE_SIZE, key=None):
+    """Return one page of `query`, newest first, older than `before`.
+
+    Rows are ordered on (timestamp_col, id_col) descending and the cursor
+    is a row-value comparison on those same columns, so every page is an
+    index range read no matter how deep it is (unlike OFFSET).
+
+    `key` maps an item to its (timestamp, id); by default it reads
+    `.timestamp` and `.id`. Aborts with a 400 for a malformed cursor.
+    """
+
+    if key is None:
+        def key(item):
+            return item.timestamp, item.id
+
+    if before:
+        try:
+            cursor = decode_cursor(before)
+        except ValueError:
+            abort(400)
+
+        query = query.filter(db.tuple_(timestamp_col, id_col) < cursor)
+
+    items = (query
+             .order_by(timestamp_col.desc(), id_col.desc())
+             .limit(per_page + 1)
+             .all())
+
+    if len(items) > per_page:
+        items = items[:per_page]
+        return Page(items, encode_cursor(*key(items[-1])))
+
+    return Page(items, None)
@@ -0,0 +1,121 @@
+"""Bcrypt password hashing in a bounded pool of worker processes."""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+import bcrypt
+
+
+class PasswordHasherBusy(Exception):
+    """Too many hashes are already waiting for a worker."""
+
+
+def hash_password(password, rounds):
+    """Hash `password` with bcrypt at cost `rounds`."""
+
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def check_password(pw_hash, password):
+    """Does `password` match bcrypt hash `pw_hash`?"""
+
+    return bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+
+
+def hash_rounds(pw_hash):
+    """The cost factor a bcrypt hash was made with ('$2b$12$...' -> 12)."""
+
+    return int(pw_hash.split('$')[2])
+
+
+class PasswordHasher:
+    """Hash and check passwords without tying up the request's CPU.
+
+    Each bcrypt call takes hundreds of milliseconds on purpose. Calls run
+    in a pool of `workers` processes. At most `max_pending` calls may be
+    queued or running at once; past that `PasswordHasherBusy` is raised
+    straight away, so a burst of logins fails fast instead of holding
+    every web worker's threads.
+
+    With `workers=0` hashing happens inline, in the calling thread, which
+    is what the tests and the dev server use; `max_pending` still applies.
+
+    Configured from BCRYPT_LOG_ROUNDS, PASSWORD_HASH_WORKERS and
+    PASSWORD_HASH_MAX_PENDING by `init_app`.
+    """
+
+    def __init__(self, rounds=12, workers=0, max_pending=32):
+        self.configure(rounds, workers, max_pending)
+        self.lock = Lock()
+
+    def configure(self, rounds, workers, max_pending):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.slots = BoundedSemaphore(max_pending)
+        self.pool = None
+
+    def init_app(self, app):
+        app.extensions['password_hasher'] = self
+        self.shutdown()
+        self.configure(
+            app.config.setdefault('BCRYPT_LOG_ROUNDS', 12),
+            app.config.setdefault('PASSWORD_HASH_WORKERS', 0),
+            app.config.setdefault('PASSWORD_HASH_MAX_PENDING', 32))
+
+    def get_pool(self):
+        # created on first use, so a pool is never inherited across fork;
+        # workers are spawned, not forked, for the same reason
+        with self.lock:
+            if self.pool is None or self.pool_pid != os.getpid():
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+                self.pool_pid = os.getpid()
+
+            return self.pool
+
+    def run(self, func, *args):
+        if not self.slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+
+        if not self.workers:
+            try:
+                return func(*args)
+            finally:
+                self.slots.release()
+
+        try:
+            future = self.get_pool().submit(func, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+
+    def hash(self, password):
+        """Hash `password` at the configured cost."""
+
+        return self.run(hash_password, password, self.rounds)
+
+    def check(self, pw_hash, password):
+        """Does `password` match `pw_hash`?"""
+
+        return self.run(check_password, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Was `pw_hash` made with a different cost than the current one?"""
+
+        return hash_rounds(pw_hash) != self.rounds
+
+    def shutdown(self):
+        """Stop the worker processes, if any were started."""
+
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
@@ -0,0 +1,224 @@
+"""Sampling profiler for chosen requests, written out as flamegraphs.
+
+A request is profiled when it wins a PROFILE_SAMPLE_RATE draw (0 to 1,
+default 0) or carries a valid signed X-Waddle-Profile header (see
+`flask profile-token`). While any profiled request is running, a
+background thread reads its stack every PROFILE_INTERVAL seconds.
+Stacks are added up per endpoint and written to PROFILE_DIR as
+`<endpoint>.<pid>.collapsed` (one "frame;frame;frame count" line per
+stack, the input format of flamegraph.pl and speedscope) and
+`<endpoint>.<pid>.svg`.
+
+With no profiled requests running the sampler thread sleeps, so a
+request that isn't profiled pays only for a header lookup and, when
+sampling is on, one random draw.
+"""
+
+import html
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+
+from flask import g, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+PROFILE_HEADER = 'X-Waddle-Profile'
+
+
+def frame_name(frame):
+    """'module:function', e.g. 'flask.app:Flask.wsgi_app'."""
+
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', '?')
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def collapse(frame):
+    """`frame`'s stack, outermost call first, in collapsed-stack form."""
+
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame).replace(';', ':'))
+        frame = frame.f_back
+
+    return ';'.join(reversed(names))
+
+
+def write_collapsed(path, stacks):
+    with open(path, 'w') as collapsed:
+        for stack, count in sorted(stacks.items()):
+            collapsed.write(f"{stack} {count}\n")
+
+
+def write_flamegraph(path, stacks, title, width=1200, row_height=16):
+    """Draw `stacks` as an SVG flamegraph: callers at the bottom, width
+    proportional to samples."""
+
+    tree = {}
+    for stack, count in stacks.items():
+        node = tree
+        for name in stack.split(';'):
+            child = node.setdefault(name, {'count': 0, 'children': {}})
+            child['count'] += count
+            node = child['children']
+
+    total = sum(stacks.values()) or 1
+    rects = []
+
+    def layout(children, x, depth):
+        for name, child in sorted(children.items()):
+            child_width = child['count'] / total * width
+            if child_width >= 0.5:
+                rects.append((x, depth, child_width, name, child['count']))
+                layout(child['children'], x, depth + 1)
+            x += child_width
+
+    layout(tree, 0, 0)
+    depth = max((rect[1] for rect in rects), default=0) + 1
+    height = (depth + 2) * row_height
+
+    with open(path, 'w') as svg:
+        svg.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" '
+                  f'height="{height}" font-family="monospace" font-size="11">\n'
+                  f'<text x="4" y="{row_height - 4}">{html.escape(title)} '
+                  f'({total} samples)</text>\n')
+
+        for x, level, rect_width, name, count in rects:
+            y = height - (level + 1) * row_height
+            # warm colours, varied by name so neighbours stand apart
+            hue = zlib.crc32(name.encode()) % 40
+            label = html.escape(name)
+            chars = int(rect_width / 7)
+            svg.write(f'<g><title>{label} ({count} samples, '
+                      f'{count / total:.1%})</title>'
+                      f'<rect x="{x:.1f}" y="{y}" width="{rect_width:.1f}" '
+                      f'height="{row_height - 1}" fill="hsl({hue},80%,60%)"/>')
+            if chars > 3:
+                svg.write(f'<text x="{x + 2:.1f}" y="{y + row_height - 4}">'
+                          f'{html.escape(name[:chars])}</text>')
+            svg.write('</g>\n')
+
+        svg.write('</svg>\n')
+
+
+class SamplingProfiler:
+    """Sample the stacks of profiled requests from a background thread.
+
+    `init_app` reads PROFILE_SAMPLE_RATE, PROFILE_INTERVAL, PROFILE_DIR and
+    PROFILE_FLUSH_SECONDS. Routes' stacks are written at most every
+    PROFILE_FLUSH_SECONDS, and straight after a header-requested profile.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.active = {}
+        self.stacks = defaultdict(Counter)
+        self.flushed = {}
+        self.thread = None
+        self.thread_pid = None
+        self.rate = 0.0
+
+    def init_app(self, app):
+        app.extensions['sampling_profiler'] = self
+        self.rate = app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+        self.interval = app.config.setdefault('PROFILE_INTERVAL', 0.002)
+        self.directory = app.config.setdefault('PROFILE_DIR', 'profiles')
+        self.flush_seconds = app.config.setdefault('PROFILE_FLUSH_SECONDS', 30)
+        self.signer = URLSafeTimedSerializer(app.config['SECRET_KEY'],
+                                             salt='waddle-profile')
+
+        app.before_request(self.start_request)
+        app.teardown_request(self.finish_request)
+
+        @app.cli.command('profile-token')
+        def profile_token():
+            """Print a header value that profiles requests for an hour."""
+
+            print(f"{PROFILE_HEADER}: {self.make_token()}")
+
+    def make_token(self):
+        return self.signer.dumps('profile')
+
+    def token_valid(self, token, max_age=3600):
+        try:
+            self.signer.loads(token, max_age=max_age)
+        except BadSignature:
+            return False
+        return True
+
+    def start_request(self):
+        token = request.headers.get(PROFILE_HEADER)
+        requested = token is not None and self.token_valid(token)
+
+        if not requested and not (self.rate and random.random() < self.rate):
+            return
+
+        g.profile_requested = requested
+        with self.lock:
+            self.active[threading.get_ident()] = request.endpoint or 'unknown'
+            self.start_thread()
+            self.wake.notify()
+
+    def finish_request(self, exc=None):
+        if 'profile_requested' not in g:
+            return
+
+        requested = g.pop('profile_requested')
+        with self.lock:
+            endpoint = self.active.pop(threading.get_ident(), None)
+
+        if endpoint is not None:
+            now = time.monotonic()
+            if requested or now - self.flushed.get(endpoint, 0) >= self.flush_seconds:
+                self.flushed[endpoint] = now
+                self.write(endpoint)
+
+    def start_thread(self):
+        # a thread doesn't survive fork, so each worker starts its own
+        if self.thread is None or self.thread_pid != os.getpid():
+            self.thread = threading.Thread(target=self.run,
+                                           name='sampling-profiler',
+                                           daemon=True)
+            self.thread_pid = os.getpid()
+            self.thread.start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                while not self.active:
+                    self.wake.wait()
+            self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        """Add one sample of every profiled request's stack."""
+
+        with self.lock:
+            active = dict(self.active)
+
+        frames = sys._current_frames()
+        for thread_id, endpoint in active.items():
+            frame = frames.get(thread_id)
+            if frame is not None:
+                stack = collapse(frame)
+                with self.lock:
+                    self.stacks[endpoint][stack] += 1
+
+    def write(self, endpoint):
+        """Write `endpoint`'s stacks so far to PROFILE_DIR."""
+
+        with self.lock:
+            stacks = Counter(self.stacks[endpoint])
+
+        if not stacks:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"{endpoint}.{os.getpid()}")
+        write_collapsed(base + '.collapsed', stacks)
+        write_flamegraph(base + '.svg', stacks, endpoint)
@@ -0,0 +1,181 @@
+"""Send reads to read replicas and writes to the primary.
+
+Replicas are SQLAlchemy binds named replica_0, replica_1, ... made from
+REPLICA_DATABASE_URLS (comma separated). GET and HEAD requests read from
+one of them, picked per request; other requests, and anything outside a
+request (CLI commands, tests' setup), use the primary.
+
+A user who has just written would not see their change on a replica that
+hasn't caught up yet, so after a request writes, that user's session reads
+from the primary for REPLICA_STICKY_SECONDS (default 5). A statement that
+writes also moves the rest of its request to the primary.
+
+Each replica's lag is checked at most every REPLICA_LAG_CHECK_SECONDS
+(default 1) per worker. Replicas further behind than REPLICA_MAX_LAG
+seconds (default: the sticky window), or that can't be reached, are left
+out until they catch up; with none left, reads go to the primary.
+"""
+
+import random
+import time
+from threading import Lock
+
+from flask import current_app, g, has_app_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+from sqlalchemy.sql.selectable import Select
+
+REPLICA_BIND_PREFIX = 'replica_'
+
+# the session key holding when this user's reads may go back to replicas
+STICKY_KEY = 'primary_until'
+
+POSTGRES_LAG = text(
+    "SELECT CASE"
+    " WHEN NOT pg_is_in_recovery()"
+    "  OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())"
+    " END")
+
+
+def replica_binds(urls, engine_options):
+    """SQLALCHEMY_BINDS for a comma-separated list of replica URLs.
+
+    Binds don't get SQLALCHEMY_ENGINE_OPTIONS, so each carries its own
+    copy of `engine_options`.
+    """
+
+    return {f"{REPLICA_BIND_PREFIX}{i}": dict(engine_options, url=url.strip())
+            for i, url in enumerate(urls.split(',')) if url.strip()}
+
+
+def is_read(clause):
+    """Could `clause` run on a replica? Plain SELECTs only: DML, locking
+    reads and raw SQL go to the primary."""
+
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+
+class RoutingSession(Session):
+    """A session that runs the current request's reads on its replica.
+
+    `db.session` is one of these (see models.py); `ReplicaRouter` picks
+    the replica, if any, at the start of each request.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            if self._flushing or not is_read(clause):
+                # the rest of the request, and this user's next requests
+                # for a while, should see this write
+                g.pop('read_bind', None)
+                g.wrote = True
+
+            elif 'read_bind' in g:
+                return g.read_bind
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+
+class ReplicaRouter:
+    """Pick a replica for each read-only request.
+
+    `init_app` must come after `db.init_app`, and before any other
+    before_request hook that queries. REPLICA_READS turns routing off
+    without removing the binds.
+    """
+
+    def __init__(self):
+        self.replicas = []
+        self.lags = {}
+        self.lock = Lock()
+        self.counts = dict(replica=0, sticky=0, lagging=0, writes=0)
+
+    def init_app(self, app):
+        app.extensions['replica_router'] = self
+        app.config.setdefault('REPLICA_READS', True)
+        self.sticky_seconds = app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+        self.max_lag = app.config.setdefault('REPLICA_MAX_LAG',
+                                             self.sticky_seconds)
+        self.check_seconds = app.config.setdefault(
+            'REPLICA_LAG_CHECK_SECONDS', 1)
+
+        self.replicas = sorted(key for key in app.config['SQLALCHEMY_BINDS']
+                               if key.startswith(REPLICA_BIND_PREFIX))
+        self.db = app.extensions['sqlalchemy']
+
+        app.before_request(self.choose_bind)
+        app.after_request(self.remember_write)
+
+    def choose_bind(self):
+        # g outlives the request when an app context was already pushed
+        g.pop('read_bind', None)
+        g.pop('wrote', None)
+
+        if (not self.replicas
+                or not current_app.config['REPLICA_READS']
+                or request.method not in ('GET', 'HEAD')
+                or request.endpoint == 'static'):
+            return
+
+        if session.get(STICKY_KEY, 0) > time.time():
+            self.count('sticky')
+            return
+
+        lags = {key: self.lag(key) for key in self.replicas}
+        current = [key for key, lag in lags.items()
+                   if lag is not None and lag <= self.max_lag]
+        if not current:
+            self.count('lagging')
+            return
+
+        g.read_bind = self.db.engines[random.choice(current)]
+        self.count('replica')
+
+    def remember_write(self, response):
+        if g.pop('wrote', False) and self.replicas:
+            session[STICKY_KEY] = time.time() + self.sticky_seconds
+            self.count('writes')
+
+        return response
+
+    def lag(self, key):
+        """Seconds `key` is behind the primary, or None if it can't be
+        reached. Rechecked every REPLICA_LAG_CHECK_SECONDS."""
+
+        now = time.monotonic()
+        with self.lock:
+            checked = self.lags.get(key)
+        if checked and checked[0] > now:
+            return checked[1]
+
+        try:
+            lag = self.measure_lag(self.db.engines[key])
+        except Exception:
+            current_app.logger.exception("checking replica %s failed", key)
+            lag = None
+
+        with self.lock:
+            self.lags[key] = (now + self.check_seconds, lag)
+
+        return lag
+
+    def measure_lag(self, engine):
+        if engine.dialect.name != 'postgresql':
+            return 0.0
+
+        with engine.connect() as connection:
+            return float(connection.execute(POSTGRES_LAG).scalar() or 0)
+
+    def count(self, outcome):
+        with self.lock:
+            self.counts[outcome] += 1
+
+    def stats(self):
+        """Requests that read from a replica, that read from the primary
+        because their user just wrote ('sticky') or every replica was
+        behind ('lagging'), and that wrote."""
+
+        with self.lock:
+            return dict(self.counts)
@@ -0,0 +1,252 @@
+"""User search for /users?q= and message search for /messages/search."""
+
+import re
+
+from flask import abort
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import aliased
+
+from models import db, User, UserCard, Message, MessageTerm
+from pagination import Page, paginate_by_time
+
+SEARCH_PAGE_SIZE = 30
+
+WORD_RE = re.compile(r"\w+")
+
+# a quoted phrase, or a single word optionally ending in * for a prefix
+QUERY_RE = re.compile(r'"([^"]*)"|(\w+)(\*?)')
+
+# Trigram GIN indexes let Postgres answer ILIKE '%term%' (for terms of
+# three or more characters) from the index instead of reading every row
+# of users.
+TRIGRAM_COLUMNS = ['username', 'location', 'bio']
+
+TRIGRAM_INDEXES = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] + [
+    f"CREATE INDEX IF NOT EXISTS ix_users_{column}_trgm "
+    f"ON users USING gin ({column} gin_trgm_ops)"
+    for column in TRIGRAM_COLUMNS
+]
+
+for statement in TRIGRAM_INDEXES:
+    event.listen(User.__table__,
+                 'after_create',
+                 DDL(statement))
+
+
+def create_search_indexes():
+    """Add the trigram indexes to a users table that already exists."""
+
+    for statement in TRIGRAM_INDEXES:
+        db.session.execute(db.text(statement))
+
+
+def drop_search_indexes():
+    """Drop the trigram indexes, e.g. to rebuild them after a bulk load."""
+
+    for column in TRIGRAM_COLUMNS:
+        db.session.execute(db.text(
+            f"DROP INDEX IF EXISTS ix_users_{column}_trgm"))
+
+
+def escape_like(term):
+    """Escape LIKE wildcards so `term` only matches itself."""
+
+    return (term
+            .replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_'))
+
+
+def search_users(term, after=None, per_page=SEARCH_PAGE_SIZE):
+    """Find users whose username, location or bio contains `term`.
+
+    Results are ranked: exact username, username prefix, username
+    substring, then location and finally bio matches, with username as
+    the tiebreak. `after` is the cursor returned with the previous page;
+    aborts with a 400 if it is malformed.
+
+    Returns (cards, next_cursor), where cards are `UserCard`s and
+    next_cursor is None on the last page.
+    """
+
+    contains = f"%{escape_like(term)}%"
+    prefix = f"{escape_like(term)}%"
+
+    rank = db.case(
+        (db.func.lower(User.username) == term.lower(), 0),
+        (User.username.ilike(prefix, escape='\\'), 1),
+        (User.username.ilike(contains, escape='\\'), 2),
+        (User.location.ilike(contains, escape='\\'), 3),
+        else_=4)
+
+    query = (db.session
+             .query(*UserCard.columns(), rank)
+             .filter(db.or_(User.username.ilike(contains, escape='\\'),
+                            User.location.ilike(contains, escape='\\'),
+                            User.bio.ilike(contains, escape='\\'))))
+
+    if after:
+        after_rank, _, after_username = after.partition(':')
+        if not after_rank.isdigit():
+            abort(400)
+
+        query = query.filter(db.tuple_(rank, User.username)
+                             > (int(after_rank), after_username))
+
+    rows = (query
+            .order_by(rank, User.username)
+            .limit(per_page + 1)
+            .all())
+
+    cards = [UserCard(*row[:-1]) for row in rows[:per_page]]
+
+    if len(rows) > per_page:
+        last_rank = rows[per_page - 1][-1]
+        return cards, f"{last_rank}:{cards[-1].username}"
+
+    return cards, None
+
+
+##############################################################################
+# Message search
+
+
+def tokenize(text):
+    """Split text into the lower-cased words the message index stores."""
+
+    return WORD_RE.findall(text.lower())
+
+
+def index_message(message):
+    """Add a flushed message's words to the search index."""
+
+    terms = [dict(term=term, message_id=message.id, position=position,
+                  timestamp=message.timestamp)
+             for position, term in enumerate(tokenize(message.text))]
+
+    if terms:
+        db.session.execute(MessageTerm.__table__.insert(), terms)
+
+
+def unindex_message(message_id):
+    """Remove a message's words from the search index."""
+
+    (MessageTerm.query
+     .filter(MessageTerm.message_id == message_id)
+     .delete(synchronize_session=False))
+
+
+def reindex_messages(batch_size=1000):
+    """Rebuild the search index from every message."""
+
+    MessageTerm.query.delete(synchronize_session=False)
+
+    batch = []
+    messages = db.session.query(Message.id, Message.text, Message.timestamp)
+    for message_id, text, timestamp in messages.yield_per(batch_size):
+        batch.extend(dict(term=term, message_id=message_id, position=position,
+                          timestamp=timestamp)
+                     for position, term in enumerate(tokenize(text)))
+
+        if len(batch) >= batch_size:
+            db.session.execute(MessageTerm.__table__.insert(), batch)
+            batch = []
+
+    if batch:
+        db.session.execute(MessageTerm.__table__.insert(), batch)
+
+
+def parse_query(query_text):
+    """Split a search into clauses.
+
+    Each clause is ('word', term), ('prefix', term) for `term*`, or
+    ('phrase', [terms]) for a quoted phrase. Every clause must match.
+    """
+
+    clauses = []
+
+    for phrase, word, star in QUERY_RE.findall(query_text):
+        if phrase:
+            terms = tokenize(phrase)
+            if len(terms) == 1:
+                clauses.append(('word', terms[0]))
+            elif terms:
+                clauses.append(('phrase', terms))
+        elif star:
+            clauses.append(('prefix', word.lower()))
+        else:
+            clauses.append(('word', word.lower()))
+
+    return clauses
+
+
+def clause_matches(select, kind, value):
+    """The query `select` builds on a new MessageTerm alias, narrowed to
+    the terms matching one clause. Returns (query, alias)."""
+
+    first = aliased(MessageTerm)
+    query = select(first)
+
+    if kind == 'word':
+        return query.where(first.term == value), first
+
+    if kind == 'prefix':
+        # a range on the primary key: every term starting with `value`
+        # sorts at or after it and before its last character + 1
+        upper = value[:-1] + chr(ord(value[-1]) + 1)
+        return query.where(first.term >= value, first.term < upper), first
+
+    # phrase: each following word sits one position after the last
+    query = query.where(first.term == value[0])
+
+    for offset, term in enumerate(value[1:], start=1):
+        nth = aliased(MessageTerm)
+        query = query.join(nth, db.and_(
+            nth.message_id == first.message_id,
+            nth.position == first.position + offset,
+            nth.term == term))
+
+    return query, first
+
+
+def clause_message_ids(kind, value):
+    """A subquery of the ids of messages that match one clause."""
+
+    query, _ = clause_matches(
+        lambda first: db.select(first.message_id), kind, value)
+    return query
+
+
+def search_messages(query_text, before=None):
+    """Find messages matching every clause in `query_text`, newest first.
+
+    Supports words, `prefix*` and "quoted phrases". `before` is the
+    cursor returned with the previous page. Returns a pagination Page.
+
+    The first word or phrase is read newest first from
+    (term, timestamp, message_id), and the other clauses are checked for
+    each message found, so a page costs about the same however many
+    messages match. A search of prefixes only has to sort their matches.
+    """
+
+    clauses = parse_query(query_text)
+
+    if not clauses:
+        return Page([], None)
+
+    # the clause whose matches are walked in time order
+    clauses.sort(key=lambda clause: clause[0] == 'prefix')
+    (kind, value), others = clauses[0], clauses[1:]
+
+    query, first = clause_matches(
+        lambda first: Message.query.join(first, first.message_id == Message.id),
+        kind, value)
+    for kind, value in others:
+        query = query.filter(
+            first.message_id.in_(clause_message_ids(kind, value)))
+
+    # a word twice in one message has two rows
+    query = query.distinct(first.timestamp, first.message_id)
+
+    return paginate_by_time(query, first.timestamp, first.message_id,
+                            before=before)
@@ -1,25 +1,37 @@
-"""Seed database with sample data."""
+"""Seed database with sample data.
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follows
+    python seed.py                      # drop everything and load generator/
+    python seed.py --resume             # carry on after a failed load
+    python seed.py --dir data --no-derived
+"""
 
+import argparse
 
-def seed_data():
-    db.drop_all()
-    db.create_all()
+from app import app
+from loader import CHUNK_ROWS, load
 
-    with open('generator/users.csv') as users:
-        db.session.bulk_insert_mappings(User, DictReader(users))
 
-    with open('generator/messages.csv') as messages:
-        db.session.bulk_insert_mappings(Message, DictReader(messages))
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load the generator CSVs.")
+    parser.add_argument("--dir", default="generator",
+                        help="directory holding users/messages/follows.csv")
+    parser.add_argument("--resume", action="store_true",
+                        help="keep existing rows and continue a failed load")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS,
+                        help="rows sent and committed at a time")
+    parser.add_argument("--no-derived", dest="derived", action="store_false",
+                        help="skip rebuilding timelines, counters and the "
+                             "message search index")
+    return parser.parse_args()
 
-    with open('generator/follows.csv') as follows:
-        db.session.bulk_insert_mappings(Follows, DictReader(follows))
 
-    db.session.commit()
+def seed_data(directory="generator", resume=False, chunk_rows=CHUNK_ROWS,
+              derived=True):
+    load(directory, resume=resume, chunk_rows=chunk_rows, derived=derived)
 
 
 if __name__ == "__main__":
-    seed_data()
+    args = parse_args()
+
+    with app.app_context():
+        seed_data(args.dir, args.resume, args.chunk_rows, args.derived)
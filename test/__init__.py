@@ -0,0 +1,16 @@
+"""Tests for Waddle.
+
+Flask-SQLAlchemy needs an app context for the module-level
+db.create_all() calls and the model setup done outside of requests, so
+one is pushed for the whole test run, with the testing settings
+(config.TestingConfig): the test database, and a second one standing in
+for a read replica.
+"""
+
+import os
+
+os.environ['WADDLE_CONFIG'] = "testing"
+
+from app import app
+
+app.app_context().push()
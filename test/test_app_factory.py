@@ -0,0 +1,109 @@
+"""App factory and settings profile tests."""
+
+import os
+import sys
+import tempfile
+from unittest import TestCase, mock
+from models import db, hasher
+
+from app import app, create_app, replica_router
+from config import ProductionConfig, TestingConfig
+
+# create tables once for all tests
+
+db.create_all()
+
+
+class AppFactoryTestCase(TestCase):
+    """Test building apps and what workers forked from them inherit."""
+
+    def test_profiles(self):
+        testing = create_app('testing')
+
+        self.assertIsNot(testing, app)
+        self.assertTrue(testing.config['TESTING'])
+        self.assertIn('waddle.users_show', testing.view_functions)
+        self.assertEqual(testing.test_client().get("/users").status_code, 200)
+
+        # the toolbar is for development, and only imported there
+        self.assertNotIn('flask_debugtoolbar', sys.modules)
+
+        with mock.patch.object(ProductionConfig, 'SECRET_KEY', None):
+            with self.assertRaises(RuntimeError):
+                create_app('production')
+
+        with mock.patch.object(TestingConfig, 'SQLALCHEMY_DATABASE_URI',
+                               'sqlite://'):
+            with self.assertRaises(RuntimeError):
+                create_app('testing')
+
+    def test_apps_side_by_side(self):
+        """Building an app leaves the others' settings and state alone."""
+
+        with mock.patch.multiple(ProductionConfig, SECRET_KEY='secret',
+                                 SQLALCHEMY_BINDS={}):
+            production = create_app('production')
+
+        with production.app_context():
+            self.assertEqual(hasher.workers, 2)
+            self.assertEqual(replica_router.replicas, [])
+
+        # the default app, with the test context pushed
+        self.assertEqual(hasher.workers, 0)
+        self.assertEqual(replica_router.replicas, ['replica_0'])
+        self.assertIsNot(production.extensions['user_cache'],
+                         app.extensions['user_cache'])
+
+    def test_bytecode_cache(self):
+        """Compiled templates are written to JINJA_BYTECODE_CACHE_DIR, for
+        the next worker to load."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.multiple(TestingConfig,
+                                     JINJA_BYTECODE_CACHE=True,
+                                     JINJA_BYTECODE_CACHE_DIR=directory):
+                cached = create_app('testing')
+
+            self.assertEqual(os.listdir(directory), [])
+            cached.test_client().get("/")
+            self.assertGreaterEqual(len(os.listdir(directory)), 2)
+
+    def test_pool_options(self):
+        options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+
+        self.assertEqual(db.engine.pool.size(), options['pool_size'])
+        self.assertEqual(db.engine.pool._max_overflow, options['max_overflow'])
+
+        # binds don't get SQLALCHEMY_ENGINE_OPTIONS; replicas carry them
+        self.assertLessEqual(options.items(),
+                             app.config['SQLALCHEMY_BINDS']['replica_0'].items())
+        replica = db.engines['replica_0']
+        self.assertEqual(replica.pool.size(), options['pool_size'])
+        self.assertEqual(replica.pool._max_overflow, options['max_overflow'])
+        self.assertTrue(ProductionConfig.SQLALCHEMY_ENGINE_OPTIONS
+                        ['pool_pre_ping'])
+
+    def test_fork_gets_empty_pools(self):
+        """A forked child doesn't reuse the parent's pooled connections,
+        and the parent keeps them."""
+
+        with db.engine.connect() as connection:
+            connection.execute(db.text("SELECT 1"))
+        pool = db.engine.pool
+        self.assertGreater(pool.checkedin(), 0)
+
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            os.write(write_end, str(db.engine.pool.checkedin()).encode())
+            os._exit(0)
+
+        os.close(write_end)
+        child_pooled = os.read(read_end, 16)
+        os.close(read_end)
+        os.waitpid(pid, 0)
+
+        self.assertEqual(child_pooled, b"0")
+        self.assertIs(db.engine.pool, pool)
+        self.assertGreater(pool.checkedin(), 0)
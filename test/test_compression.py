@@ -0,0 +1,167 @@
+"""Response compression tests."""
+
+import gzip
+import os
+from unittest import TestCase
+
+import brotli
+from models import db, User, Message, Follows, TimelineEntry
+
+from app import app, CURR_USER_KEY, user_cache, fragment_cache
+from compression import ENCODINGS, compress_static
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+STYLESHEET = os.path.join(app.static_folder, 'stylesheets', 'style.css')
+
+
+class CompressionTestCase(TestCase):
+    """Test which responses are compressed, and how."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.session.expunge_all()
+        user_cache.clear()
+        fragment_cache.clear()
+
+        self.client = app.test_client()
+
+        self.user = User.signup(username="testuser",
+                                email="test@test.com",
+                                password="testuser",
+                                image_url=None)
+        db.session.flush()
+        db.session.add_all(Message(text=f"message number {i}",
+                                   user_id=self.user.id)
+                           for i in range(50))
+        db.session.flush()
+        TimelineEntry.backfill()
+        db.session.commit()
+        self.user_id = self.user.id
+
+    def tearDown(self):
+        """Clear sample data and built static files after each test."""
+
+        TimelineEntry.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        for _, suffix in ENCODINGS:
+            if os.path.exists(STYLESHEET + suffix):
+                os.remove(STYLESHEET + suffix)
+
+    def get_home(self, **headers):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            return c.get("/", headers=headers)
+
+    def test_pages(self):
+        """Pages are compressed with the best encoding the client takes."""
+
+        plain = self.get_home()
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+
+        resp = self.get_home(**{'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+        self.assertLess(len(resp.data) * 4, len(plain.data))
+        self.assertEqual(int(resp.headers['Content-Length']), len(resp.data))
+
+        resp = self.get_home(**{'Accept-Encoding': 'gzip, deflate, br'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(resp.data), plain.data)
+
+        resp = self.get_home(**{'Accept-Encoding': 'br;q=0, gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+
+    def test_etag(self):
+        """A page's ETag is weak, and the 304 for it carries the same one."""
+
+        resp = self.client.get(f"/users/{self.user_id}",
+                               headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertTrue(resp.headers['ETag'].startswith('W/'))
+
+        not_modified = self.client.get(
+            f"/users/{self.user_id}",
+            headers={'Accept-Encoding': 'gzip',
+                     'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.headers['ETag'], resp.headers['ETag'])
+
+        # and the same one whether or not the page went out compressed
+        plain = self.client.get(f"/users/{self.user_id}")
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(plain.headers['ETag'], resp.headers['ETag'])
+
+    def test_skipped(self):
+        """Small responses and other content types go out as they are."""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = c.post("/messages/likes",
+                          json={"message_ids": [1]},
+                          headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(resp.mimetype, 'application/json')
+            self.assertNotIn('Content-Encoding', resp.headers)
+
+        resp = self.client.get("/static/favicon.png",
+                               headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', resp.headers)
+
+    def test_static(self):
+        """Static files are only sent compressed once built."""
+
+        headers = {'Accept-Encoding': 'gzip, br'}
+        with open(STYLESHEET, 'rb') as f:
+            stylesheet = f.read()
+
+        resp = self.client.get("/static/stylesheets/style.css",
+                               headers=headers)
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.get_data(), stylesheet)
+        resp.close()
+
+        built = []
+        compress_static(app.static_folder,
+                        progress=lambda path, written: built.append(path))
+        self.assertIn(STYLESHEET, built)
+        self.assertFalse(os.path.exists(
+            os.path.join(app.static_folder, 'favicon.png.gz')))
+
+        resp = self.client.get("/static/stylesheets/style.css",
+                               headers=headers)
+        self.assertEqual(resp.headers['Content-Encoding'], 'br')
+        self.assertEqual(resp.mimetype, 'text/css')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(brotli.decompress(resp.get_data()), stylesheet)
+        resp.close()
+
+        resp = self.client.get("/static/stylesheets/style.css",
+                               headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(resp.get_data()), stylesheet)
+        resp.close()
+
+        # a copy older than its file isn't served
+        os.utime(STYLESHEET + '.br', ns=(0, 0))
+        resp = self.client.get("/static/stylesheets/style.css",
+                               headers={'Accept-Encoding': 'br'})
+        self.assertNotIn('Content-Encoding', resp.headers)
+        resp.close()
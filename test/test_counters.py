@@ -0,0 +1,132 @@
+"""User counter tests."""
+
+from unittest import TestCase
+from models import db, User, Message, Like, Follows, TimelineEntry
+
+from app import app, CURR_USER_KEY
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CounterTestCase(TestCase):
+    """Test that the denormalized counts follow the write paths."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        self.client = app.test_client()
+
+        self.alice = User.signup(username="alice",
+                                 email="alice@test.com",
+                                 password="password",
+                                 image_url=None)
+        self.bob = User.signup(username="bob",
+                               email="bob@test.com",
+                               password="password",
+                               image_url=None)
+        db.session.commit()
+
+        self.alice_id = self.alice.id
+        self.bob_id = self.bob.id
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def counts(self, user_id):
+        user = User.query.get(user_id)
+        db.session.refresh(user)
+        return dict(messages=user.messages_count,
+                    followers=user.followers_count,
+                    following=user.following_count,
+                    likes=user.likes_count)
+
+    def login(self, client, user_id):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_follow_and_unfollow(self):
+        """Following bumps both sides; unfollowing undoes it."""
+
+        with self.client as c:
+            self.login(c, self.alice_id)
+            c.post(f"/users/follow/{self.bob_id}")
+
+            self.assertEqual(self.counts(self.alice_id)['following'], 1)
+            self.assertEqual(self.counts(self.bob_id)['followers'], 1)
+
+            c.post(f"/users/stop-following/{self.bob_id}")
+
+        self.assertEqual(self.counts(self.alice_id)['following'], 0)
+        self.assertEqual(self.counts(self.bob_id)['followers'], 0)
+
+    def test_post_like_and_delete(self):
+        """Posting and liking count up; deleting the message counts down."""
+
+        with self.client as c:
+            self.login(c, self.alice_id)
+            c.post("/messages/new", data={"text": "count me"})
+            msg_id = Message.query.one().id
+
+            self.login(c, self.bob_id)
+            c.post(f"/messages/{msg_id}/like")
+
+            self.assertEqual(self.counts(self.alice_id)['messages'], 1)
+            self.assertEqual(self.counts(self.bob_id)['likes'], 1)
+
+            self.login(c, self.alice_id)
+            c.post(f"/messages/{msg_id}/delete")
+
+        self.assertEqual(self.counts(self.alice_id)['messages'], 0)
+        self.assertEqual(self.counts(self.bob_id)['likes'], 0)
+
+    def test_release_counts(self):
+        """Removing a user takes them out of other users' counts."""
+
+        msg = Message(text="soon gone", user_id=self.alice_id)
+        db.session.add(msg)
+        db.session.add(Follows(user_being_followed_id=self.alice_id,
+                               user_following_id=self.bob_id))
+        db.session.add(Follows(user_being_followed_id=self.bob_id,
+                               user_following_id=self.alice_id))
+        db.session.flush()
+        db.session.add(Like(user_id=self.bob_id, message_id=msg.id))
+        User.repair_counts()
+        db.session.commit()
+
+        User.release_counts(self.alice_id)
+        User.query.filter_by(id=self.alice_id).delete()
+        db.session.commit()
+
+        self.assertEqual(self.counts(self.bob_id),
+                         dict(messages=0, followers=0, following=0, likes=0))
+
+    def test_repair_counts(self):
+        """Repair recomputes counts from the source tables."""
+
+        db.session.add(Message(text="one", user_id=self.alice_id))
+        db.session.add(Message(text="two", user_id=self.alice_id))
+        db.session.add(Follows(user_being_followed_id=self.alice_id,
+                               user_following_id=self.bob_id))
+        db.session.commit()
+
+        User.repair_counts()
+        db.session.commit()
+
+        self.assertEqual(self.counts(self.alice_id),
+                         dict(messages=2, followers=1, following=0, likes=0))
+        self.assertEqual(self.counts(self.bob_id),
+                         dict(messages=0, followers=0, following=1, likes=0))
@@ -0,0 +1,148 @@
+"""Followers/following page tests."""
+
+import re
+from unittest import TestCase
+from models import db, User, UserCard, Message, Like, Follows, TimelineEntry
+
+from app import app, CURR_USER_KEY, user_cache
+from metrics import record_queries
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FollowPagesTestCase(TestCase):
+    """Test keyset pages of followers and followed users."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.session.expunge_all()
+        user_cache.clear()
+
+        self.client = app.test_client()
+
+        users = [User(username=f"user{i}",
+                      email=f"user{i}@test.com",
+                      password="not-a-real-hash")
+                 for i in range(40)]
+        db.session.add_all(users)
+        db.session.flush()
+
+        # user0 is popular and follows everyone back; user1 views the pages
+        # and follows every other one of user0's followers
+        self.star, self.viewer, *self.fans = users
+        db.session.add_all(
+            [Follows(user_being_followed_id=self.star.id,
+                     user_following_id=user.id) for user in users[1:]] +
+            [Follows(user_being_followed_id=user.id,
+                     user_following_id=self.star.id) for user in users[1:]] +
+            [Follows(user_being_followed_id=fan.id,
+                     user_following_id=self.viewer.id)
+             for fan in self.fans[::2]])
+        db.session.commit()
+
+        self.star_id = self.star.id
+        self.viewer_id = self.viewer.id
+        self.others = sorted(user.id for user in users[1:])
+        self.viewer_follows = {fan.id for fan in self.fans[::2]}
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_pages_cover_everything_once(self):
+        """Walking the cursors visits each follow once, in id order."""
+
+        for page_of in [UserCard.followers, UserCard.following]:
+            seen = []
+            after = None
+
+            while True:
+                cards, after = page_of(self.star_id, after=after, per_page=7)
+                seen.extend(card.id for card in cards)
+                if after is None:
+                    break
+
+            self.assertEqual(seen, self.others)
+
+    def test_show_pages_check_one_follow(self):
+        """A profile or message page checks whether the viewer follows
+        just the user it shows, not everyone the viewer follows."""
+
+        followed, unfollowed = self.fans[0], self.fans[1]
+        message = Message(text="hello", user_id=unfollowed.id)
+        db.session.add(message)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+
+            for path, user_id, follows in [
+                    (f"/users/{followed.id}", followed.id, True),
+                    (f"/users/{unfollowed.id}", unfollowed.id, False),
+                    (f"/messages/{message.id}", unfollowed.id, False)]:
+                with record_queries() as statements:
+                    html = c.get(path).get_data(as_text=True)
+
+                follow_checks = [s for s in statements
+                                 if "follows.user_being_followed_id IN" in s]
+                self.assertEqual(len(follow_checks), 1, path)
+                self.assertEqual(
+                    f"/users/stop-following/{user_id}" in html, follows, path)
+                self.assertEqual(
+                    f"/users/follow/{user_id}" in html, not follows, path)
+
+    def test_pages(self):
+        """A page shows 30 users with a link to the rest, and checks
+        follow state for just those in one query."""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+
+            for path in [f"/users/{self.star_id}/followers",
+                         f"/users/{self.star_id}/following"]:
+                with record_queries() as statements:
+                    html = c.get(path).get_data(as_text=True)
+
+                self.assertLessEqual(len(statements), 4)
+                follow_checks = [s for s in statements
+                                 if "follows.user_being_followed_id IN" in s]
+                self.assertEqual(len(follow_checks), 1)
+
+                page = set(self.others[:30])
+                unfollow = {int(m) for m in
+                            re.findall(r'/users/stop-following/(\d+)', html)}
+                follow = {int(m) for m in
+                          re.findall(r'/users/follow/(\d+)', html)}
+
+                # the viewer follows the profile's owner too
+                self.assertEqual(unfollow,
+                                 (self.viewer_follows & page) | {self.star_id})
+                # and has no button for themselves
+                self.assertEqual(follow,
+                                 page - self.viewer_follows - {self.viewer_id})
+
+                more = re.search(r'href="([^"]+\?after=(\d+))"', html)
+                self.assertEqual(int(more.group(2)), self.others[29])
+
+                rest = c.get(more.group(1)).get_data(as_text=True)
+                shown = {int(m) for m in
+                         re.findall(r'href="/users/(\d+)" class="card-link"',
+                                    rest)}
+                self.assertEqual(shown, set(self.others[30:]))
+                self.assertNotIn("?after=", rest)
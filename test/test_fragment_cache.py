@@ -0,0 +1,206 @@
+"""Template fragment cache tests."""
+
+from datetime import datetime
+from unittest import TestCase
+from models import db, User, Message, Like, Follows, TimelineEntry, hasher
+
+from app import app, CURR_USER_KEY, fragment_cache, user_cache
+from fragment_cache import FragmentCache
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test the LRU on its own."""
+
+    def user(self, user_id):
+        return User(id=user_id, updated_at=datetime(2020, 1, 1),
+                    profile_updated_at=datetime(2020, 1, 1))
+
+    def test_hit_and_miss(self):
+        cache = FragmentCache()
+        renders = []
+
+        def render():
+            renders.append(1)
+            return "fragment"
+
+        self.assertEqual(cache.render(["card", self.user(1)], render), "fragment")
+        self.assertEqual(cache.render(["card", self.user(1)], render), "fragment")
+        cache.render(["card", self.user(2)], render)
+
+        self.assertEqual(len(renders), 2)
+        self.assertEqual(cache.stats(), dict(size=2, hits=1, misses=2,
+                                             evictions=0, invalidations=0))
+
+    def test_new_version_misses(self):
+        """A user with a new updated_at gets a new fragment."""
+
+        cache = FragmentCache()
+        cache.render(["card", self.user(1)], lambda: "old")
+
+        changed = self.user(1)
+        changed.updated_at = datetime(2021, 1, 1)
+
+        self.assertEqual(cache.render(["card", changed], lambda: "new"), "new")
+
+    def test_message_keyed_on_profile(self):
+        """A message's fragment outlives its author's counter updates, not
+        their profile edits."""
+
+        cache = FragmentCache()
+        author = self.user(1)
+        cache.render(["message", Message(id=10, user=author)], lambda: "old")
+
+        author.updated_at = datetime(2021, 1, 1)
+        self.assertEqual(cache.render(["message", Message(id=10, user=author)],
+                                      lambda: "new"), "old")
+
+        author.profile_updated_at = datetime(2021, 1, 1)
+        self.assertEqual(cache.render(["message", Message(id=10, user=author)],
+                                      lambda: "new"), "new")
+
+    def test_bounded(self):
+        """Past max_size the least recently used fragment goes."""
+
+        cache = FragmentCache(max_size=2)
+        cache.render(["card", self.user(1)], lambda: "1")
+        cache.render(["card", self.user(2)], lambda: "2")
+        cache.render(["card", self.user(1)], lambda: "1")
+        cache.render(["card", self.user(3)], lambda: "3")
+
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.render(["card", self.user(1)], lambda: "x"), "1")
+        self.assertEqual(cache.render(["card", self.user(2)], lambda: "x"), "x")
+
+    def test_invalidate(self):
+        """Invalidating a user drops their fragments and their messages'."""
+
+        cache = FragmentCache()
+        author = self.user(1)
+        msg = Message(id=10, user=author)
+
+        cache.render(["card", author], lambda: "card")
+        cache.render(["message", msg], lambda: "message")
+        cache.render(["card", self.user(2)], lambda: "other")
+
+        cache.invalidate("user", 1)
+
+        self.assertEqual(cache.stats()["size"], 1)
+        self.assertEqual(cache.stats()["invalidations"], 2)
+        self.assertEqual(cache.tagged.keys(), {("user", 2)})
+
+    def test_disabled(self):
+        cache = FragmentCache(max_size=0)
+        cache.render(["card", self.user(1)], lambda: "card")
+
+        self.assertEqual(cache.stats()["size"], 0)
+
+
+class FragmentViewsTestCase(TestCase):
+    """Test fragments in rendered pages."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.session.expunge_all()
+        user_cache.clear()
+        fragment_cache.clear()
+
+        self.client = app.test_client()
+
+        self.author = User(username="author",
+                           email="author@test.com",
+                           password="not-a-real-hash",
+                           bio="Original bio")
+        db.session.add(self.author)
+        db.session.flush()
+        db.session.add(Message(text="hello there", user_id=self.author.id))
+        db.session.commit()
+
+        self.author_id = self.author.id
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_profile_fragments(self):
+        """A profile's fragments are reused, and give the same page."""
+
+        path = f"/users/{self.author_id}"
+
+        first = self.client.get(path).get_data()
+        misses = fragment_cache.stats()["misses"]
+        second = self.client.get(path).get_data()
+
+        self.assertEqual(first, second)
+        self.assertEqual(fragment_cache.stats()["misses"], misses)
+        self.assertGreaterEqual(fragment_cache.stats()["hits"], 3)
+
+        fragment_cache.max_size = 0
+        fragment_cache.clear()
+        try:
+            uncached = self.client.get(path).get_data()
+        finally:
+            fragment_cache.max_size = app.config["FRAGMENT_CACHE_SIZE"]
+
+        self.assertEqual(uncached, first)
+
+    def test_profile_edit_invalidates(self):
+        """Editing a profile drops the old fragments and shows the edit."""
+
+        self.author.password = hasher.hash("password")
+        db.session.commit()
+
+        path = f"/users/{self.author_id}"
+        self.client.get(path)
+        self.assertGreater(fragment_cache.stats()["size"], 0)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.author_id
+
+            c.post("/users/profile", data=dict(username="author",
+                                               email="author@test.com",
+                                               bio="Edited bio",
+                                               password="password"))
+
+            self.assertEqual(fragment_cache.stats()["size"], 0)
+            self.assertIn(b"Edited bio", c.get(path).data)
+
+    def test_like_keeps_message_fragments(self):
+        """Liking changes counters only: the author's message fragments
+        are neither dropped nor rendered again."""
+
+        path = f"/users/{self.author_id}"
+        self.client.get(path)
+        invalidations = fragment_cache.stats()["invalidations"]
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.author_id
+
+            message_id = Message.query.one().id
+            c.post("/messages/likes", json={"message_ids": [message_id]})
+
+        misses = fragment_cache.stats()["misses"]
+        page = self.client.get(path).get_data()
+
+        self.assertEqual(fragment_cache.stats()["invalidations"], invalidations)
+        # only the user's own fragments, keyed on updated_at, are
+        # rendered again: the header, with the new like count, and sidebar
+        self.assertEqual(fragment_cache.stats()["misses"], misses + 2)
+        self.assertIn(b"> 1</a>", page)
@@ -0,0 +1,106 @@
+"""Synthetic data generator tests."""
+
+import csv
+import filecmp
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+from unittest import TestCase
+from models import db, User, Follows
+
+from loader import load
+
+GENERATOR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         "generator", "create_csvs.py")
+
+
+def generate(out, *args):
+    subprocess.run([sys.executable, GENERATOR, "--out", out,
+                    "--users", "200", "--messages", "500", "--follows", "3000",
+                    *args],
+                   check=True, capture_output=True)
+
+
+def read_rows(out, file_name):
+    with open(os.path.join(out, file_name), newline="") as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+class GeneratorTestCase(TestCase):
+    """Test the CSVs create_csvs.py writes."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.out = os.path.join(cls.directory, "a")
+        generate(cls.out)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+        db.session.rollback()
+        db.drop_all()
+        db.create_all()
+
+    def test_deterministic(self):
+        """The same seed gives the same files; another seed doesn't."""
+
+        again = os.path.join(self.directory, "b")
+        generate(again)
+        other = os.path.join(self.directory, "c")
+        generate(other, "--seed", "other")
+
+        for file_name in ["users.csv", "messages.csv", "follows.csv"]:
+            self.assertTrue(filecmp.cmp(os.path.join(self.out, file_name),
+                                        os.path.join(again, file_name),
+                                        shallow=False))
+            self.assertFalse(filecmp.cmp(os.path.join(self.out, file_name),
+                                         os.path.join(other, file_name),
+                                         shallow=False))
+
+    def test_follows(self):
+        """Follows are distinct, never self-follows, and top-heavy."""
+
+        follows = [(row["user_being_followed_id"], row["user_following_id"])
+                   for row in read_rows(self.out, "follows.csv")]
+
+        self.assertEqual(len(follows), 3000)
+        self.assertEqual(len(set(follows)), len(follows))
+        self.assertFalse([pair for pair in follows if pair[0] == pair[1]])
+
+        followers = Counter(followed for followed, _ in follows)
+        counts = sorted(followers.values(), reverse=True)
+        # the most followed user has many times the median
+        self.assertGreater(counts[0], 5 * counts[len(counts) // 2])
+
+    def test_dense_follows(self):
+        """Every follow asked for is written, up to everyone following
+        everyone else."""
+
+        for users, follows in [(50, 2000), (3, 6)]:
+            out = os.path.join(self.directory, f"dense-{users}")
+            generate(out, "--users", str(users), "--follows", str(follows))
+
+            pairs = {(row["user_being_followed_id"], row["user_following_id"])
+                     for row in read_rows(out, "follows.csv")}
+            self.assertEqual(len(pairs), follows)
+
+    def test_users_unique(self):
+        """Usernames and emails never collide."""
+
+        users = read_rows(self.out, "users.csv")
+
+        self.assertEqual(len({user["username"] for user in users}), 200)
+        self.assertEqual(len({user["email"] for user in users}), 200)
+
+    def test_loads(self):
+        """The output loads cleanly through the seed loader."""
+
+        load(self.out, progress=lambda *args: None)
+
+        self.assertEqual(User.query.count(), 200)
+        self.assertEqual(Follows.query.count(), 3000)
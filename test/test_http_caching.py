@@ -0,0 +1,214 @@
+"""HTTP caching tests."""
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+from werkzeug.http import http_date
+from models import db, User, Message, Like, Follows, TimelineEntry
+
+from app import app, CURR_USER_KEY, user_cache
+from metrics import record_queries
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class HTTPCachingTestCase(TestCase):
+    """Test cache policies, conditional GETs and static URLs."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.session.expunge_all()
+        user_cache.clear()
+
+        self.client = app.test_client()
+
+        # last changed a while ago, so pages get a Last-Modified
+        self.earlier = datetime.utcnow() - timedelta(hours=1)
+
+        self.author = User(username="author",
+                           email="author@test.com",
+                           password="not-a-real-hash",
+                           updated_at=self.earlier)
+        self.viewer = User(username="viewer",
+                           email="viewer@test.com",
+                           password="not-a-real-hash",
+                           updated_at=self.earlier)
+        db.session.add_all([self.author, self.viewer])
+        db.session.flush()
+
+        self.msg = Message(text="hello", user_id=self.author.id,
+                           timestamp=self.earlier)
+        self.other_msg = Message(text="again", user_id=self.author.id,
+                                 timestamp=self.earlier)
+        db.session.add_all([self.msg, self.other_msg])
+        db.session.commit()
+
+        self.author_id = self.author.id
+        self.viewer_id = self.viewer.id
+        self.msg_id = self.msg.id
+        self.other_msg_id = self.other_msg.id
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def login(self, client):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.viewer_id
+
+    def revalidate(self, client, path, resp):
+        return client.get(path, headers={"If-None-Match": resp.headers["ETag"]})
+
+    def test_message_not_modified(self):
+        """A repeat visit to a message page gets a 304 and no render."""
+
+        path = f"/messages/{self.msg_id}"
+
+        with self.client as c:
+            self.login(c)
+            resp = c.get(path)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("ETag", resp.headers)
+            self.assertIn("Last-Modified", resp.headers)
+            self.assertEqual(resp.headers["Cache-Control"], "private, no-cache")
+
+            with record_queries() as statements:
+                again = self.revalidate(c, path, resp)
+
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.get_data(), b"")
+        self.assertEqual(again.headers["ETag"], resp.headers["ETag"])
+        self.assertEqual(len(statements), 1)
+
+    def test_message_changes(self):
+        """The viewer liking something, or the author editing their profile,
+        changes the message page."""
+
+        path = f"/messages/{self.msg_id}"
+
+        with self.client as c:
+            self.login(c)
+            resp = c.get(path)
+
+            c.post(f"/messages/{self.msg_id}/like")
+            liked = self.revalidate(c, path, resp)
+            self.assertEqual(liked.status_code, 200)
+            self.assertIn(b"to-unlike", liked.data)
+
+            User.query.get(self.author_id).bio = "new bio"
+            db.session.commit()
+            self.assertEqual(self.revalidate(c, path, liked).status_code, 200)
+
+    def test_if_modified_since(self):
+        """Without an ETag, a page is 304 to a client with its date."""
+
+        path = f"/messages/{self.msg_id}"
+
+        with self.client as c:
+            self.login(c)
+            resp = c.get(path)
+            since = {"If-Modified-Since": resp.headers["Last-Modified"]}
+            self.assertEqual(c.get(path, headers=since).status_code, 304)
+
+            # but the ETag wins when both are sent
+            stale = c.get(path, headers={**since, "If-None-Match": 'W/"x"'})
+            self.assertEqual(stale.status_code, 200)
+
+    def test_changed_this_second(self):
+        """A page changed in the last second has no Last-Modified, and
+        If-Modified-Since alone can't get a 304 for it: another change in
+        the same second would have the same date."""
+
+        msg = Message(text="just now", user_id=self.author_id)
+        db.session.add(msg)
+        db.session.commit()
+        path = f"/messages/{msg.id}"
+
+        with self.client as c:
+            self.login(c)
+            resp = c.get(path)
+            self.assertNotIn("Last-Modified", resp.headers)
+
+            since = {"If-Modified-Since": http_date(datetime.utcnow())}
+            self.assertEqual(c.get(path, headers=since).status_code, 200)
+            self.assertEqual(self.revalidate(c, path, resp).status_code, 304)
+
+    def test_viewers_differ(self):
+        """Logged-out and logged-in visitors get different ETags."""
+
+        path = f"/messages/{self.msg_id}"
+        anon = self.client.get(path)
+
+        with self.client as c:
+            self.login(c)
+            self.assertEqual(self.revalidate(c, path, anon).status_code, 200)
+
+    def test_user_page(self):
+        """A profile is 304 until the user posts."""
+
+        path = f"/users/{self.author_id}"
+
+        with self.client as c:
+            self.login(c)
+            resp = c.get(path)
+            self.assertEqual(self.revalidate(c, path, resp).status_code, 304)
+
+            User.adjust_counts(self.author_id, messages_count=1)
+            db.session.commit()
+            self.assertEqual(self.revalidate(c, path, resp).status_code, 200)
+
+    def test_missing(self):
+        self.assertEqual(self.client.get("/messages/0").status_code, 404)
+        self.assertEqual(self.client.get("/users/0").status_code, 404)
+
+    def test_flashes_not_cached(self):
+        """A page showing a flash gets no validators."""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess["_flashes"] = [("success", "Hello!")]
+            resp = c.get(f"/users/{self.author_id}")
+
+        self.assertIn(b"Hello!", resp.data)
+        self.assertNotIn("ETag", resp.headers)
+
+    def test_policies(self):
+        """Forms aren't stored; other pages must be revalidated."""
+
+        self.assertEqual(self.client.get("/login").headers["Cache-Control"],
+                         "no-store")
+        self.assertEqual(self.client.get("/users").headers["Cache-Control"],
+                         "private, no-cache")
+
+    def test_static(self):
+        """Static URLs in pages are hashed, and those can be kept forever."""
+
+        html = self.client.get("/login").get_data(as_text=True)
+        self.assertIn("/static/stylesheets/style.css?v=", html)
+
+        start = html.index("/static/stylesheets/style.css?v=")
+        url = html[start:html.index('"', start)]
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["Cache-Control"],
+                         "public, max-age=31536000, immutable")
+        resp.close()
+
+        resp = self.client.get("/static/stylesheets/style.css")
+        self.assertEqual(resp.headers["Cache-Control"], "public, max-age=3600")
+        resp.close()
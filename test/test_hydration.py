@@ -0,0 +1,88 @@
+"""Message hydration tests."""
+
+from unittest import TestCase
+from models import db, User, Message, Like, Follows, TimelineEntry
+
+from app import app, CURR_USER_KEY
+from feeds import hydrate_messages
+from metrics import record_queries
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+
+class HydrationTestCase(TestCase):
+    """Test that message lists load authors and likes in batches."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        self.client = app.test_client()
+
+        self.viewer = User.signup(username="viewer",
+                                  email="viewer@test.com",
+                                  password="password",
+                                  image_url=None)
+        db.session.commit()
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def add_authors(self, count, prefix="author"):
+        """Have the viewer follow `count` new users with a liked message each."""
+
+        for i in range(count):
+            author = User.signup(username=f"{prefix}{i}",
+                                 email=f"{prefix}{i}@test.com",
+                                 password="password",
+                                 image_url=None)
+            db.session.flush()
+            db.session.add(Follows(user_being_followed_id=author.id,
+                                   user_following_id=self.viewer.id))
+            msg = Message(text=f"message {i}", user_id=author.id)
+            db.session.add(msg)
+            db.session.flush()
+            db.session.add(Like(user_id=self.viewer.id, message_id=msg.id))
+
+        TimelineEntry.backfill()
+        db.session.commit()
+
+    def home_query_count(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer.id
+
+            with record_queries() as statements:
+                resp = c.get("/")
+
+        self.assertEqual(resp.status_code, 200)
+        return len(statements)
+
+    def test_liked_ids(self):
+        """Only the viewer's likes for the given messages come back."""
+
+        self.add_authors(3)
+        messages = Message.query.order_by(Message.id).all()
+
+        self.assertEqual(hydrate_messages(messages[:2], self.viewer),
+                         {messages[0].id, messages[1].id})
+        self.assertEqual(hydrate_messages(messages, None), set())
+
+    def test_home_query_count_is_flat(self):
+        """Rendering the home feed costs the same with 2 or 20 messages."""
+
+        self.add_authors(2)
+        small = self.home_query_count()
+
+        self.add_authors(18, prefix="more")
+
+        self.assertEqual(self.home_query_count(), small)
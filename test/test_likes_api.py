@@ -0,0 +1,197 @@
+"""Like endpoint and likes page tests."""
+
+import re
+from datetime import datetime, timedelta
+from unittest import TestCase
+from models import db, User, Message, Like, Follows, TimelineEntry
+
+from app import app, CURR_USER_KEY, MAX_LIKE_BATCH, user_cache
+from metrics import record_queries
+from pagination import PAGE_SIZE
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LikesAPITestCase(TestCase):
+    """Test /messages/likes, the form like/unlike routes and likes pages."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.session.expunge_all()
+        user_cache.clear()
+
+        self.client = app.test_client()
+
+        self.author = User(username="author",
+                           email="author@test.com",
+                           password="not-a-real-hash")
+        self.fan = User(username="fan",
+                        email="fan@test.com",
+                        password="not-a-real-hash")
+        db.session.add_all([self.author, self.fan])
+        db.session.flush()
+
+        messages = [Message(text=f"message {i}", user_id=self.author.id)
+                    for i in range(3)]
+        db.session.add_all(messages)
+        db.session.commit()
+
+        self.fan_id = self.fan.id
+        self.msg_ids = [msg.id for msg in messages]
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def login(self, client):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.fan_id
+
+    def liked(self):
+        return {message_id for (message_id,) in
+                db.session.query(Like.message_id)
+                .filter(Like.user_id == self.fan_id)}
+
+    def likes_count(self):
+        return db.session.query(User.likes_count).filter(
+            User.id == self.fan_id).scalar()
+
+    def test_like_batch(self):
+        """A batch of likes is one statement, and reports the new count."""
+
+        with self.client as c:
+            self.login(c)
+
+            with record_queries() as statements:
+                resp = c.post("/messages/likes",
+                              json={"message_ids": self.msg_ids[:2]})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json, {"likes_count": 2})
+        self.assertEqual(resp.headers["Cache-Control"], "no-store")
+        self.assertEqual(
+            len([s for s in statements if "INSERT INTO likes" in s]), 1)
+        self.assertFalse([s for s in statements if s.startswith("SELECT")
+                          and "FROM likes" in s])
+        self.assertEqual(self.liked(), set(self.msg_ids[:2]))
+        self.assertEqual(self.likes_count(), 2)
+
+    def test_like_twice(self):
+        """Repeating a like, or liking a missing message, changes nothing."""
+
+        with self.client as c:
+            self.login(c)
+            c.post("/messages/likes", json={"message_ids": [self.msg_ids[0]]})
+            resp = c.post("/messages/likes",
+                          json={"message_ids": [self.msg_ids[0],
+                                                self.msg_ids[0], 0]})
+
+            # the form route used to fail on the primary key here
+            c.post(f"/messages/{self.msg_ids[0]}/like")
+
+        self.assertEqual(resp.json, {"likes_count": 1})
+        self.assertEqual(self.liked(), {self.msg_ids[0]})
+        self.assertEqual(self.likes_count(), 1)
+
+    def test_unlike_batch(self):
+        """Unliking removes only likes that exist."""
+
+        with self.client as c:
+            self.login(c)
+            c.post("/messages/likes", json={"message_ids": self.msg_ids})
+            resp = c.delete("/messages/likes",
+                            json={"message_ids": self.msg_ids[1:] + [0]})
+            again = c.delete("/messages/likes",
+                             json={"message_ids": self.msg_ids[1:]})
+
+        self.assertEqual(resp.json, {"likes_count": 1})
+        self.assertEqual(again.json, {"likes_count": 1})
+        self.assertEqual(self.liked(), {self.msg_ids[0]})
+
+    def test_rejected(self):
+        """Logged-out, non-JSON and malformed requests change nothing."""
+
+        anon = self.client.post("/messages/likes",
+                                json={"message_ids": self.msg_ids})
+        self.assertEqual(anon.status_code, 401)
+
+        with self.client as c:
+            self.login(c)
+
+            form = c.post("/messages/likes",
+                          data={"message_ids": self.msg_ids[0]})
+            self.assertEqual(form.status_code, 415)
+
+            # JSON that isn't an object, then objects without a good list
+            for body in [[1], 1, "message_ids",
+                         {}, {"message_ids": []}, {"message_ids": "1"},
+                         {"message_ids": ["1"]},
+                         {"message_ids": [1] * (MAX_LIKE_BATCH + 1)}]:
+                resp = c.post("/messages/likes", json=body)
+                self.assertEqual(resp.status_code, 400, body)
+
+        self.assertEqual(self.liked(), set())
+        self.assertEqual(self.likes_count(), 0)
+
+    def test_likes_page(self):
+        """The likes page lists likes newest first, a page at a time, with
+        the same number of queries however many authors are on it."""
+
+        authors = [User(username=f"author{i}",
+                        email=f"author{i}@test.com",
+                        password="not-a-real-hash")
+                   for i in range(PAGE_SIZE + 1)]
+        db.session.add_all(authors)
+        db.session.flush()
+
+        # liked in the opposite order to posting, so like time and message
+        # time disagree
+        start = datetime(2020, 1, 1)
+        messages = [Message(text=f"liked {i}", user_id=author.id,
+                            timestamp=start + timedelta(minutes=i))
+                    for i, author in enumerate(authors)]
+        db.session.add_all(messages)
+        db.session.flush()
+        db.session.add_all([Like(user_id=self.fan_id, message_id=msg.id,
+                                 created_at=start - timedelta(minutes=i))
+                            for i, msg in enumerate(messages)])
+        db.session.commit()
+
+        liked_order = [msg.id for msg in messages]
+
+        with self.client as c:
+            self.login(c)
+
+            with record_queries() as statements:
+                first = c.get(f"/users/{self.fan_id}/likes")
+            html = first.get_data(as_text=True)
+
+            self.assertLessEqual(len(statements), 4)
+            shown = [int(m) for m in re.findall(r'class="to-unlike" id="(\d+)"',
+                                                html)]
+            self.assertEqual(shown, liked_order[:PAGE_SIZE])
+
+            older = re.search(r'href="(/users/\d+/likes\?before=[^"]+)"', html)
+            second = c.get(older.group(1)).get_data(as_text=True)
+
+        shown = [int(m) for m in re.findall(r'class="to-unlike" id="(\d+)"',
+                                            second)]
+        self.assertEqual(shown, liked_order[PAGE_SIZE:])
+        self.assertNotIn("likes?before=", second)
+
+    def test_likes_page_missing_user(self):
+        self.assertEqual(self.client.get("/users/0/likes").status_code, 404)
@@ -0,0 +1,129 @@
+"""Bulk loader tests."""
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from models import db, User, Message, Follows, TimelineEntry, MessageTerm
+
+from loader import load, rows_loaded
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+USERS_CSV = """id,email,username,image_url,password,bio,header_image_url,location
+1,a@test.com,alpha,/a.png,hash,Bio a,/ha.png,Here
+2,b@test.com,bravo,/b.png,hash,,/hb.png,There
+3,c@test.com,{third_username},/c.png,hash,Bio c,/hc.png,
+4,d@test.com,delta,/d.png,hash,,/hd.png,
+"""
+
+MESSAGES_CSV = """text,timestamp,user_id
+first post,2020-01-01 10:00:00.000000,1
+"with, a comma",2020-01-02 10:00:00.000000,2
+third,2020-01-03 10:00:00.000000,{third_user}
+fourth,2020-01-04 10:00:00.000000,1
+"""
+
+FOLLOWS_CSV = """user_being_followed_id,user_following_id
+1,2
+1,3
+2,1
+"""
+
+
+class LoaderTestCase(TestCase):
+    """Test chunked, resumable loading of the generator CSVs."""
+
+    def setUp(self):
+        """Write sample CSVs to a scratch directory."""
+
+        self.directory = tempfile.mkdtemp()
+        self.write_csvs()
+        self.progress = []
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        shutil.rmtree(self.directory)
+
+        db.session.rollback()
+        db.drop_all()
+        db.create_all()
+
+    def write_csvs(self, third_user=3, third_username="charlie"):
+        for name, contents in [
+            ("users.csv", USERS_CSV.format(third_username=third_username)),
+            ("messages.csv", MESSAGES_CSV.format(third_user=third_user)),
+            ("follows.csv", FOLLOWS_CSV),
+        ]:
+            with open(os.path.join(self.directory, name), "w") as csv_file:
+                csv_file.write(contents)
+
+    def record(self, path, rows, started):
+        self.progress.append((os.path.basename(path), rows))
+
+    def test_load(self):
+        """Every row lands, in chunks, and derived tables are rebuilt."""
+
+        load(self.directory, chunk_rows=2, progress=self.record)
+
+        self.assertEqual(User.query.count(), 4)
+        self.assertEqual(Message.query.count(), 4)
+        self.assertEqual(Follows.query.count(), 3)
+        self.assertEqual(User.query.get(1).followers_count, 2)
+        self.assertEqual(User.query.get(2).bio, None)
+        self.assertGreater(TimelineEntry.query.count(), 0)
+        self.assertGreater(MessageTerm.query.count(), 0)
+        self.assertIn(("messages.csv", 2), self.progress)
+        self.assertIn(("messages.csv", 4), self.progress)
+
+    def test_resume(self):
+        """A failed load picks up after its last committed chunk."""
+
+        # user 99 doesn't exist, so the second messages chunk fails
+        self.write_csvs(third_user=99)
+
+        with self.assertRaises(Exception):
+            load(self.directory, chunk_rows=2, progress=self.record)
+        db.session.rollback()
+
+        messages_path = os.path.join(self.directory, "messages.csv")
+        self.assertEqual(rows_loaded(messages_path), 2)
+        self.assertEqual(Message.query.count(), 2)
+
+        self.write_csvs()
+        load(self.directory, resume=True, chunk_rows=2, progress=self.record)
+
+        self.assertEqual(User.query.count(), 4)
+        self.assertEqual(Message.query.count(), 4)
+        self.assertEqual(rows_loaded(messages_path), 0)
+
+    def test_resume_users(self):
+        """Users loaded again after a failed chunk keep their ids, and new
+        users are numbered after them."""
+
+        # a duplicate username fails the second users chunk
+        self.write_csvs(third_username="alpha")
+
+        with self.assertRaises(Exception):
+            load(self.directory, chunk_rows=2, progress=self.record)
+        db.session.rollback()
+
+        users_path = os.path.join(self.directory, "users.csv")
+        self.assertEqual(rows_loaded(users_path), 2)
+
+        self.write_csvs()
+        load(self.directory, resume=True, chunk_rows=2, progress=self.record)
+
+        self.assertEqual(User.query.get(3).username, "charlie")
+        self.assertEqual(User.query.get(4).username, "delta")
+        self.assertEqual(Message.query.count(), 4)
+        self.assertEqual(Follows.query.count(), 3)
+
+        user = User.signup(username="echo", email="e@test.com",
+                           password="password", image_url=None)
+        db.session.commit()
+        self.assertEqual(user.id, 5)
@@ -0,0 +1,92 @@
+"""Load-test harness tests."""
+
+import os
+import sys
+from random import Random
+from unittest import TestCase
+from models import db, User, Message, Follows
+
+from app import app
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "benchmarks"))
+
+from loadtest import (load_state, generate_workload, sign_in,
+                      InProcessClient, run, summarize, compare, percentile)
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+
+class LoadTestTestCase(TestCase):
+    """Test generating, sending and judging a traffic mix."""
+
+    def setUp(self):
+        """Add a few users, messages and follows to drive traffic at."""
+
+        users = [User(username=f"user{i}",
+                      email=f"user{i}@test.com",
+                      password="not-a-real-hash")
+                 for i in range(6)]
+        db.session.add_all(users)
+        db.session.flush()
+
+        db.session.add_all([Message(text=f"message {i}", user_id=user.id)
+                            for i, user in enumerate(users)])
+        db.session.add(Follows(user_being_followed_id=users[0].id,
+                               user_following_id=users[1].id))
+        db.session.commit()
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        db.session.rollback()
+        db.drop_all()
+        db.create_all()
+
+    def test_run(self):
+        """Generated traffic is valid and summarized per route."""
+
+        state = load_state(3, Random(1))
+        requests = generate_workload(80, Random(1), state)
+        credentials = sign_in(app, {request["user_id"] for request in requests})
+
+        samples, wall_seconds = run(InProcessClient(app, credentials), requests)
+
+        results = summarize(samples, wall_seconds)
+
+        self.assertEqual(sum(result["count"] for result in results.values()), 80)
+        self.assertEqual([result for result in results.values()
+                          if result["errors"]], [])
+        self.assertGreater(results["home"]["sql"], 0)
+
+    def test_workload_deterministic(self):
+        """The same seed gives the same requests."""
+
+        first = generate_workload(50, Random(7), load_state(3, Random(7)))
+        second = generate_workload(50, Random(7), load_state(3, Random(7)))
+
+        self.assertEqual(first, second)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([5], 95), 5)
+
+    def test_compare(self):
+        """Slower, chattier or failing routes are regressions."""
+
+        baseline = dict(home=dict(count=10, errors=0, p95=10.0, sql=3.0))
+
+        self.assertEqual(
+            compare(dict(home=dict(count=10, errors=0, p95=11.0, sql=3.0)),
+                    baseline),
+            [])
+        self.assertEqual(
+            len(compare(dict(home=dict(count=10, errors=1, p95=20.0, sql=4.0)),
+                        baseline)),
+            3)
@@ -0,0 +1,135 @@
+"""Message search tests."""
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+from models import db, User, Message, MessageTerm, TimelineEntry
+
+from app import app, CURR_USER_KEY
+from pagination import encode_cursor
+from search import (parse_query, search_messages, index_message,
+                    reindex_messages)
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class MessageSearchTestCase(TestCase):
+    """Test the inverted index and the search endpoint."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        self.client = app.test_client()
+
+        self.user = User.signup(username="testuser",
+                                email="test@test.com",
+                                password="testuser",
+                                image_url=None)
+        db.session.commit()
+
+        start = datetime(2020, 1, 1)
+        for minutes, text in enumerate([
+            "Fish for dinner again",
+            "Dinner was fish, again",
+            "The fishing boat is late",
+            "Nothing to see here",
+        ]):
+            msg = Message(text=text,
+                          user_id=self.user.id,
+                          timestamp=start + timedelta(minutes=minutes))
+            db.session.add(msg)
+            db.session.flush()
+            index_message(msg)
+        db.session.commit()
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        MessageTerm.query.delete()
+        TimelineEntry.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def texts(self, query_text, before=None):
+        messages, _ = search_messages(query_text, before=before)
+        return [msg.text for msg in messages]
+
+    def test_parse_query(self):
+        """Words, prefixes and phrases are split into clauses."""
+
+        self.assertEqual(parse_query('Fish* "for Dinner" late'),
+                         [('prefix', 'fish'),
+                          ('phrase', ['for', 'dinner']),
+                          ('word', 'late')])
+
+    def test_words_newest_first(self):
+        """Every word must match, and results are newest first."""
+
+        self.assertEqual(self.texts("fish dinner"),
+                         ["Dinner was fish, again", "Fish for dinner again"])
+
+    def test_prefix(self):
+        """A trailing * matches any word starting with the prefix."""
+
+        self.assertEqual(self.texts("fish*"),
+                         ["The fishing boat is late",
+                          "Dinner was fish, again",
+                          "Fish for dinner again"])
+
+    def test_phrase(self):
+        """Quoted words must appear next to each other in order."""
+
+        self.assertEqual(self.texts('"fish for dinner"'),
+                         ["Fish for dinner again"])
+        self.assertEqual(self.texts('"dinner fish"'), [])
+
+    def test_pages(self):
+        """The cursor continues from the last result."""
+
+        messages, cursor = search_messages("again")
+        self.assertIsNone(cursor)
+
+        newest = messages[0]
+        older, _ = search_messages(
+            "again", before=encode_cursor(newest.timestamp, newest.id))
+        self.assertEqual([msg.text for msg in older], ["Fish for dinner again"])
+
+    def test_index_follows_writes(self):
+        """Posting indexes a message and deleting it removes it."""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user.id
+
+            c.post("/messages/new", data={"text": "penguins on parade"})
+            self.assertEqual(self.texts("parade"), ["penguins on parade"])
+
+            msg = Message.query.filter_by(text="penguins on parade").one()
+            c.post(f"/messages/{msg.id}/delete")
+
+        self.assertEqual(self.texts("parade"), [])
+
+    def test_reindex(self):
+        """Reindexing rebuilds the index from the messages table."""
+
+        MessageTerm.query.delete()
+        reindex_messages(batch_size=2)
+        db.session.commit()
+
+        self.assertEqual(self.texts("boat"), ["The fishing boat is late"])
+
+    def test_search_view(self):
+        """The search page renders matching messages."""
+
+        resp = self.client.get("/messages/search?q=boat")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"The fishing boat is late", resp.data)
+        self.assertNotIn(b"Nothing to see here", resp.data)
@@ -0,0 +1,170 @@
+"""Request metrics and query budget tests."""
+
+from unittest import TestCase
+from models import db, User, Message, Like, Follows, TimelineEntry
+
+from app import app, CURR_USER_KEY, request_metrics, user_cache
+from metrics import QueryStats, record_queries
+from search import reindex_messages
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+# the most statements each page may run, however much data is on it;
+# raising one of these should be a deliberate choice
+QUERY_BUDGETS = {
+    "/": 4,
+    "/users": 3,
+    "/users?q=user": 2,
+    "/users/{viewer}": 3,
+    "/users/{author}": 6,
+    "/users/{viewer}/following": 3,
+    "/users/{viewer}/followers": 3,
+    "/users/{viewer}/likes": 4,
+    "/messages/{message}": 5,
+    "/messages/search?q=message": 4,
+}
+
+
+class MetricsTestCase(TestCase):
+    """Test per-request SQL counting and its exports."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.session.expunge_all()
+        user_cache.clear()
+        request_metrics.reset()
+
+        self.client = app.test_client()
+
+        self.viewer = User(username="viewer",
+                           email="viewer@test.com",
+                           password="not-a-real-hash")
+        db.session.add(self.viewer)
+        db.session.commit()
+        self.viewer_id = self.viewer.id
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def add_authors(self, count, prefix="author"):
+        """Have the viewer follow and be followed by `count` new users, and
+        like a message from each."""
+
+        for i in range(count):
+            author = User(username=f"{prefix}{i}",
+                          email=f"{prefix}{i}@test.com",
+                          password="not-a-real-hash")
+            db.session.add(author)
+            db.session.flush()
+            db.session.add_all([
+                Follows(user_being_followed_id=author.id,
+                        user_following_id=self.viewer_id),
+                Follows(user_being_followed_id=self.viewer_id,
+                        user_following_id=author.id),
+            ])
+            msg = Message(text=f"message {i}", user_id=author.id)
+            db.session.add(msg)
+            db.session.flush()
+            db.session.add(Like(user_id=self.viewer_id, message_id=msg.id))
+            self.message_id = msg.id
+            self.author_id = author.id
+
+        TimelineEntry.backfill()
+        User.repair_counts()
+        reindex_messages()
+        db.session.commit()
+
+    def login(self, client):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.viewer_id
+
+    def test_server_timing(self):
+        """Responses carry the request's SQL count and time."""
+
+        with self.client as c:
+            self.login(c)
+            with record_queries() as statements:
+                resp = c.get(f"/users/{self.viewer_id}")
+
+        timing = resp.headers["Server-Timing"]
+        self.assertIn(f'desc="{len(statements)} queries"', timing)
+        self.assertIn("db;dur=", timing)
+        self.assertIn("total;dur=", timing)
+
+    def test_metrics_endpoint(self):
+        """/metrics reports per-endpoint totals in Prometheus format."""
+
+        self.client.get(f"/users/{self.viewer_id}")
+        self.client.get(f"/users/{self.viewer_id}")
+
+        resp = self.client.get("/metrics")
+        body = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        self.assertIn('waddle_requests_total{endpoint="waddle.users_show",'
+                      'method="GET",status="200"} 2', body)
+        self.assertIn('waddle_request_duration_seconds_count'
+                      '{endpoint="waddle.users_show"} 2', body)
+        self.assertIn('waddle_sql_queries_total{endpoint="waddle.users_show"}', body)
+
+    def test_repeated_statements(self):
+        """A statement run past the threshold is logged and counted."""
+
+        request_metrics.repeat_threshold = 1
+        try:
+            with self.assertLogs(app.logger, "WARNING") as logs:
+                self.client.get(f"/users/{self.viewer_id}")
+        finally:
+            request_metrics.repeat_threshold = app.config["SQL_REPEAT_THRESHOLD"]
+
+        self.assertIn("possible N+1", logs.output[0])
+        body = self.client.get("/metrics").get_data(as_text=True)
+        self.assertNotIn('waddle_sql_repeated_statements_total'
+                         '{endpoint="waddle.users_show"} 0', body)
+
+    def test_query_stats(self):
+        stats = QueryStats()
+        for user_id in range(3):
+            stats.record("SELECT * FROM users WHERE id = %(id)s", 0.001)
+        stats.record("SELECT * FROM messages", 0.001)
+
+        self.assertEqual(stats.count, 4)
+        self.assertEqual(stats.repeated(3),
+                         {"SELECT * FROM users WHERE id = %(id)s": 3})
+
+    def test_query_budgets(self):
+        """No page goes over its query budget, with little or more data."""
+
+        for authors in [2, 20]:
+            self.add_authors(authors - getattr(self, "authors", 0),
+                             prefix=f"author{authors}-")
+            self.authors = authors
+
+            for path, budget in QUERY_BUDGETS.items():
+                path = path.format(viewer=self.viewer_id,
+                                   author=self.author_id,
+                                   message=self.message_id)
+                # start each page from a cold session, like a real request
+                db.session.expunge_all()
+                user_cache.clear()
+
+                with self.client as c:
+                    self.login(c)
+                    with record_queries() as statements:
+                        resp = c.get(path)
+
+                self.assertEqual(resp.status_code, 200, path)
+                self.assertLessEqual(len(statements), budget,
+                                     f"{path} with {authors} authors")
@@ -0,0 +1,102 @@
+"""Schema migration tests."""
+
+from unittest import TestCase
+from models import db, User, Message, Like, Follows, TimelineEntry
+
+from migrations import MIGRATIONS, migrate, pending, schema_migrations
+from search import TRIGRAM_COLUMNS
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+# what the schema looked like before any migration
+BASELINE = [
+    "DROP TABLE timelines",
+    "DROP TABLE message_terms",
+    "ALTER TABLE users DROP COLUMN messages_count, "
+    "DROP COLUMN followers_count, DROP COLUMN following_count, "
+    "DROP COLUMN likes_count, DROP COLUMN updated_at, "
+    "DROP COLUMN profile_updated_at",
+    "ALTER TABLE likes DROP COLUMN created_at",
+    "DROP INDEX ix_messages_user_timestamp",
+    "DROP INDEX ix_follows_following",
+    "DROP INDEX ix_likes_message",
+] + [f"DROP INDEX ix_users_{column}_trgm" for column in TRIGRAM_COLUMNS]
+
+
+class MigrationTestCase(TestCase):
+    """Test that the migrations bring an old database up to models.py."""
+
+    def setUp(self):
+        """Add sample data to a database with the original schema."""
+
+        db.session.commit()
+
+        with db.engine.begin() as connection:
+            for statement in BASELINE:
+                connection.execute(db.text(statement))
+
+            connection.execute(db.text(
+                "INSERT INTO users (id, email, username, password) "
+                "VALUES (1, 'a@test.com', 'a', 'x'), (2, 'b@test.com', 'b', 'x')"))
+            connection.execute(db.text(
+                "INSERT INTO messages (id, text, timestamp, user_id) "
+                "VALUES (1, 'hello world', now(), 1)"))
+            connection.execute(db.text(
+                "INSERT INTO follows VALUES (1, 2)"))
+            connection.execute(db.text(
+                "INSERT INTO likes VALUES (2, 1)"))
+            connection.execute(schema_migrations.delete())
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_migrate(self):
+        """Migrating adds every table, column and index in models.py, and
+        fills in the derived data."""
+
+        applied = []
+        migrate(progress=applied.append)
+
+        self.assertEqual(applied, MIGRATIONS)
+        self.assertEqual(pending(), [])
+
+        inspector = db.inspect(db.engine)
+        for table in db.metadata.sorted_tables:
+            columns = {column['name']
+                       for column in inspector.get_columns(table.name)}
+            indexes = {index['name']
+                       for index in inspector.get_indexes(table.name)}
+
+            self.assertLessEqual({column.name for column in table.columns},
+                                 columns, table.name)
+            self.assertLessEqual({index.name for index in table.indexes},
+                                 indexes, table.name)
+
+        invalid = db.session.execute(db.text(
+            "SELECT count(*) FROM pg_index WHERE NOT indisvalid")).scalar()
+        self.assertEqual(invalid, 0)
+
+        self.assertEqual(TimelineEntry.query.count(), 2)
+        self.assertEqual(User.query.get(1).followers_count, 1)
+        self.assertEqual(User.query.get(2).likes_count, 1)
+        self.assertEqual(Like.query.one().created_at.date(),
+                         User.query.get(1).updated_at.date())
+
+    def test_migrate_again(self):
+        """A second run has nothing to do."""
+
+        migrate()
+
+        applied = []
+        migrate(progress=applied.append)
+        self.assertEqual(applied, [])
@@ -0,0 +1,90 @@
+"""Keyset pagination tests."""
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+from models import db, User, Message
+
+from app import app
+from pagination import paginate_by_time, encode_cursor, decode_cursor
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+
+class PaginationTestCase(TestCase):
+    """Test cursor pagination over messages."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        self.client = app.test_client()
+
+        self.user = User.signup(username="testuser",
+                                email="test@test.com",
+                                password="testuser",
+                                image_url=None)
+        db.session.commit()
+
+        # two messages share a timestamp so the id tiebreak is exercised
+        now = datetime(2020, 1, 1)
+        for i, minutes in enumerate([0, 1, 1, 2, 3]):
+            db.session.add(Message(text=f"msg {i}",
+                                   user_id=self.user.id,
+                                   timestamp=now + timedelta(minutes=minutes)))
+        db.session.commit()
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_cursor_round_trip(self):
+        """A cursor decodes back to the timestamp and id it came from."""
+
+        stamp = datetime(2021, 5, 4, 3, 2, 1, 123456)
+        self.assertEqual(decode_cursor(encode_cursor(stamp, 42)), (stamp, 42))
+
+    def test_pages_cover_everything_once(self):
+        """Walking the cursors visits every message once, newest first."""
+
+        query = Message.query.filter(Message.user_id == self.user.id)
+        seen = []
+        before = None
+
+        while True:
+            items, before = paginate_by_time(
+                query, Message.timestamp, Message.id,
+                before=before, per_page=2)
+            seen.extend(items)
+            if before is None:
+                break
+
+        expected = (query
+                    .order_by(Message.timestamp.desc(), Message.id.desc())
+                    .all())
+        self.assertEqual(seen, expected)
+
+    def test_profile_load_older(self):
+        """The profile page honours the before cursor."""
+
+        newest = (Message.query
+                  .order_by(Message.timestamp.desc(), Message.id.desc())
+                  .first())
+        cursor = encode_cursor(newest.timestamp, newest.id)
+
+        resp = self.client.get(f"/users/{self.user.id}?before={cursor}")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn(b"msg 4", resp.data)
+        self.assertIn(b"msg 3", resp.data)
+
+    def test_bad_cursor(self):
+        """A malformed cursor is a bad request."""
+
+        resp = self.client.get(f"/users/{self.user.id}?before=nonsense")
+
+        self.assertEqual(resp.status_code, 400)
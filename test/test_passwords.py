@@ -0,0 +1,108 @@
+"""Password hashing tests."""
+
+from unittest import TestCase
+from models import db, User, hasher
+
+from config import ProductionConfig
+from passwords import PasswordHasher, PasswordHasherBusy, hash_rounds
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test the hasher on its own."""
+
+    def test_hash_and_check(self):
+        """A hash matches its password and nothing else."""
+
+        inline = PasswordHasher(rounds=4)
+        pw_hash = inline.hash("secret")
+
+        self.assertEqual(hash_rounds(pw_hash), 4)
+        self.assertTrue(inline.check(pw_hash, "secret"))
+        self.assertFalse(inline.check(pw_hash, "not secret"))
+
+    def test_worker_pool(self):
+        """Hashing in worker processes gives the same results."""
+
+        pooled = PasswordHasher(rounds=4, workers=1)
+        try:
+            pw_hash = pooled.hash("secret")
+            self.assertTrue(pooled.check(pw_hash, "secret"))
+        finally:
+            pooled.shutdown()
+
+    def test_full_queue(self):
+        """Past max_pending, calls fail straight away."""
+
+        pooled = PasswordHasher(rounds=4, workers=1, max_pending=1)
+        pooled.slots.acquire()
+
+        with self.assertRaises(PasswordHasherBusy):
+            pooled.hash("secret")
+
+        pooled.slots.release()
+        pooled.shutdown()
+
+    def test_full_inline(self):
+        """max_pending also bounds hashes run inline."""
+
+        inline = PasswordHasher(rounds=4, max_pending=1)
+        inline.slots.acquire()
+
+        with self.assertRaises(PasswordHasherBusy):
+            inline.hash("secret")
+
+        inline.slots.release()
+        self.assertTrue(inline.check(inline.hash("secret"), "secret"))
+
+    def test_production_pool(self):
+        """Production hashes in worker processes."""
+
+        self.assertGreater(ProductionConfig.PASSWORD_HASH_WORKERS, 0)
+
+
+class RehashTestCase(TestCase):
+    """Test that logging in upgrades hashes made at an old cost."""
+
+    def setUp(self):
+        """Add a user hashed at a low cost."""
+
+        self.rounds = hasher.rounds
+        hasher.rounds = 4
+
+        User.signup(username="testuser",
+                    email="test@test.com",
+                    password="password",
+                    image_url=None)
+        db.session.commit()
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        hasher.rounds = self.rounds
+
+        User.query.delete()
+        db.session.commit()
+
+    def test_rehash_on_login(self):
+        """A successful login re-hashes at the configured cost."""
+
+        hasher.rounds = 5
+        user = User.authenticate("testuser", "password")
+        db.session.commit()
+
+        self.assertEqual(hash_rounds(user.password), 5)
+        self.assertTrue(User.authenticate("testuser", "password"))
+
+    def test_no_rehash_on_failure(self):
+        """A wrong password leaves the hash alone."""
+
+        hasher.rounds = 5
+        self.assertFalse(User.authenticate("testuser", "wrong"))
+
+        user = User.query.filter_by(username="testuser").one()
+        self.assertEqual(hash_rounds(user.password), 4)
@@ -0,0 +1,103 @@
+"""Sampling profiler tests."""
+
+import os
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from unittest import TestCase
+from models import db
+
+from app import app, profiler
+from profiler import PROFILE_HEADER, write_flamegraph
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+
+def busy_function(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class ProfilerTestCase(TestCase):
+    """Test choosing, sampling and writing out profiled requests."""
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.directory = tempfile.mkdtemp()
+        self.old_directory = profiler.directory
+        profiler.directory = self.directory
+        profiler.stacks.clear()
+
+    def tearDown(self):
+        profiler.directory = self.old_directory
+        profiler.rate = 0.0
+        shutil.rmtree(self.directory)
+
+    def test_off_by_default(self):
+        """Without a rate or a header, requests aren't profiled."""
+
+        self.client.get("/signup")
+
+        self.assertEqual(profiler.active, {})
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_signed_header(self):
+        """A signed header profiles the request and writes its stacks."""
+
+        # sample at least once, however fast the request is
+        profiler.stacks["waddle.signup"]["app:homepage"] += 1
+
+        resp = self.client.get("/signup",
+                               headers={PROFILE_HEADER: profiler.make_token()})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(profiler.active, {})
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         [f"waddle.signup.{os.getpid()}.collapsed",
+                          f"waddle.signup.{os.getpid()}.svg"])
+
+    def test_bad_header(self):
+        """A header that isn't signed with the app's key is ignored."""
+
+        self.assertFalse(profiler.token_valid("profile"))
+        self.assertFalse(profiler.token_valid(profiler.make_token() + "x"))
+
+        profiler.stacks["waddle.signup"]["app:homepage"] += 1
+        self.client.get("/signup", headers={PROFILE_HEADER: "profile"})
+
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_sample(self):
+        """A sample records the profiled thread's stack under its route."""
+
+        stop = threading.Event()
+        thread = threading.Thread(target=busy_function, args=(stop,))
+        thread.start()
+
+        try:
+            with profiler.lock:
+                profiler.active[thread.ident] = "busy"
+            profiler.sample()
+        finally:
+            with profiler.lock:
+                profiler.active.pop(thread.ident)
+            stop.set()
+            thread.join()
+
+        [stack] = profiler.stacks["busy"]
+        self.assertTrue(stack.endswith(":busy_function"))
+
+    def test_flamegraph(self):
+        path = os.path.join(self.directory, "test.svg")
+        write_flamegraph(path, Counter({"main;view;render": 3,
+                                        "main;view;query": 1}), "test")
+
+        with open(path) as svg:
+            contents = svg.read()
+
+        self.assertIn("(4 samples)", contents)
+        self.assertIn("render (3 samples, 75.0%)", contents)
@@ -0,0 +1,268 @@
+"""Query plan tests: the hot paths in app.py must be served by indexes."""
+
+import re
+from datetime import datetime, timedelta
+from random import Random
+from unittest import TestCase
+from sqlalchemy import event
+from models import db, User, Message, Like, Follows, TimelineEntry
+
+from app import app, CURR_USER_KEY, user_cache
+from pagination import PAGE_SIZE
+from search import reindex_messages, search_messages
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+USERS = 300
+MESSAGES_PER_USER = 10
+
+# lookups by the second column of a primary key, and the index that must
+# serve them: Postgres 18 can skip scan the primary key instead, which
+# hides a missing index from `seq_scans`
+LOOKUP_INDEXES = {
+    ('follows', 'user_following_id'): 'ix_follows_following',
+    ('likes', 'message_id'): 'ix_likes_message',
+}
+
+# the first column an Index Cond tests, e.g. "(user_following_id = 5)"
+COND_COLUMN_RE = re.compile(r"^\(*(?:\w+\.)?(\w+) ")
+
+
+def seq_scans(plan):
+    """Tables read end to end anywhere in an EXPLAIN plan.
+
+    That's a sequential scan, or an index scan with no condition that
+    filters every row instead, which is what the planner falls back to
+    when sequential scans are off and the index doesn't fit the query.
+    """
+
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan['Relation Name'])
+    elif (plan.get('Node Type') in ('Index Scan', 'Index Only Scan')
+          and 'Index Cond' not in plan and 'Filter' in plan):
+        found.append(f"{plan['Relation Name']} ({plan['Index Name']})")
+    for child in plan.get('Plans', []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def plan_nodes(plan):
+    """Every node of an EXPLAIN plan, depth first."""
+
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def index_scans(plan):
+    """(index name, first column of its condition) for every index read
+    anywhere in an EXPLAIN plan, bitmap scans included."""
+
+    found = []
+    if 'Index Name' in plan and 'Index Cond' in plan:
+        column = COND_COLUMN_RE.match(plan['Index Cond'])
+        found.append((plan['Index Name'], column and column.group(1)))
+    for child in plan.get('Plans', []):
+        found.extend(index_scans(child))
+    return found
+
+
+class QueryPlanTestCase(TestCase):
+    """EXPLAIN every statement the busiest routes run.
+
+    Sequential scans are disabled for the EXPLAIN, so the planner only
+    picks one where no index can answer the query: on a small test
+    database a scan can be cheapest, but it would not stay so in
+    production.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """Seed users who post, follow and like."""
+
+        rng = Random(1)
+        start = datetime(2020, 1, 1)
+
+        users = [User(username=f"user{i}",
+                      email=f"user{i}@test.com",
+                      password="not-a-real-hash",
+                      location="Anywhere",
+                      bio=f"bio of user {i}")
+                 for i in range(USERS)]
+        db.session.add_all(users)
+        db.session.flush()
+        cls.user_ids = [user.id for user in users]
+
+        db.session.add_all(
+            Message(text=f"message {i} from {user.username}",
+                    user_id=user.id,
+                    timestamp=start + timedelta(minutes=rng.randrange(10**5)))
+            for user in users for i in range(MESSAGES_PER_USER))
+        db.session.flush()
+        cls.message_ids = [message_id for (message_id,)
+                           in db.session.query(Message.id)]
+
+        db.session.add_all(
+            Follows(user_being_followed_id=followed,
+                    user_following_id=user_id)
+            for user_id in cls.user_ids
+            for followed in rng.sample(cls.user_ids, 20)
+            if followed != user_id)
+        db.session.add_all(
+            Like(user_id=user_id, message_id=message_id)
+            for user_id in cls.user_ids
+            for message_id in rng.sample(cls.message_ids, 20))
+        db.session.flush()
+
+        TimelineEntry.backfill()
+        User.repair_counts()
+        reindex_messages()
+        db.session.commit()
+        db.session.execute(db.text("ANALYZE"))
+
+    @classmethod
+    def tearDownClass(cls):
+        """Clear sample data."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def setUp(self):
+        db.session.expunge_all()
+        user_cache.clear()
+
+        self.client = app.test_client()
+        self.viewer_id, self.other_id = self.user_ids[:2]
+
+        viewer_follows = {followed for (followed,) in db.session
+                          .query(Follows.user_being_followed_id)
+                          .filter(Follows.user_following_id == self.viewer_id)}
+        self.followed_id = min(viewer_follows)
+        self.unfollowed_id = min(set(self.user_ids[2:]) - viewer_follows)
+        self.own_message_id = (db.session.query(Message.id)
+                               .filter(Message.user_id == self.viewer_id)
+                               .first()[0])
+
+    def run_routes(self, client):
+        """Request each hot route once."""
+
+        message_id = self.message_ids[0]
+        before = "20991231000000000000-0"
+
+        client.get("/")
+        client.get(f"/?before={before}")
+        client.get(f"/users/{self.other_id}")
+        client.get(f"/users/{self.other_id}?before={before}")
+        client.get("/users")
+        client.get("/users?after=user1")
+        client.get("/users?q=user")
+        client.get(f"/users/{self.other_id}/following")
+        client.get(f"/users/{self.other_id}/followers")
+        client.get(f"/users/{self.other_id}/likes")
+        client.get(f"/messages/{message_id}")
+        client.get("/messages/search?q=message")
+
+        client.post("/messages/likes", json={"message_ids": [message_id]})
+        client.delete("/messages/likes", json={"message_ids": [message_id]})
+        client.post(f"/users/follow/{self.unfollowed_id}")
+        client.post(f"/users/stop-following/{self.followed_id}")
+        client.post("/messages/new", data={"text": "a new message"})
+        client.post(f"/messages/{self.own_message_id}/delete")
+
+    def test_no_sequential_scans(self):
+        """Each statement reads a range of an index, not a whole table."""
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and statement.split(None, 1)[0] in (
+                    'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+                statements.append((statement, parameters))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                self.run_routes(c)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertGreater(len(statements), 30)
+
+        connection = db.session.connection()
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        index_tables = dict(connection.exec_driver_sql(
+            "SELECT indexrelid::regclass::text, indrelid::regclass::text "
+            "FROM pg_index").all())
+
+        failures = []
+        looked_up = set()
+        for statement, parameters in statements:
+            plan = connection.exec_driver_sql(
+                "EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+            scanned = seq_scans(plan[0]['Plan'])
+            if scanned:
+                failures.append(f"{', '.join(scanned)}: {statement}")
+
+            for index, column in index_scans(plan[0]['Plan']):
+                lookup = (index_tables[index], column)
+                if lookup in LOOKUP_INDEXES:
+                    looked_up.add(lookup)
+                    if index != LOOKUP_INDEXES[lookup]:
+                        failures.append(f"{lookup} read with {index}, not "
+                                        f"{LOOKUP_INDEXES[lookup]}: {statement}")
+
+        db.session.rollback()
+
+        self.assertFalse(failures, "\n\n".join(failures))
+        self.assertEqual(looked_up, set(LOOKUP_INDEXES))
+
+    def test_search_reads_a_page(self):
+        """Searching for a word in every message reads about a page of the
+        word's index entries, newest first, and sorts nothing."""
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if 'message_terms' in statement:
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            page = search_messages("message")
+            search_messages("message", before=page.next_cursor)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(len(page.items), PAGE_SIZE)
+        self.assertEqual(len(statements), 2)
+
+        connection = db.session.connection()
+        for statement, parameters in statements:
+            plan = connection.exec_driver_sql(
+                "EXPLAIN (ANALYZE, FORMAT JSON) " + statement,
+                parameters).scalar()
+            nodes = list(plan_nodes(plan[0]['Plan']))
+
+            self.assertNotIn('Sort', [node['Node Type'] for node in nodes])
+            scans = [node for node in nodes
+                     if node.get('Relation Name') == 'message_terms']
+            self.assertEqual([scan['Index Name'] for scan in scans],
+                             ['ix_message_terms_term_timestamp'])
+            self.assertLessEqual(scans[0]['Actual Rows'], PAGE_SIZE + 1)
+
+        db.session.rollback()
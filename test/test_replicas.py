@@ -0,0 +1,149 @@
+"""Read replica routing tests.
+
+waddle-test-replica stands in for a replica of waddle-test (see
+test/__init__.py). Nothing copies rows between them, so each test puts
+what the replica should have there itself, and rows only on one side
+show which database a page was read from.
+"""
+
+import time
+from unittest import TestCase
+from models import db, User, Message, Like, Follows, TimelineEntry, hasher
+
+from app import (app, CURR_USER_KEY, replica_router, user_cache,
+                 fragment_cache)
+from replicas import STICKY_KEY
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+replica = db.engines['replica_0']
+db.metadata.create_all(replica)
+
+# Don't have WTForms use CSRF
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+TABLES = [TimelineEntry, Like, Message, Follows, User]
+
+
+def replicate(*models):
+    """Copy the primary's rows of `models` to the replica."""
+
+    with replica.begin() as connection:
+        for model in models:
+            rows = [dict(row._mapping) for row in
+                    db.session.execute(db.select(model.__table__))]
+            if rows:
+                connection.execute(model.__table__.insert(), rows)
+
+
+class ReplicaTestCase(TestCase):
+    """Test which database requests read from."""
+
+    def setUp(self):
+        """Create test client, add sample data to both databases."""
+
+        db.session.expunge_all()
+        user_cache.clear()
+        fragment_cache.clear()
+        replica_router.lags.clear()
+        app.config['REPLICA_READS'] = True
+
+        self.client = app.test_client()
+
+        self.user = User(username="writer",
+                         email="writer@test.com",
+                         password=hasher.hash("password"))
+        db.session.add(self.user)
+        db.session.commit()
+        self.user_id = self.user.id
+
+        replicate(User)
+
+        with replica.begin() as connection:
+            connection.execute(User.__table__.insert().values(
+                id=self.user_id + 1000, username="only_on_replica",
+                email="replica@test.com", password="not-a-real-hash"))
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        app.config['REPLICA_READS'] = False
+        replica_router.__dict__.pop('measure_lag', None)
+
+        for model in TABLES:
+            model.query.delete()
+        db.session.commit()
+
+        with replica.begin() as connection:
+            for model in TABLES:
+                connection.execute(model.__table__.delete())
+
+    def login(self, client):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def test_get_reads_replica(self):
+        replica_reads = replica_router.stats()['replica']
+
+        html = self.client.get("/users").get_data(as_text=True)
+
+        self.assertIn("only_on_replica", html)
+        self.assertEqual(replica_router.stats()['replica'], replica_reads + 1)
+
+    def test_post_reads_primary(self):
+        """Logging in reads the primary, and never the replica."""
+
+        User.query.get(self.user_id).username = "renamed"
+        db.session.commit()
+
+        resp = self.client.post("/login", data=dict(username="renamed",
+                                                    password="password"))
+
+        self.assertEqual(resp.status_code, 302)
+
+    def test_read_your_writes(self):
+        """After a write, the writer reads the primary until the sticky
+        window ends."""
+
+        with self.client as c:
+            self.login(c)
+            c.post("/messages/new", data={"text": "fresh off the primary"})
+
+            self.assertEqual(Message.query.count(), 1)
+            with c.session_transaction() as sess:
+                self.assertGreater(sess[STICKY_KEY], time.time())
+
+            page = c.get(f"/users/{self.user_id}").get_data(as_text=True)
+            self.assertIn("fresh off the primary", page)
+
+            # the replica hasn't caught up once the window has passed
+            with c.session_transaction() as sess:
+                sess[STICKY_KEY] = time.time() - 1
+
+            page = c.get(f"/users/{self.user_id}").get_data(as_text=True)
+            self.assertNotIn("fresh off the primary", page)
+
+    def test_lagging_replica(self):
+        """A replica too far behind, or down, isn't read."""
+
+        for measure_lag in [lambda engine: replica_router.max_lag + 1,
+                            lambda engine: 1 / 0]:
+            replica_router.lags.clear()
+            replica_router.measure_lag = measure_lag
+
+            html = self.client.get("/users").get_data(as_text=True)
+            self.assertNotIn("only_on_replica", html)
+
+    def test_lag(self):
+        """A database that isn't a standby has no lag; checks are reused
+        for REPLICA_LAG_CHECK_SECONDS."""
+
+        with app.test_request_context():
+            self.assertEqual(replica_router.lag('replica_0'), 0)
+
+            replica_router.measure_lag = lambda engine: 1 / 0
+            self.assertEqual(replica_router.lag('replica_0'), 0)
@@ -0,0 +1,123 @@
+"""User search and directory tests."""
+
+from unittest import TestCase
+from models import db, User, UserCard
+
+from app import app
+from search import search_users
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+
+class UserSearchTestCase(TestCase):
+    """Test ranked, paginated user search and the user directory."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        self.client = app.test_client()
+
+        for username, location, bio in [
+            ("penguin", "Antarctica", None),
+            ("penguinfan", None, None),
+            ("kingpenguin", None, None),
+            ("walrus", "Penguin Island", None),
+            ("seal", None, "friends with a penguin"),
+            ("gull", "Oakland", "likes fish"),
+            ("under_score", None, None),
+        ]:
+            db.session.add(User(username=username,
+                                email=f"{username}@test.com",
+                                password="password",
+                                location=location,
+                                bio=bio))
+        db.session.commit()
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        User.query.delete()
+        db.session.commit()
+
+    def test_ranking(self):
+        """Exact, prefix and substring usernames beat location and bio."""
+
+        users, next_cursor = search_users("Penguin")
+
+        self.assertEqual([u.username for u in users],
+                         ["penguin", "penguinfan", "kingpenguin",
+                          "walrus", "seal"])
+        self.assertIsNone(next_cursor)
+
+    def test_pages(self):
+        """Following the cursor returns the rest of the results once."""
+
+        first, cursor = search_users("penguin", per_page=2)
+        second, cursor = search_users("penguin", after=cursor, per_page=2)
+        third, cursor = search_users("penguin", after=cursor, per_page=2)
+
+        self.assertEqual([u.username for u in first + second + third],
+                         ["penguin", "penguinfan", "kingpenguin",
+                          "walrus", "seal"])
+        self.assertIsNone(cursor)
+
+    def test_wildcards_are_literal(self):
+        """LIKE wildcards in the search term only match themselves."""
+
+        users, _ = search_users("_")
+
+        self.assertEqual([u.username for u in users], ["under_score"])
+
+    def test_search_view(self):
+        """The users page shows ranked search results."""
+
+        resp = self.client.get("/users?q=oakland")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"@gull", resp.data)
+        self.assertNotIn(b"@penguin", resp.data)
+
+    def test_trigram_indexes(self):
+        """create_all builds the trigram indexes on Postgres."""
+
+        index_names = {name for (name,) in db.session.execute(db.text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'users'"))}
+
+        self.assertIn("ix_users_username_trgm", index_names)
+        self.assertIn("ix_users_bio_trgm", index_names)
+
+    def test_directory_pages(self):
+        """The directory walks every user once in username order."""
+
+        usernames = []
+        cursor = None
+
+        while True:
+            cards, cursor = UserCard.directory(after=cursor, per_page=3)
+            usernames.extend(card.username for card in cards)
+            if cursor is None:
+                break
+
+        self.assertEqual(usernames,
+                         sorted(u.username for u in User.query.all()))
+
+    def test_directory_view(self):
+        """The users page links to the next page of the directory."""
+
+        resp = self.client.get("/users?after=penguin")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"@penguinfan", resp.data)
+        self.assertNotIn(b"@kingpenguin", resp.data)
+
+    def test_cards_are_not_entities(self):
+        """Cards carry only the columns a card shows."""
+
+        cards, _ = UserCard.directory()
+
+        self.assertIsInstance(cards[0], UserCard)
+        self.assertFalse(hasattr(cards[0], "password"))
+        self.assertFalse(hasattr(cards[0], "__dict__"))
@@ -0,0 +1,153 @@
+"""Home timeline tests."""
+
+from unittest import TestCase
+from models import db, User, Message, Follows, TimelineEntry
+
+from app import app, CURR_USER_KEY
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineTestCase(TestCase):
+    """Test that timelines follow posts, follows and deletes."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        self.client = app.test_client()
+
+        self.poster = User.signup(username="poster",
+                                  email="poster@test.com",
+                                  password="password",
+                                  image_url=None)
+        self.reader = User.signup(username="reader",
+                                  email="reader@test.com",
+                                  password="password",
+                                  image_url=None)
+        db.session.commit()
+
+        db.session.add(Follows(user_being_followed_id=self.poster.id,
+                               user_following_id=self.reader.id))
+        db.session.commit()
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        TimelineEntry.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def timeline_ids(self, user_id):
+        return [entry.message_id for entry in
+                TimelineEntry.query.filter_by(user_id=user_id)]
+
+    def post_as(self, client, user, text):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user.id
+
+        client.post("/messages/new", data={"text": text})
+        return Message.query.filter_by(text=text).one()
+
+    def test_post_fans_out(self):
+        """Posting adds the message to the author's and followers' feeds."""
+
+        with self.client as c:
+            msg = self.post_as(c, self.poster, "hello followers")
+
+        self.assertEqual(self.timeline_ids(self.poster.id), [msg.id])
+        self.assertEqual(self.timeline_ids(self.reader.id), [msg.id])
+
+    def test_home_reads_timeline(self):
+        """The home feed shows fanned-out messages from followed users."""
+
+        with self.client as c:
+            self.post_as(c, self.poster, "hello followers")
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.reader.id
+
+            resp = c.get("/")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(b"hello followers", resp.data)
+
+    def test_unfollow_trims(self):
+        """Unfollowing removes that author's messages from the feed."""
+
+        with self.client as c:
+            msg = self.post_as(c, self.poster, "hello followers")
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.reader.id
+
+            c.post(f"/users/stop-following/{self.poster.id}")
+
+        self.assertEqual(self.timeline_ids(self.reader.id), [])
+        self.assertEqual(self.timeline_ids(self.poster.id), [msg.id])
+
+    def test_self_follow(self):
+        """Users can't follow themselves, and one who did before keeps
+        their own messages when they unfollow."""
+
+        with self.client as c:
+            msg = self.post_as(c, self.reader, "my own message")
+
+            resp = c.post(f"/users/follow/{self.reader.id}")
+            self.assertEqual(resp.status_code, 302)
+            self.assertIsNone(Follows.query.get((self.reader.id,
+                                                 self.reader.id)))
+
+            db.session.add(Follows(user_being_followed_id=self.reader.id,
+                                   user_following_id=self.reader.id))
+            db.session.commit()
+
+            c.post(f"/users/stop-following/{self.reader.id}")
+            self.assertIn(msg.id, self.timeline_ids(self.reader.id))
+
+            resp = c.get("/users")
+            self.assertNotIn(f'action="/users/follow/{self.reader.id}"'.encode(),
+                             resp.data)
+
+    def test_follow_adds_history(self):
+        """Following someone brings their earlier messages into the feed."""
+
+        with self.client as c:
+            msg = self.post_as(c, self.reader, "posted before the follow")
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.poster.id
+
+            c.post(f"/users/follow/{self.reader.id}")
+
+        self.assertEqual(self.timeline_ids(self.poster.id), [msg.id])
+
+    def test_delete_trims(self):
+        """Deleting a message removes it from every timeline."""
+
+        with self.client as c:
+            msg = self.post_as(c, self.poster, "hello followers")
+            c.post(f"/messages/{msg.id}/delete")
+
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_backfill(self):
+        """Backfill builds timelines from existing follows and messages."""
+
+        msg = Message(text="seeded", user_id=self.poster.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        TimelineEntry.backfill()
+        db.session.commit()
+
+        self.assertEqual(self.timeline_ids(self.poster.id), [msg.id])
+        self.assertEqual(self.timeline_ids(self.reader.id), [msg.id])
@@ -0,0 +1,104 @@
+"""Current-user cache tests."""
+
+from unittest import TestCase
+from sqlalchemy import event
+from models import db, User
+
+from app import app, CURR_USER_KEY, user_cache
+
+# create tables once for all tests
+# in each test we delete the data and create new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class UserCacheTestCase(TestCase):
+    """Test that add_user_to_g reuses cached users and forgets them."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        self.client = app.test_client()
+        user_cache.clear()
+
+        self.user = User.signup(username="testuser",
+                                email="test@test.com",
+                                password="testuser",
+                                image_url=None)
+        db.session.commit()
+        self.user_id = self.user.id
+
+        # start from an empty identity map, as a new request would
+        db.session.expunge_all()
+
+        self.statements = []
+        event.listen(db.engine, "before_cursor_execute", self.record)
+
+    def tearDown(self):
+        """Clear sample data after each test."""
+
+        event.remove(db.engine, "before_cursor_execute", self.record)
+        user_cache.clear()
+
+        User.query.delete()
+        db.session.commit()
+
+    def record(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def login(self, client):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def test_second_request_is_cached(self):
+        """Only the first request for a user queries for them."""
+
+        with self.client as c:
+            self.login(c)
+
+            c.get("/messages/new")
+            self.assertEqual(len(self.statements), 1)
+
+            del self.statements[:]
+            resp = c.get("/messages/new")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.statements, [])
+
+    def test_anonymous_requests_skip_lookup(self):
+        """Logged-out requests never query for a user."""
+
+        resp = self.client.get("/login")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.statements, [])
+
+    def test_logout_invalidates(self):
+        """Logging out drops the cached user."""
+
+        with self.client as c:
+            self.login(c)
+            c.get("/messages/new")
+            self.assertIn(self.user_id, user_cache.entries)
+
+            c.get("/logout")
+
+        self.assertNotIn(self.user_id, user_cache.entries)
+
+    def test_profile_edit_invalidates(self):
+        """Profile changes show up on the next request."""
+
+        with self.client as c:
+            self.login(c)
+            c.get("/messages/new")
+
+            c.post("/users/profile", data={"username": "renamed",
+                                           "email": "test@test.com",
+                                           "password": "testuser"})
+            resp = c.get("/messages/new")
+
+        self.assertIn(b'alt="renamed"', resp.data)
@@ -108,6 +108,14 @@ class UserModelTestCase(TestCase):
         self.assertEqual(User.is_followed_by(
             test_query_two, test_query_one), False)
 
+    def test_following_ids(self):
+        """Testing that following_ids returns the ids user2 follows."""
+        test_query_one = User.query.get_or_404(1)
+        test_query_two = User.query.get_or_404(2)
+
+        self.assertEqual(test_query_two.following_ids(), {1})
+        self.assertEqual(test_query_one.following_ids(), set())
+
     def test_user_creation_method(self):
         """Testing if a created user is added to db"""
         user_count = User.query.count()
@@ -87,6 +87,19 @@ class UserViewTestCase(TestCase):
             self.assertIn('<h3 class="following-header">Following</h3>',
                           resp.data.decode('utf-8'))
 
+    def test_users_index_follow_state(self):
+        """Test that the user list shows Unfollow only for followed users,
+        and no button on the viewer's own card."""
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user.id
+            resp = client.get('/users')
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('action="/users/stop-following/2"', html)
+            self.assertNotIn(f'/users/follow/{self.user.id}"', html)
+
     def test_logged_out_visiting(self):
         """Test to see if you are prevented from viewing a user's
         follower/following page if you are not logged in"""
@@ -0,0 +1,80 @@
+"""Per-worker cache of logged-in users for the add_user_to_g hook."""
+
+import time
+from threading import Lock
+
+from sqlalchemy.orm import defer, make_transient_to_detached
+
+from models import db, User
+
+CACHED_COLUMNS = [column.key for column in User.__table__.columns
+                  if column.key != 'password']
+
+
+class UserCache:
+    """Keep recently seen users for `ttl` seconds, up to `max_size` of them.
+
+    The cache holds detached copies of users, never the instances in a
+    session. `load` merges the cached copy into the current session
+    without a query (`load=False`), so the hook that runs on every
+    request usually costs no SQL at all.
+
+    Each worker has its own cache, so a change made through another
+    worker is only seen here once the entry expires. Routes that change
+    the current user's row call `invalidate` so the change shows up on
+    their next request.
+    """
+
+    def __init__(self, ttl=30, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = {}
+        self.lock = Lock()
+
+    def init_app(self, app):
+        app.extensions['user_cache'] = self
+        self.ttl = app.config.setdefault('USER_CACHE_TTL', self.ttl)
+
+    def load(self, user_id):
+        """Return the user with `user_id`, attached to the current session.
+
+        Returns None if there is no such user.
+        """
+
+        with self.lock:
+            entry = self.entries.get(user_id)
+
+        if entry and entry[0] > time.monotonic():
+            return db.session.merge(entry[1], load=False)
+
+        # the password hash is only needed to log in or change it
+        user = User.query.options(defer(User.password)).get(user_id)
+
+        if user is None:
+            self.invalidate(user_id)
+            return None
+
+        # a detached copy with the same identity; the password column is
+        # left out, so it is expired and loads on first access
+        snapshot = User(**{name: getattr(user, name)
+                           for name in CACHED_COLUMNS})
+        make_transient_to_detached(snapshot)
+
+        with self.lock:
+            if len(self.entries) >= self.max_size:
+                self.entries.pop(next(iter(self.entries)))
+            self.entries[user_id] = (time.monotonic() + self.ttl, snapshot)
+
+        return user
+
+    def invalidate(self, user_id):
+        """Drop a user so their next request reloads them."""
+
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        """Drop every cached user."""
+
+        with self.lock:
+            self.entries.clear()